@@ -1,604 +1,4969 @@
-import gradio as gr
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import io
 import os
 import base64
 import re
-from PIL import Image, ImageEnhance, ImageFilter
+import hashlib
+import sqlite3
+import gzip
+import zlib
+import unicodedata
+import random
+import math
+import sys
+import atexit
+import socket
+import signal
+import multiprocessing
+import importlib
+import importlib.util
+import functools
+import abc
+from urllib.parse import urlsplit
+from collections import OrderedDict, deque
 import time
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify, Response, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
 import threading
-import cv2
-import numpy as np
+import queue
+import contextlib
+import contextvars
+import asyncio
+import cProfile
+import pstats
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
+
+
+class LazyModule:
+    """module ที่ import เมื่อใช้งานครั้งแรก (ลดเวลา cold start ของโหมด API)
+    
+    เมื่อโหลดแล้วจะแทนชื่อ global ของ module นี้ด้วย module จริง การใช้ครั้งถัดไปจึงไม่ผ่าน proxy
+    """
+
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+
+    def _load(self):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+def optional_module(name, alias):
+    """LazyModule ถ้าติดตั้งไว้ หรือ None (dependency เสริม)"""
+    return LazyModule(name, alias) if importlib.util.find_spec(name) is not None else None
+
+
+# OpenCV / NumPy / PIL โหลดเมื่อมีงานภาพครั้งแรก
+cv2 = LazyModule("cv2", "cv2")
+np = LazyModule("numpy", "np")
+Image = LazyModule("PIL.Image", "Image")
+
+# OCR แบบ offline เป็นตัวเลือกเสริม
+pytesseract = optional_module("pytesseract", "pytesseract")
+
+# ใช้เฉพาะ SERVER_MODE=async
+aiohttp = optional_module("aiohttp", "aiohttp")
+
+# บีบอัด response แบบ br (ถ้าไม่มีใช้ gzip)
+brotli = optional_module("brotli", "brotli")
+web = LazyModule("aiohttp.web", "web") if aiohttp is not None else None
+
+# โหมดของแอป: full (Gradio UI + API) หรือ api (API อย่างเดียว ไม่ import Gradio เริ่มได้เร็ว)
+APP_MODE = os.environ.get("APP_MODE", "full")
+# อุ่นเครื่องก่อนเปิด port: โหลด OpenCV/NumPy, เปิดฐานข้อมูลแคช และ connection ไปยัง provider
+WARMUP = os.environ.get("WARMUP", "0").lower() in ("1", "true", "yes")
 
 # ตั้งค่า port
 PORT = int(os.environ.get("PORT", 7860))
 
-class ProfessionalTranslationApp:
-    def __init__(self):
-        # หลาย API keys สำหรับ fallback
-        self.ocr_api_keys = [
-            "K89947895888957",  # OCR.space
-            "helloworld",       # ฟรี
-        ]
-        self.current_ocr_key_index = 0
+# จำนวน worker process ของ API (pre-fork ใช้ port เดียวกัน) และ process pool สำหรับ pipeline ภาพ (0 = ใช้ thread)
+WORKERS = max(1, int(os.environ.get("WORKERS", 1)))
+CPU_PROCESSES = int(os.environ.get("CPU_PROCESSES", 0))
+PREFORK = WORKERS > 1 and hasattr(os, 'fork')
+# process ที่มี OCRKeyScheduler ของตัวเอง (โหมด full มี process ของ Gradio เพิ่มอีก 1) แบ่งโควตา key เท่าๆ กัน
+OCR_KEY_SHARES = WORKERS + (APP_MODE == 'full') if PREFORK else 1
+
+# ตั้งค่าแคชผล OCR (ตั้ง OCR_CACHE_DB เพื่อเก็บลงดิสก์ให้อยู่รอดหลังรีสตาร์ท)
+# หลาย worker ใช้ SQLite เป็นค่าเริ่มต้นเพื่อให้ทุก worker เห็นแคชเดียวกัน
+OCR_CACHE_SIZE = int(os.environ.get("OCR_CACHE_SIZE", 256))
+OCR_CACHE_TTL = int(os.environ.get("OCR_CACHE_TTL", 7 * 24 * 3600))
+OCR_CACHE_DB = os.environ.get("OCR_CACHE_DB", os.path.join("cache", "ocr_cache.db") if WORKERS > 1 else "")
+OCR_CACHE_MAX_DISK_ENTRIES = int(os.environ.get("OCR_CACHE_MAX_DISK_ENTRIES", 20000))
+
+# ดัชนี perceptual hash (ไม่บังคับ, PHASH_MAX_DISTANCE > 0 = เปิด): ภาพเดียวกันที่ถูกบีบอัดซ้ำ/ย่อใช้ผล OCR เดิม
+# ผู้สมัครต้องมีสัดส่วนภาพเท่ากันและผ่านการเทียบภาพย่อ 512px ทีละช่อง (ต่างเกิน PHASH_DETAIL_TOLERANCE = คนละหน้า)
+PHASH_MAX_DISTANCE = int(os.environ.get("PHASH_MAX_DISTANCE", 0))
+PHASH_DETAIL_TOLERANCE = float(os.environ.get("PHASH_DETAIL_TOLERANCE", 8))
+PHASH_DB = os.environ.get("PHASH_DB", OCR_CACHE_DB)
+# ชี้ไปยังผลในแคช OCR จึงไม่ต้องเก็บมากกว่าแคชบนดิสก์ (ภาพย่อประมาณ 25 KB ต่อรายการ)
+PHASH_MAX_ENTRIES = int(os.environ.get("PHASH_MAX_ENTRIES", OCR_CACHE_MAX_DISK_ENTRIES))
+
+# ตั้งค่า translation memory (เก็บคำแปลซ้ำลงดิสก์เป็นค่าเริ่มต้น)
+TRANSLATION_MEMORY_SIZE = int(os.environ.get("TRANSLATION_MEMORY_SIZE", 4096))
+TRANSLATION_MEMORY_TTL = int(os.environ.get("TRANSLATION_MEMORY_TTL", 30 * 24 * 3600))
+TRANSLATION_MEMORY_DB = os.environ.get("TRANSLATION_MEMORY_DB", os.path.join("cache", "translation_memory.db"))
+TRANSLATION_MEMORY_MAX_DISK_ENTRIES = int(os.environ.get("TRANSLATION_MEMORY_MAX_DISK_ENTRIES", 500000))
+
+# โหมดเรียก API แปลภาษา: sequential (ทีละตัว) หรือ concurrent (ยิงพร้อมกันแบบ hedged)
+TRANSLATION_MODE = os.environ.get("TRANSLATION_MODE", "sequential")
+TRANSLATION_WORKERS = int(os.environ.get("TRANSLATION_WORKERS", 16))
+# เวลารอ MyMemory ก่อนยอมใช้ผลจาก LibreTranslate (ปรับตาม latency จริงภายในช่วงนี้)
+TRANSLATION_HEDGE_MIN = float(os.environ.get("TRANSLATION_HEDGE_MIN", 0.5))
+TRANSLATION_HEDGE_MAX = float(os.environ.get("TRANSLATION_HEDGE_MAX", 3.0))
+
+# URL ของ provider (ชี้ไปที่ stand-in ใน benchmarks/standins.py ได้)
+OCR_SPACE_URL = os.environ.get("OCR_SPACE_URL", "https://api.ocr.space/parse/image")
+MYMEMORY_URL = os.environ.get("MYMEMORY_URL", "https://api.mymemory.translated.net/get")
+LIBRETRANSLATE_URL = os.environ.get("LIBRETRANSLATE_URL", "https://libretranslate.de/translate")
+
+# OCR.space keys และโควตาต่อ key: "key:ต่อนาที:ต่อวัน,..." (0 = ไม่จำกัด, รายการที่อ่านไม่ได้จะถูกข้าม)
+OCR_API_KEYS = os.environ.get("OCR_API_KEYS", "K89947895888957:60:0,helloworld:10:0")
+# เวลาพัก key หลังโดน rate limit / IsErroredOnProcessing (เพิ่มเป็นสองเท่าเมื่อเกิดซ้ำ)
+OCR_KEY_COOLDOWN = float(os.environ.get("OCR_KEY_COOLDOWN", 30))
+OCR_KEY_MAX_COOLDOWN = float(os.environ.get("OCR_KEY_MAX_COOLDOWN", 600))
+OCR_RATE_LIMIT_STATUS = (403, 429)
+# status ที่ retry ด้วย key เดิม (rate limit จะสลับ key แทน)
+OCR_RETRY_STATUS = (500, 502, 503, 504)
+
+# ตั้งค่า HTTP client (connection pool, retry, circuit breaker)
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 32))
+HTTP_BACKOFF_BASE = float(os.environ.get("HTTP_BACKOFF_BASE", 0.5))
+HTTP_BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", 4.0))
+HTTP_WARM_TIMEOUT = float(os.environ.get("HTTP_WARM_TIMEOUT", 5))
+OCR_MAX_RETRIES = int(os.environ.get("OCR_MAX_RETRIES", 1))
+OCR_KEY_ATTEMPTS = int(os.environ.get("OCR_KEY_ATTEMPTS", 2))
+TRANSLATION_MAX_RETRIES = int(os.environ.get("TRANSLATION_MAX_RETRIES", 0))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", 30))
+
+# โฟลเดอร์ glossary ภายนอก (ชื่อตัวละคร/คำเรียกต่อเรื่อง) โหลดใหม่อัตโนมัติเมื่อไฟล์เปลี่ยน
+GLOSSARY_DIR = os.environ.get("GLOSSARY_DIR", "glossaries")
+GLOSSARY_RELOAD_INTERVAL = float(os.environ.get("GLOSSARY_RELOAD_INTERVAL", 5))
+
+# ตั้งค่าการเตรียมภาพก่อน OCR
+OCR_MAX_SIDE = int(os.environ.get("OCR_MAX_SIDE", 1200))
+PNG_COMPRESSION = int(os.environ.get("PNG_COMPRESSION", 1))
+OCR_MAX_UPLOAD_BYTES = int(os.environ.get("OCR_MAX_UPLOAD_BYTES", 1024 * 1024))
+
+# ส่งเฉพาะบริเวณข้อความ (speech bubble) เป็น mosaic: off / manga / all (ไม่บังคับ)
+# ตัวตรวจหาเฉพาะตัวอักษรสีเข้มบนพื้นสว่าง ข้อความสีขาวบนพื้นเข้ม (SFX/กล่องบรรยายสีดำ) จะหายจากผล OCR
+OCR_REGIONS = os.environ.get("OCR_REGIONS", "off")
+OCR_REGION_PADDING = int(os.environ.get("OCR_REGION_PADDING", 12))
+OCR_MOSAIC_GAP = int(os.environ.get("OCR_MOSAIC_GAP", 24))
+# ถ้า region ครอบคลุมเกินสัดส่วนนี้ของหน้า หรือมีมากเกินไป ส่งทั้งหน้าแทน
+OCR_REGION_MAX_COVERAGE = float(os.environ.get("OCR_REGION_MAX_COVERAGE", 0.6))
+OCR_REGION_MAX_COUNT = int(os.environ.get("OCR_REGION_MAX_COUNT", 32))
+
+# ภาพที่ยาวกว่ากว้างเกิน OCR_TILE_ASPECT เท่า (เช่นเว็บตูน) ตัดเป็น tile ความละเอียดเดิมแทนการย่อ (0 = ปิด)
+OCR_TILE_ASPECT = float(os.environ.get("OCR_TILE_ASPECT", 3))
+OCR_TILE_LENGTH = int(os.environ.get("OCR_TILE_LENGTH", 1200))
+OCR_TILE_OVERLAP = int(os.environ.get("OCR_TILE_OVERLAP", 160))
+OCR_TILE_MAX = int(os.environ.get("OCR_TILE_MAX", 24))
+
+# ภาพขาเข้า: ปฏิเสธภาพที่มี pixel เกินนี้จาก header ก่อน decode (0 = ไม่จำกัด)
+IMAGE_MAX_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", 90000000))
+# ดาวน์โหลดภาพจาก URL แบบ stream: ขนาดสูงสุด, timeout และ HTTP cache บนดิสก์ (IMAGE_CACHE_DIR ว่าง = ปิด)
+IMAGE_FETCH_MAX_BYTES = int(os.environ.get("IMAGE_FETCH_MAX_BYTES", 20 * 1024 * 1024))
+IMAGE_FETCH_TIMEOUT = float(os.environ.get("IMAGE_FETCH_TIMEOUT", 15))
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", os.path.join("cache", "images"))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+# ข้อความ error เมื่อ OCR ทำงานปกติแต่ไม่พบข้อความ (ไม่ถือว่า engine ล้มเหลว)
+OCR_NO_TEXT_ERROR = "ไม่พบข้อความในภาพ"
+
+# OCR routing: remote (OCR.space ก่อน), local (Tesseract ก่อน), fastest (latency ต่ำสุดก่อน)
+OCR_ROUTING = os.environ.get("OCR_ROUTING", "remote")
+# ถ้า engine แรกยังไม่ตอบภายในเวลานี้ (วินาที) ให้เริ่ม engine สำรองคู่ขนาน (0 = ปิด)
+OCR_FALLBACK_AFTER = float(os.environ.get("OCR_FALLBACK_AFTER", 8))
+TESSERACT_CONFIG = os.environ.get("TESSERACT_CONFIG", "--psm 3")
+
+# จำนวนตัวอักษรสูงสุดต่อ request เมื่อรวมหลายบรรทัดแปลพร้อมกัน
+LINE_BATCH_CHARS = int(os.environ.get("LINE_BATCH_CHARS", 900))
+# แบบ stream (SSE) ใช้ก้อนเล็กกว่า event line จะทยอยมาแทนที่จะมาพร้อมกันทั้งก้อน
+STREAM_LINE_BATCH_CHARS = int(os.environ.get("STREAM_LINE_BATCH_CHARS", 100))
+# ขีดจำกัดตัวอักษรต่อ request ของ provider แปลภาษา
+TRANSLATION_MAX_CHARS = 1000
+# ข้อความยาวเกินนี้แบ่งเป็นก้อนตามบรรทัด/ประโยค แล้วแปลพร้อมกันไม่เกิน TRANSLATION_CHUNK_WORKERS ก้อน (รวมทุก request)
+TRANSLATION_CHUNK_CHARS = min(int(os.environ.get("TRANSLATION_CHUNK_CHARS", 900)), TRANSLATION_MAX_CHARS)
+TRANSLATION_CHUNK_WORKERS = int(os.environ.get("TRANSLATION_CHUNK_WORKERS", 4))
+
+# ตั้งค่า batch pipeline
+BATCH_MAX_PAGES = int(os.environ.get("BATCH_MAX_PAGES", 50))
+BATCH_CPU_WORKERS = int(os.environ.get("BATCH_CPU_WORKERS", os.cpu_count() or 2))
+OCR_CONCURRENCY = int(os.environ.get("OCR_CONCURRENCY", 4))
+BATCH_TRANSLATE_WORKERS = int(os.environ.get("BATCH_TRANSLATE_WORKERS", 8))
+# หน้าที่กำลังประมวลผลหรือรอ client อ่านพร้อมกันได้สูงสุดต่อ batch (หน้าถัดไปเริ่มเมื่อ client อ่านผลไปแล้ว)
+BATCH_MAX_IN_FLIGHT = max(1, int(os.environ.get("BATCH_MAX_IN_FLIGHT", 2 * OCR_CONCURRENCY)))
+
+# โหมด server ของ API: thread (Flask dev server) หรือ async (aiohttp + admission control)
+SERVER_MODE = os.environ.get("SERVER_MODE", "thread")
+API_PORT = int(os.environ.get("API_PORT", 5000))
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", 20 * 1024 * 1024))
+# /api/translate-batch ส่งได้หลายหน้า (JSON base64 ใหญ่กว่าไฟล์ราว 4/3) จึงมีขีดจำกัดแยก
+BATCH_MAX_REQUEST_BYTES = int(os.environ.get("BATCH_MAX_REQUEST_BYTES", 200 * 1024 * 1024))
+BATCH_PATH = '/api/translate-batch'
+ASYNC_MAX_IN_FLIGHT = int(os.environ.get("ASYNC_MAX_IN_FLIGHT", 64))
+ASYNC_MAX_QUEUE = int(os.environ.get("ASYNC_MAX_QUEUE", 256))
+ASYNC_PER_CLIENT_LIMIT = int(os.environ.get("ASYNC_PER_CLIENT_LIMIT", 4))
+ASYNC_QUEUE_TIMEOUT = float(os.environ.get("ASYNC_QUEUE_TIMEOUT", 10))
+# เชื่อ X-Client-Id / X-Forwarded-For เฉพาะเมื่อรันหลัง reverse proxy ที่ตั้ง header เอง (ไม่งั้นใช้ IP ที่เชื่อมต่อ)
+ASYNC_TRUST_PROXY = os.environ.get("ASYNC_TRUST_PROXY", "0").lower() in ("1", "true", "yes")
+
+# บีบอัด response ตาม Accept-Encoding เฉพาะที่ใหญ่กว่านี้ (byte)
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 5))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 5))
+
+# token สำหรับ admin endpoints (ว่าง = ไม่ตรวจสอบ)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# สุ่ม profile request (0 = ปิด) เก็บเฉพาะ request ที่ช้ากว่า PROFILE_SLOW_MS
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", 2000))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "")
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 20))
+
+
+# ตารางช่วง codepoint สำหรับตรวจจับภาษา (ช่วงปิดทั้งสองด้าน, เรียงจากน้อยไปมาก)
+SCRIPT_NAMES = ['latin', 'vietnamese', 'cyrillic', 'devanagari', 'thai', 'kana', 'han', 'hangul']
+SCRIPT_RANGES = [
+    (0x0041, 0x005A, 'latin'),
+    (0x0061, 0x007A, 'latin'),
+    (0x00C0, 0x019F, 'latin'),       # Latin-1 + Extended-A (รวม ă/đ ที่ใช้ในโรมาเนีย/โครเอเชียด้วย)
+    (0x01A0, 0x01A1, 'vietnamese'),  # Ơ ơ
+    (0x01A2, 0x01AE, 'latin'),
+    (0x01AF, 0x01B0, 'vietnamese'),  # Ư ư
+    (0x01B1, 0x024F, 'latin'),
+    (0x0400, 0x052F, 'cyrillic'),
+    (0x0900, 0x097F, 'devanagari'),
+    (0x0E00, 0x0E7F, 'thai'),
+    (0x1E00, 0x1E9F, 'latin'),
+    (0x1EA0, 0x1EF9, 'vietnamese'),  # สระพร้อมวรรณยุกต์ของเวียดนาม
+    (0x3040, 0x30FF, 'kana'),        # ฮิรางานะ + คาตากานะ
+    (0x4E00, 0x9FFF, 'han'),
+    (0xAC00, 0xD7A3, 'hangul'),
+]
+# ภาษาที่ไม่ใช่เอเชียต้องมีสัดส่วนอย่างน้อยเท่านี้ของ (ตัวอักษรของภาษานั้น + ละติน)
+# ru/hi ต้องมากกว่าละติน ส่วน vi ตัวอักษรเฉพาะเป็นส่วนน้อยของคำอยู่แล้ว (ประโยคทั่วไปราว 15%)
+SCRIPT_MIN_SHARE = {'ru': 0.5, 'hi': 0.5, 'vi': 0.1}
+
+
+@functools.lru_cache(maxsize=None)
+def script_tables():
+    """(ขอบเขต, label) ของ SCRIPT_RANGES เป็น NumPy array (สร้างครั้งแรกที่ใช้)
+    
+    ขอบเขต [start0, end0+1, start1, end1+1, ...] สำหรับ np.searchsorted
+    ตำแหน่งคี่ = อยู่ในช่วงที่ (ตำแหน่ง // 2)
+    """
+    boundaries = np.array(
+        [bound for start, end, _ in SCRIPT_RANGES for bound in (start, end + 1)], dtype=np.uint32
+    )
+    labels = np.array([SCRIPT_NAMES.index(name) for _, _, name in SCRIPT_RANGES], dtype=np.intp)
+    return boundaries, labels
+
+
+class GlossaryAutomaton:
+    """Aho-Corasick automaton สำหรับแทนที่คำหลายคำในรอบเดียว (leftmost-longest)"""
+
+    def __init__(self, replacements):
+        self.replacements = {k: v for k, v in replacements.items() if k}
+        self._goto = [{}]
+        self._fail = [0]
+        self._length = [0]      # ความยาว pattern ที่จบที่ node นี้ (0 = ไม่มี)
+        self._output = [0]      # node ปลายทางถัดไปตาม fail chain ที่มี pattern จบ
+        for phrase in self.replacements:
+            self._add(phrase)
+        self._build()
+
+    def _add(self, phrase):
+        node = 0
+        for char in phrase:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._length.append(0)
+                self._output.append(0)
+            node = nxt
+        self._length[node] = len(phrase)
+
+    def _build(self):
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                fail_node = self._fail[child]
+                self._output[child] = fail_node if self._length[fail_node] else self._output[fail_node]
+                pending.append(child)
+
+    def find(self, text):
+        """คืน list ของ (start, end) แบบ leftmost-longest ไม่ทับซ้อนกัน"""
+        longest = {}
+        node = 0
+        goto, fail, length, output = self._goto, self._fail, self._length, self._output
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            match = node if length[node] else output[node]
+            while match:
+                start = index + 1 - length[match]
+                if length[match] > longest.get(start, 0):
+                    longest[start] = length[match]
+                match = output[match]
+
+        matches = []
+        position = 0
+        for start in sorted(longest):
+            if start >= position:
+                matches.append((start, start + longest[start]))
+                position = start + longest[start]
+        return matches
+
+    def replace(self, text):
+        if not self.replacements:
+            return text
+        parts = []
+        position = 0
+        for start, end in self.find(text):
+            parts.append(text[position:start])
+            parts.append(self.replacements[text[start:end]])
+            position = end
+        if not parts:
+            return text
+        parts.append(text[position:])
+        return "".join(parts)
+
+
+class GlossaryStore:
+    """รวม glossary ในโค้ดกับไฟล์ภายนอก คอมไพล์เป็น automaton และโหลดใหม่เมื่อไฟล์เปลี่ยน
+
+    โครงสร้างไฟล์ (JSON เป็น dict หรือ TSV "คำ<TAB>ความหมาย"):
+        <GLOSSARY_DIR>/phrases/<lang>/*.json|*.tsv   คำศัพท์ฝั่งต้นทาง (โหมดมังงะ)
+        <GLOSSARY_DIR>/rewrites/<lang>/*.json|*.tsv  คำแทนที่ในคำแปล (ตามภาษาต้นทาง)
+    """
+
+    KINDS = ('phrases', 'rewrites')
+
+    def __init__(self, builtin_phrases, builtin_rewrites, directory=None, reload_interval=5.0):
+        self.builtin = {'phrases': builtin_phrases, 'rewrites': builtin_rewrites}
+        self.directory = directory or None
+        self.reload_interval = reload_interval
+        self._automata = {}
+        self._revisions = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload(force=True)
+
+    def _files(self):
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        found = []
+        for kind in self.KINDS:
+            base = os.path.join(self.directory, kind)
+            if not os.path.isdir(base):
+                continue
+            for lang in sorted(os.listdir(base)):
+                lang_dir = os.path.join(base, lang)
+                if not os.path.isdir(lang_dir):
+                    continue
+                for name in sorted(os.listdir(lang_dir)):
+                    if name.endswith(('.json', '.tsv')):
+                        found.append((kind, lang, os.path.join(lang_dir, name)))
+        return found
+
+    def _read(self, path):
+        if path.endswith('.json'):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError(f"ต้องเป็น JSON object ไม่ใช่ {type(data).__name__}")
+            return {str(k): str(v) for k, v in data.items()}
+        entries = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if not line or line.startswith('#') or '\t' not in line:
+                    continue
+                phrase, meaning = line.split('\t', 1)
+                entries[phrase] = meaning
+        return entries
+
+    def reload(self, force=False):
+        """คอมไพล์ใหม่ถ้าไฟล์ glossary เปลี่ยน (หรือ force) คืน True ถ้ามีการโหลดใหม่"""
+        files = self._files()
+        signature = tuple((path, os.path.getmtime(path), os.path.getsize(path)) for _, _, path in files)
+        if not force and signature == self._signature:
+            return False
+
+        merged = {kind: {lang: dict(entries) for lang, entries in self.builtin[kind].items()} for kind in self.KINDS}
+        for kind, lang, path in files:
+            try:
+                merged[kind].setdefault(lang, {}).update(self._read(path))
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                print(f"Glossary load error ({path}): {e}")
+
+        automata = {}
+        for lang, entries in merged['phrases'].items():
+            automata[('phrases', lang)] = GlossaryAutomaton(
+                {phrase: f"{phrase} ({meaning})" for phrase, meaning in entries.items()}
+            )
+        for lang, entries in merged['rewrites'].items():
+            automata[('rewrites', lang)] = GlossaryAutomaton(entries)
         
-        # รองรับหลายภาษาแบบละเอียด
-        self.supported_languages = {
-            'th': {'name': 'Thai', 'emoji': '🇹🇭'},
-            'en': {'name': 'English', 'emoji': '🇺🇸'},
-            'ja': {'name': 'Japanese', 'emoji': '🇯🇵'},
-            'ko': {'name': 'Korean', 'emoji': '🇰🇷'},
-            'zh': {'name': 'Chinese', 'emoji': '🇨🇳'},
-            'fr': {'name': 'French', 'emoji': '🇫🇷'},
-            'es': {'name': 'Spanish', 'emoji': '🇪🇸'},
-            'de': {'name': 'German', 'emoji': '🇩🇪'},
+        # revision ตามเนื้อหา: ทุก worker/ทุกครั้งที่รีสตาร์ทได้ค่าเดียวกันถ้า glossary ไม่เปลี่ยน
+        revisions = {}
+        for lang in set(merged['phrases']) | set(merged['rewrites']):
+            content = json.dumps(
+                [merged[kind].get(lang, {}) for kind in self.KINDS], sort_keys=True, ensure_ascii=False
+            )
+            revisions[lang] = hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
+
+        with self._lock:
+            self._automata = automata
+            self._revisions = revisions
+            self._signature = signature
+        return True
+
+    def _check_reload(self):
+        """ตรวจไฟล์เปลี่ยนไม่เกินทุก reload_interval วินาที"""
+        now = time.time()
+        if self.directory and now - self._checked_at >= self.reload_interval:
+            self._checked_at = now
+            try:
+                self.reload()
+            except OSError as e:
+                print(f"Glossary reload error: {e}")
+
+    def get(self, kind, lang):
+        """คืน automaton ของภาษานั้น"""
+        self._check_reload()
+        return self._automata.get((kind, lang))
+
+    def revision(self, lang):
+        """hash ของ glossary ภาษานั้น (ใส่ใน key ของ translation memory ให้คำแปลเก่าหมดไปเมื่อแก้ glossary)"""
+        self._check_reload()
+        return self._revisions.get(lang, '')
+
+    def get_stats(self):
+        return {
+            f"{kind}:{lang}": len(automaton.replacements)
+            for (kind, lang), automaton in self._automata.items()
         }
+
+
+# ขอบประโยค: ขึ้นบรรทัดใหม่, 。！？ ของ CJK (ไม่ต้องมีช่องว่าง) และ .!? ของอักษรละตินที่ตามด้วยช่องว่าง
+# ภาษาไทยไม่มีเครื่องหมายจบประโยค ใช้ช่องว่างระหว่างประโยคในขั้นแบ่งย่อยแทน
+SENTENCE_PATTERN = re.compile(
+    r'[^\n]*?(?:\n+|[。！？｡]+[」』”’）)]*\s*|[.!?…]+["\'”’)\]]*(?:\s+|$)|$)'
+)
+# ประโยคที่ยาวเกินก้อน: แบ่งที่ช่องว่างก่อน แล้วจึงแบ่งที่จุลภาค/วรรค (CJK ไม่มีช่องว่าง)
+CHUNK_SPLITTERS = (
+    re.compile(r'\S+\s*|\s+'),
+    re.compile(r'[^、，,；;：:]*[、，,；;：:]+\s*|[^、，,；;：:]+'),
+)
+# ภาษาปลายทางที่ต่อประโยคโดยไม่เว้นวรรค
+NO_SPACE_LANGUAGES = ('ja', 'zh', 'zh-CN', 'zh-TW')
+
+
+def _split_long_segment(segment, max_chars, level=0):
+    if len(segment.rstrip()) <= max_chars:
+        return [segment]
+    if level >= len(CHUNK_SPLITTERS):
+        return [segment[i:i + max_chars] for i in range(0, len(segment), max_chars)]
+    pieces = []
+    for part in CHUNK_SPLITTERS[level].findall(segment):
+        pieces.extend(_split_long_segment(part, max_chars, level + 1))
+    return pieces
+
+
+def split_translation_chunks(text, max_chars=TRANSLATION_CHUNK_CHARS):
+    """แบ่งข้อความยาวเป็นก้อนไม่เกิน max_chars ตามขอบบรรทัดและประโยค
+    
+    คืน list ของ (ข้อความ, ตัวคั่นที่ตามหลัง) เรียงตามลำดับเดิม ข้อความสั้นคืนก้อนเดียว
+    """
+    if len(text) <= max_chars:
+        return [(text, '')]
+    
+    pieces = []
+    for segment in SENTENCE_PATTERN.findall(text):
+        if segment:
+            pieces.extend(_split_long_segment(segment, max_chars))
+    
+    # รวมประโยคติดกันให้เต็มก้อนเพื่อลดจำนวน request
+    chunks = []
+    current = ''
+    for piece in pieces:
+        if current.strip() and len(current) + len(piece.rstrip()) > max_chars:
+            chunks.append(current)
+            current = ''
+        current += piece
+    if current.strip():
+        chunks.append(current)
+    
+    return [(chunk.strip(), chunk[len(chunk.rstrip()):]) for chunk in chunks if chunk.strip()]
+
+
+def join_translated_chunks(translations, separators, target_lang):
+    """ต่อคำแปลของแต่ละก้อนตามลำดับ (คงการขึ้นบรรทัดใหม่ของต้นฉบับ)"""
+    parts = []
+    for translated, separator in zip(translations, separators):
+        parts.append(translated.strip())
+        if '\n' in separator:
+            parts.append('\n' * separator.count('\n'))
+        elif separator or target_lang not in NO_SPACE_LANGUAGES:
+            parts.append(' ')
+    return ''.join(parts).strip()
+
+
+def combine_chunk_results(results, chunks, target_lang):
+    """รวม (api_name, คำแปล) ของทุกก้อนเป็นผลเดียว (None ถ้ามีก้อนที่แปลไม่ได้)"""
+    if not results or not all(results):
+        return None
+    api_used = "+".join(dict.fromkeys(api_name for api_name, _ in results))
+    translated = join_translated_chunks(
+        [translation for _, translation in results], [separator for _, separator in chunks], target_lang
+    )
+    return api_used, translated
+
+
+class CircuitOpenError(Exception):
+    """ถูก raise เมื่อ circuit ของ provider เปิดอยู่ (ไม่ส่ง request จริง)"""
+
+
+class CircuitBreaker:
+    """Circuit breaker แบบ closed / open / half-open"""
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def available(self):
+        """ตรวจว่าส่ง request ได้หรือไม่ (ไม่เปลี่ยนสถานะ)"""
+        with self._lock:
+            state = self.state
+            return state == "closed" or (state == "half_open" and not self.trial_in_flight)
+
+    def allow(self):
+        """ขออนุญาตส่ง request (ช่วง half-open ปล่อยทีละ 1 request เพื่อทดสอบ)"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+            self.trial_in_flight = False
+
+    def release(self):
+        """ปล่อย trial ของช่วง half-open โดยไม่นับผล (request ถูกยกเลิกหรือพังด้วยเหตุที่ไม่เกี่ยวกับ provider)"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def get_stats(self):
+        return {"state": self.state, "failures": self.failures}
+
+
+class HTTPClient:
+    """HTTP client กลาง: session keep-alive แยกตาม host, retry แบบ jittered backoff และ circuit breaker"""
+
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, backoff_base=HTTP_BACKOFF_BASE, backoff_max=HTTP_BACKOFF_MAX,
+                 metrics=None):
+        self.pool_size = pool_size
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.metrics = metrics
+        self._sessions = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def session_for(self, url):
+        """คืน requests.Session ที่ผูกกับ host ของ url (สร้างครั้งแรกที่ใช้)"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+            return session
+
+    def warm(self, url, timeout=HTTP_WARM_TIMEOUT):
+        """เปิด connection (DNS + TLS) ไปยัง host ของ url ไว้ใน pool ล่วงหน้า (HEAD ไม่ใช้โควตา API)"""
+        try:
+            self.session_for(url).head(url, timeout=timeout).close()
+        except requests.RequestException as e:
+            print(f"warm-up {urlsplit(url).netloc}: {e}")
+
+    def breaker(self, name):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name)
+                self._breakers[name] = breaker
+            return breaker
+
+    def observe(self, breaker, started, outcome, retrying=False):
+        """บันทึกเวลาของการเรียก upstream แต่ละครั้ง (label ตามชื่อ breaker)"""
+        if self.metrics is None:
+            return
+        name = breaker.name if breaker is not None else "unknown"
+        if name.startswith("ocr:"):
+            labels = {"provider": "ocr_space", "ocr_key": mask_key(name[4:])}
+        else:
+            labels = {"provider": name, "ocr_key": ""}
+        self.metrics.observe("upstream_attempt_seconds", time.perf_counter() - started, outcome=outcome, **labels)
+        if retrying:
+            self.metrics.inc("upstream_retries_total", **labels)
+
+    def backoff(self, attempt):
+        """full jitter: สุ่มระหว่าง 0 ถึง base * 2^attempt (ไม่เกิน backoff_max)"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method, url, breaker=None, retries=0, retry_status=None, **kwargs):
+        """ส่ง request พร้อม retry เมื่อ network error หรือ status 429/5xx (หรือ retry_status)
         
-        # Context dictionary สำหรับการแปลที่เข้าใจบริบท
-        self.context_phrases = {
-            'ja': {
-                'manga': {
-                    'お前': 'you (informal/male)',
-                    '俺': 'I (male)',
-                    '私': 'I (female/formal)',
-                    '君': 'you (friendly)',
-                    'ありがとう': 'thank you',
-                    'すみません': 'excuse me/sorry',
-                }
-            },
-            'ko': {
-                'manga': {
-                    '나는': 'I',
-                    '너': 'you',
-                    '감사합니다': 'thank you',
-                }
-            }
+        raise CircuitOpenError ถ้า breaker ไม่อนุญาต และ raise exception เดิม
+        เมื่อ retry ครบแล้วยัง error ระดับ network
+        """
+        session = self.session_for(url)
+        retry_status = self.RETRY_STATUS if retry_status is None else retry_status
+        for attempt in range(retries + 1):
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(breaker.name)
+            
+            last_attempt = attempt == retries
+            started = time.perf_counter()
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.RequestException:
+                if breaker is not None:
+                    breaker.record_failure()
+                self.observe(breaker, started, "network_error", not last_attempt)
+                if last_attempt:
+                    raise
+                time.sleep(self.backoff(attempt))
+                continue
+            except BaseException:
+                # ไม่ใช่ error ของ provider: คืน trial ไม่งั้น breaker ค้าง half-open ตลอดไป
+                if breaker is not None:
+                    breaker.release()
+                raise
+            
+            if response.status_code in retry_status:
+                if breaker is not None:
+                    breaker.record_failure()
+                self.observe(breaker, started, f"http_{response.status_code}", not last_attempt)
+                if last_attempt:
+                    return response
+                time.sleep(self.backoff(attempt))
+                continue
+            
+            if breaker is not None:
+                breaker.record_success()
+            self.observe(breaker, started, "ok" if response.status_code == 200 else f"http_{response.status_code}")
+            return response
+
+    def get_stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+            hosts = list(self._sessions)
+        return {
+            "hosts": hosts,
+            "circuits": {name: breaker.get_stats() for name, breaker in breakers.items()}
         }
+
+
+class ImageFetcher:
+    """ดาวน์โหลดภาพจาก URL แบบ stream จำกัดขนาด พร้อม HTTP cache บนดิสก์ (ETag / Last-Modified / max-age)
     
-    def get_ocr_key(self):
-        """สลับใช้ OCR API keys"""
-        key = self.ocr_api_keys[self.current_ocr_key_index]
-        self.current_ocr_key_index = (self.current_ocr_key_index + 1) % len(self.ocr_api_keys)
-        return key
+    ตรวจขนาดภาพจาก header ทันทีที่อ่านได้ ภาพที่ใหญ่เกินจะถูกตัดการดาวน์โหลดก่อนโหลดครบ
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    HEADER_PROBE_BYTES = 1024 * 1024
+    PRUNE_EVERY = 64
+
+    def __init__(self, http, cache_dir=IMAGE_CACHE_DIR, max_bytes=IMAGE_FETCH_MAX_BYTES,
+                 cache_max_bytes=IMAGE_CACHE_MAX_BYTES, timeout=IMAGE_FETCH_TIMEOUT):
+        self.http = http
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.cache_max_bytes = cache_max_bytes
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._stores = 0
+        self.stats = {"downloads": 0, "fresh_hits": 0, "revalidated": 0, "rejected": 0, "bytes_downloaded": 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _paths(self, url):
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, digest[:2], digest)
+        return base + ".json", base + ".img"
+
+    def _load_meta(self, url):
+        if not self.cache_dir:
+            return None
+        meta_path, _ = self._paths(url)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get("url") == url else None
+
+    def _read_body(self, url):
+        _, body_path = self._paths(url)
+        try:
+            with open(body_path, 'rb') as f:
+                body = f.read()
+            os.utime(body_path)  # LRU ตาม mtime
+            return body
+        except OSError:
+            return None
+
+    @staticmethod
+    def _max_age(response):
+        """อายุที่ใช้ได้โดยไม่ต้องถามใหม่จาก Cache-Control (0 = ต้อง revalidate ทุกครั้ง)"""
+        cache_control = response.headers.get("Cache-Control", "").lower()
+        if "no-cache" in cache_control:
+            return 0
+        match = re.search(r"max-age=(\d+)", cache_control)
+        return int(match.group(1)) if match else 0
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _store(self, url, response, body):
+        """เก็บลงแคชถ้า response มี validator หรือ max-age (ข้าม no-store)"""
+        if not self.cache_dir or "no-store" in response.headers.get("Cache-Control", "").lower():
+            return
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        max_age = self._max_age(response)
+        if not (etag or last_modified or max_age):
+            return
+        
+        meta_path, body_path = self._paths(url)
+        meta = {"url": url, "etag": etag, "last_modified": last_modified,
+                "expires": time.time() + max_age, "size": len(body)}
+        try:
+            os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+            self._write(body_path, body)
+            self._write(meta_path, json.dumps(meta).encode('utf-8'))
+        except OSError as e:
+            print(f"image cache write error: {e}")
+            return
+        
+        with self._lock:
+            self._stores += 1
+            prune = self._stores % self.PRUNE_EVERY == 0
+        if prune:
+            self._prune()
+
+    def _refresh(self, url, meta, response):
+        """304: ต่ออายุ entry เดิม"""
+        meta = dict(meta, expires=time.time() + self._max_age(response))
+        meta_path, _ = self._paths(url)
+        try:
+            self._write(meta_path, json.dumps(meta).encode('utf-8'))
+        except OSError as e:
+            print(f"image cache write error: {e}")
+
+    def _prune(self):
+        """ลบภาพที่ใช้ล่าสุดนานที่สุดจนขนาดรวมไม่เกิน cache_max_bytes"""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".img"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.cache_max_bytes:
+                break
+            for remove in (path, path[:-4] + ".json"):
+                with contextlib.suppress(OSError):
+                    os.remove(remove)
+            total -= size
+
+    def _reject(self, message):
+        self._count("rejected")
+        raise ValueError(message)
+
+    def _read_capped(self, response):
+        """อ่าน body ทีละ chunk หยุดทันทีเมื่อเกิน max_bytes หรือ header บอกว่าภาพใหญ่เกิน"""
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            self._reject(f"ไฟล์ภาพใหญ่เกิน {self.max_bytes // (1024 * 1024)} MB")
+        
+        buffer = bytearray()
+        checked = False
+        for chunk in response.iter_content(self.CHUNK_SIZE):
+            buffer += chunk
+            if len(buffer) > self.max_bytes:
+                self._reject(f"ไฟล์ภาพใหญ่เกิน {self.max_bytes // (1024 * 1024)} MB")
+            if not checked and len(buffer) <= self.HEADER_PROBE_BYTES:
+                size = image_dimensions(bytes(buffer))
+                if size is not None:
+                    checked = True
+                    try:
+                        check_image_size(size)
+                    except ValueError as e:
+                        self._reject(str(e))
+        self._count("bytes_downloaded", len(buffer))
+        return bytes(buffer)
+
+    def fetch(self, url):
+        """คืน bytes ของภาพ (จากแคชถ้ายังไม่หมดอายุ หรือ server ตอบ 304)"""
+        meta = self._load_meta(url)
+        if meta is not None and meta.get("expires", 0) > time.time():
+            body = self._read_body(url)
+            if body is not None:
+                self._count("fresh_hits")
+                return body
+        
+        return self._download(url, meta)
+
+    def _download(self, url, meta=None):
+        """GET แบบมีเงื่อนไข (If-None-Match / If-Modified-Since) ถ้ามี entry เดิม"""
+        headers = {}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        
+        with self.http.request("GET", url, stream=True, timeout=self.timeout, headers=headers) as response:
+            if response.status_code == 304 and meta is not None:
+                body = self._read_body(url)
+                if body is None:
+                    # ไฟล์ในแคชหายไป: โหลดใหม่แบบไม่มีเงื่อนไข
+                    return self._download(url)
+                self._refresh(url, meta, response)
+                self._count("revalidated")
+                return body
+            response.raise_for_status()
+            body = self._read_capped(response)
+        self._count("downloads")
+        self._store(url, response, body)
+        return body
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, cache_dir=self.cache_dir or None)
+
+
+def mask_key(key):
+    """ซ่อน API key สำหรับแสดงใน stats/metrics"""
+    return key[:4] + "***" if len(key) > 6 else key
+
+
+def parse_ocr_key_quotas(spec, shares=1):
+    """แปลง "key:ต่อนาที:ต่อวัน,..." เป็น list ของ dict (ละส่วนโควตาได้)
     
-    def enhance_manga_image(self, image):
-        """ปรับปรุงภาพมังงะให้ OCR ทำงานได้ดีขึ้น"""
+    shares > 1 แบ่งโควตาให้แต่ละ worker process เท่าๆ กัน รวมทุก worker แล้วไม่เกินโควตาของ key
+    """
+    quotas = []
+    for item in spec.split(','):
+        parts = item.strip().split(':')
+        if not parts[0]:
+            continue
         try:
-            # แปลงเป็น numpy array สำหรับ OpenCV
-            if isinstance(image, Image.Image):
-                img_array = np.array(image)
-            else:
-                img_array = image
+            per_minute = float(parts[1]) if len(parts) > 1 and parts[1] else 60.0
+            per_day = int(parts[2]) if len(parts) > 2 and parts[2] else 0
+        except ValueError as e:
+            print(f"OCR_API_KEYS: ข้าม key {mask_key(parts[0])} ({e})")
+            continue
+        if per_minute < 0 or per_day < 0:
+            print(f"OCR_API_KEYS: ข้าม key {mask_key(parts[0])} (โควตาติดลบ)")
+            continue
+        quotas.append({
+            "key": parts[0],
+            "per_minute": per_minute / shares,
+            "per_day": max(1, per_day // shares) if per_day else 0
+        })
+    return quotas
+
+
+class OCRKeyScheduler:
+    """เลือก OCR key แบบ thread-safe ด้วย token bucket ต่อ key
+    
+    เลือก key ที่เหลืองบมากที่สุด ข้าม key ที่หมดโควตา อยู่ในช่วงพัก (cooldown)
+    หรือ circuit เปิดอยู่ per_minute = 0 คือไม่จำกัดต่อนาที และ bucket จุอย่างน้อย 1 token
+    (per_minute < 1 ยังใช้ได้ ครั้งละ 1 request ทุก 60/per_minute วินาที)
+    """
+
+    def __init__(self, quotas, breaker_for=None, cooldown=OCR_KEY_COOLDOWN, max_cooldown=OCR_KEY_MAX_COOLDOWN):
+        self.breaker_for = breaker_for
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        now = time.time()
+        self._keys = OrderedDict()
+        for quota in quotas:
+            self._keys[quota["key"]] = {
+                "per_minute": quota["per_minute"],
+                "per_day": quota["per_day"],
+                "tokens": max(1.0, quota["per_minute"]),
+                "refilled_at": now,
+                "day": time.strftime("%Y-%m-%d"),
+                "used_today": 0,
+                "cooldown_until": 0.0,
+                "strikes": 0,
+                "requests": 0,
+                "ok": 0,
+                "rate_limited": 0,
+                "errors": 0,
+            }
+
+    @property
+    def keys(self):
+        return list(self._keys)
+
+    def _refill(self, state, now):
+        elapsed = now - state["refilled_at"]
+        state["tokens"] = min(
+            max(1.0, state["per_minute"]), state["tokens"] + elapsed * state["per_minute"] / 60.0
+        )
+        state["refilled_at"] = now
+        today = time.strftime("%Y-%m-%d")
+        if state["day"] != today:
+            state["day"] = today
+            state["used_today"] = 0
+
+    def _budget(self, state):
+        """งบที่เหลือ (token ในนาทีนี้ จำกัดด้วยโควตาที่เหลือของวัน)"""
+        tokens = state["tokens"] if state["per_minute"] else float('inf')
+        if state["per_day"]:
+            return min(tokens, state["per_day"] - state["used_today"])
+        return tokens
+
+    def acquire(self):
+        """จองสิทธิ์ใช้ key 1 ครั้ง คืน key หรือ None ถ้าไม่มี key ที่ใช้ได้"""
+        now = time.time()
+        with self._lock:
+            best_key, best_budget = None, 0.0
+            for key, state in self._keys.items():
+                self._refill(state, now)
+                if state["cooldown_until"] > now:
+                    continue
+                if self.breaker_for is not None and not self.breaker_for(key).available():
+                    continue
+                budget = self._budget(state)
+                if budget >= 1 and budget > best_budget:
+                    best_key, best_budget = key, budget
             
-            # แปลงเป็น grayscale
-            if len(img_array.shape) == 3:
-                gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+            if best_key is not None:
+                state = self._keys[best_key]
+                if state["per_minute"]:
+                    state["tokens"] -= 1
+                state["used_today"] += 1
+                state["requests"] += 1
+            return best_key
+
+    def report(self, key, outcome):
+        """แจ้งผลการใช้ key: 'ok', 'rate_limited' หรือ 'errored' (สองแบบหลังจะพัก key)"""
+        with self._lock:
+            state = self._keys.get(key)
+            if state is None:
+                return
+            if outcome == 'ok':
+                state["ok"] += 1
+                state["strikes"] = 0
+                return
+            state["rate_limited" if outcome == 'rate_limited' else "errors"] += 1
+            state["strikes"] += 1
+            cooldown = min(self.max_cooldown, self.cooldown * (2 ** (state["strikes"] - 1)))
+            state["cooldown_until"] = time.time() + cooldown
+
+    def get_stats(self):
+        now = time.time()
+        with self._lock:
+            stats = {}
+            for key, state in self._keys.items():
+                self._refill(state, now)
+                stats[mask_key(key)] = {
+                    "per_minute": state["per_minute"],
+                    "per_day": state["per_day"],
+                    "tokens": round(state["tokens"], 2) if state["per_minute"] else None,
+                    "used_today": state["used_today"],
+                    "remaining_today": state["per_day"] - state["used_today"] if state["per_day"] else None,
+                    "cooldown_seconds": round(max(0.0, state["cooldown_until"] - now), 1),
+                    "requests": state["requests"],
+                    "ok": state["ok"],
+                    "rate_limited": state["rate_limited"],
+                    "errors": state["errors"],
+                }
+            return stats
+
+
+class LatencyTracker:
+    """เก็บ latency ล่าสุดของแต่ละ provider เพื่อใช้ปรับ hedge deadline"""
+
+    def __init__(self, window=200, metrics=None):
+        self.window = window
+        self.metrics = metrics
+        self._samples = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, ok=True):
+        if self.metrics is not None:
+            self.metrics.observe("provider_seconds", seconds, provider=name, outcome="ok" if ok else "failed")
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+            counts = self._counts.setdefault(name, {"ok": 0, "failed": 0})
+            counts["ok" if ok else "failed"] += 1
+
+    def percentile(self, name, q):
+        """คืน percentile (0-100) ของ latency หรือ None ถ้ายังไม่มีข้อมูล"""
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(q / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def get_stats(self):
+        with self._lock:
+            names = list(self._samples)
+            counts = {name: dict(c) for name, c in self._counts.items()}
+        return {
+            name: {
+                "p50": self.percentile(name, 50),
+                "p90": self.percentile(name, 90),
+                "p99": self.percentile(name, 99),
+                **counts.get(name, {})
+            }
+            for name in names
+        }
+
+
+class MetricsRegistry:
+    """histogram/counter แบบมี label แสดงผลเป็น Prometheus text format"""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    METRICS = {
+        "stage_seconds": ("histogram", "เวลาของแต่ละขั้นใน pipeline OCR/แปลภาษา"),
+        "upstream_attempt_seconds": ("histogram", "เวลาของการเรียก upstream API แต่ละครั้ง (รวม retry)"),
+        "upstream_retries_total": ("counter", "จำนวนครั้งที่ retry upstream API"),
+        "provider_seconds": ("histogram", "เวลาต่อการเรียก provider (OCR engine / API แปลภาษา)"),
+        "requests_total": ("counter", "จำนวน request แยกตาม endpoint และผลลัพธ์"),
+    }
+
+    def __init__(self, prefix="manga_translator_"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = {"buckets": [0] * len(self.BUCKETS), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    series["buckets"][index] += 1
+            series["sum"] += seconds
+            series["count"] += 1
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe_stages(self, timings, is_manga, outcome, stage_outcomes=None):
+        """บันทึก timings (มิลลิวินาที) ของ request หนึ่งลง stage_seconds"""
+        stage_outcomes = stage_outcomes or {}
+        for stage, ms in timings.items():
+            self.observe("stage_seconds", ms / 1000.0, stage=stage, is_manga=str(bool(is_manga)).lower(),
+                         outcome=stage_outcomes.get(stage, outcome))
+
+    @staticmethod
+    def _labels(pairs):
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return ",".join(f'{name}="{escape(value)}"' for name, value in pairs)
+
+    def render(self, **const_labels):
+        """const_labels ติดทุก series (เช่น worker_pid เมื่อมีหลาย worker ให้ Prometheus รวมเอง)"""
+        const = tuple(sorted(const_labels.items()))
+        with self._lock:
+            histograms = {
+                (metric, const + labels): {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]}
+                for (metric, labels), v in self._histograms.items()
+            }
+            counters = {(metric, const + labels): value for (metric, labels), value in self._counters.items()}
+        
+        lines = []
+        for name, (kind, help_text) in self.METRICS.items():
+            full_name = self.prefix + name
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{full_name}{{{self._labels(labels)}}} {value}")
+                continue
+            for (metric, labels), series in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(self.BUCKETS, series["buckets"]):
+                    bucket_labels = self._labels(labels + (("le", repr(bound)),))
+                    lines.append(f"{full_name}_bucket{{{bucket_labels}}} {count}")
+                inf_labels = self._labels(labels + (("le", "+Inf"),))
+                lines.append(f"{full_name}_bucket{{{inf_labels}}} {series['count']}")
+                lines.append(f"{full_name}_sum{{{self._labels(labels)}}} {series['sum']:.6f}")
+                lines.append(f"{full_name}_count{{{self._labels(labels)}}} {series['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class SlowRequestProfiler:
+    """สุ่ม profile request ด้วย cProfile และเก็บไว้เฉพาะที่ช้ากว่า slow_ms
+    
+    profile ได้ทีละ request (cProfile เปิดพร้อมกันหลายตัวไม่ได้) และเห็นเฉพาะงาน
+    ใน thread ที่รับ request งานที่ส่งต่อไป thread pool จะเห็นเป็นเวลารอ
+    """
+
+    def __init__(self, sample_rate=PROFILE_SAMPLE_RATE, slow_ms=PROFILE_SLOW_MS,
+                 directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.directory = directory
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self.recent = deque(maxlen=keep)
+
+    def run(self, label, fn, *args, **kwargs):
+        """เรียก fn(*args) และ profile ถ้าถูกสุ่มเลือก"""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate or not self._busy.acquire(blocking=False):
+            return fn(*args, **kwargs)
+        
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self._busy.release()
+            if elapsed_ms >= self.slow_ms:
+                self._keep(label, elapsed_ms, profiler)
+
+    def _keep(self, label, elapsed_ms, profiler):
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.sort_stats("cumulative").print_stats(25)
+        
+        path = None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{int(time.time() * 1000)}-{label}-{int(elapsed_ms)}ms.prof")
+            stats.dump_stats(path)
+        
+        with self._lock:
+            self.recent.append({
+                "label": label,
+                "elapsed_ms": round(elapsed_ms, 1),
+                "at": time.time(),
+                "path": path,
+                "summary": output.getvalue()
+            })
+
+    def get_recent(self):
+        with self._lock:
+            return list(self.recent)
+
+
+class SingleFlight:
+    """รวมงานที่ซ้ำกันขณะกำลังทำอยู่ (single-flight)
+    
+    thread แรกของแต่ละ key เป็นผู้ทำงานจริง thread อื่นที่มาด้วย key เดียวกันระหว่างนั้น
+    จะรอและได้ผลลัพธ์เดียวกัน (รวมถึง exception)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """คืน (ผลลัพธ์, shared) โดย shared=True เมื่อได้ผลจากงานของ thread อื่น"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
             else:
-                gray = img_array
-            
-            # เพิ่ม contrast
-            gray = cv2.convertScaleAbs(gray, alpha=1.5, beta=0)
-            
-            # ลบ noise
-            gray = cv2.medianBlur(gray, 3)
+                self.shared += 1
+                leader = False
+        
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+        
+        try:
+            call["result"] = fn(*args, **kwargs)
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["done"].set()
+        return call["result"], False
+
+    def get_stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "shared": self.shared}
+
+
+class TieredCache:
+    """แคชสองชั้น: LRU ในหน่วยความจำ + SQLite บนดิสก์ (ถ้ากำหนด db_path)"""
+
+    PRUNE_EVERY = 64
+
+    def __init__(self, name, max_entries=256, db_path=None, ttl=None, max_disk_entries=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.db_path = db_path or None
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()  # key -> (value, tag, created)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._writes = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _db(self):
+        """เปิด connection SQLite แบบ lazy (เปิดใหม่ถ้าอยู่คนละ process)"""
+        if not self.db_path:
+            return None
+        if self._conn is None or self._conn_pid != os.getpid():
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, tag TEXT, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_tag ON cache (tag)")
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _remember(self, key, value, tag, created):
+        self._memory[key] = (value, tag, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get(self, key):
+        """คืนค่าจากแคช หรือ None ถ้าไม่พบ/หมดอายุ"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[2], now):
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+
+            conn = self._db()
+            if conn is not None:
+                try:
+                    row = conn.execute(
+                        "SELECT value, tag, created FROM cache WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        if not self._expired(row[2], now):
+                            conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+                            conn.commit()
+                            value = json.loads(row[0])
+                            self._remember(key, value, row[1], row[2])
+                            self.stats["disk_hits"] += 1
+                            return value
+                        conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                        conn.commit()
+                except sqlite3.Error as e:
+                    print(f"{self.name} cache read error: {e}")
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key, value, tag=None):
+        """บันทึกค่าลงแคชทั้งสองชั้น"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, tag, now)
+            self.stats["stores"] += 1
+
+            conn = self._db()
+            if conn is not None:
+                try:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO cache (key, value, tag, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                        (key, json.dumps(value, ensure_ascii=False), tag, now, now)
+                    )
+                    conn.commit()
+                    self._writes += 1
+                    if self._writes % self.PRUNE_EVERY == 0:
+                        self._prune_disk(conn, now)
+                except sqlite3.Error as e:
+                    print(f"{self.name} cache write error: {e}")
+
+    def _prune_disk(self, conn, now):
+        """ลบรายการที่หมดอายุ และรายการเก่าสุดเมื่อเกินขนาดที่กำหนด"""
+        if self.ttl is not None:
+            conn.execute("DELETE FROM cache WHERE created < ?", (now - self.ttl,))
+        if self.max_disk_entries:
+            conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,)
+            )
+        conn.commit()
+
+    def purge(self, tag=None):
+        """ลบรายการทั้งหมด (หรือเฉพาะ tag ที่กำหนด) คืนจำนวนที่ลบจากดิสก์/หน่วยความจำ"""
+        with self._lock:
+            if tag is None:
+                removed = len(self._memory)
+                self._memory.clear()
+            else:
+                keys = [k for k, entry in self._memory.items() if entry[1] == tag]
+                for k in keys:
+                    del self._memory[k]
+                removed = len(keys)
+
+            conn = self._db()
+            if conn is not None:
+                try:
+                    if tag is None:
+                        cursor = conn.execute("DELETE FROM cache")
+                    else:
+                        cursor = conn.execute("DELETE FROM cache WHERE tag = ?", (tag,))
+                    conn.commit()
+                    removed = max(removed, cursor.rowcount)
+                except sqlite3.Error as e:
+                    print(f"{self.name} cache purge error: {e}")
+            return removed
+
+    def disk_size(self):
+        conn = self._db()
+        if conn is None:
+            return 0
+        with self._lock:
+            try:
+                return conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            except sqlite3.Error:
+                return 0
+
+    def get_stats(self):
+        """สถิติ hit/miss สำหรับ monitoring"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+        stats["disk_entries"] = self.disk_size()
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+class PerceptualHashIndex:
+    """ดัชนี dHash 64 บิตสำหรับหาภาพใกล้เคียง (Hamming distance ไม่เกิน max_distance)
+    
+    ใช้ multi-index hashing: แบ่ง hash เป็น 4 ส่วน ส่วนละ 16 บิต ถ้าระยะรวมไม่เกิน r
+    จะมีอย่างน้อยหนึ่งส่วนที่ต่างกันไม่เกิน r // 4 บิต จึงค้นเฉพาะ bucket ของแต่ละส่วน
+    (ผ่าน index ของ SQLite) แล้วค่อยวัดระยะจริง รองรับหลายล้านหน้าโดยไม่ต้องโหลดทั้งหมดเข้าหน่วยความจำ
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+    PRUNE_EVERY = 256
+
+    def __init__(self, db_path=None, max_distance=PHASH_MAX_DISTANCE, max_entries=PHASH_MAX_ENTRIES):
+        self.db_path = db_path or None
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._writes = 0
+        self.stats = {"lookups": 0, "hits": 0, "candidates": 0, "rejected": 0, "stores": 0}
+
+    def _db(self):
+        """เปิด connection แบบ lazy (ไม่กำหนด db_path = เก็บในหน่วยความจำ)"""
+        if self._conn is None or self._conn_pid != os.getpid():
+            if self.db_path:
+                directory = os.path.dirname(self.db_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path or ":memory:", timeout=10, check_same_thread=False)
+            if self.db_path:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS phash ("
+                "cache_key TEXT PRIMARY KEY, hash INTEGER NOT NULL, variant TEXT NOT NULL, "
+                "c0 INTEGER, c1 INTEGER, c2 INTEGER, c3 INTEGER, "
+                "width INTEGER, height INTEGER, created REAL NOT NULL, detail BLOB)"
+            )
+            try:
+                # ฐานข้อมูลเดิมก่อนมีภาพย่อ (รายการเก่าไม่มี detail จึงไม่ถูกใช้ซ้ำ)
+                conn.execute("ALTER TABLE phash ADD COLUMN detail BLOB")
+            except sqlite3.OperationalError:
+                pass
+            for i in range(self.CHUNKS):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS phash_c{i} ON phash (c{i}, variant)")
+            conn.execute("CREATE INDEX IF NOT EXISTS phash_created ON phash (created)")
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _chunks(self, value):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def _neighbours(self, chunk, radius):
+        """ค่าทั้งหมดที่ต่างจาก chunk ไม่เกิน radius บิต"""
+        values = {chunk}
+        for _ in range(radius):
+            values |= {value ^ (1 << bit) for value in values for bit in range(self.CHUNK_BITS)}
+        return values
+
+    @staticmethod
+    def _signed(value):
+        # SQLite INTEGER เป็น signed 64-bit
+        return value - (1 << 64) if value >= (1 << 63) else value
+
+    def add(self, value, cache_key, variant, size, detail):
+        """เก็บ hash + ภาพย่อ (detail_fingerprint) ของภาพที่มีผล OCR อยู่ใน cache_key
+        
+        size = ขนาดที่พิกัด overlay อ้างอิง
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._db()
+                conn.execute(
+                    "INSERT OR REPLACE INTO phash "
+                    "(cache_key, hash, variant, c0, c1, c2, c3, width, height, created, detail) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (cache_key, self._signed(value), variant, *self._chunks(value), size[0], size[1], now, detail)
+                )
+                conn.commit()
+                self.stats["stores"] += 1
+                self._writes += 1
+                if self.max_entries and self._writes % self.PRUNE_EVERY == 0:
+                    conn.execute(
+                        "DELETE FROM phash WHERE cache_key IN ("
+                        "SELECT cache_key FROM phash ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,)
+                    )
+                    conn.commit()
+            except sqlite3.Error as e:
+                print(f"phash index write error: {e}")
+
+    def lookup(self, value, variant, exclude=None):
+        """คืน list ของ (distance, cache_key, (width, height), detail) เรียงจากใกล้สุด
+        
+        เป็นเพียงผู้สมัคร ต้องยืนยันด้วย detail ก่อนใช้ (dHash 9x8 มองไม่เห็นข้อความ)
+        """
+        if self.max_distance <= 0:
+            return []
+        radius = self.max_distance // self.CHUNKS
+        clauses, params = [], []
+        for i, chunk in enumerate(self._chunks(value)):
+            values = sorted(self._neighbours(chunk, radius))
+            clauses.append(f"c{i} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+        
+        with self._lock:
+            self.stats["lookups"] += 1
+            try:
+                rows = self._db().execute(
+                    f"SELECT hash, cache_key, width, height, detail FROM phash "
+                    f"WHERE variant = ? AND ({' OR '.join(clauses)})",
+                    [variant] + params
+                ).fetchall()
+            except sqlite3.Error as e:
+                print(f"phash index read error: {e}")
+                return []
+            self.stats["candidates"] += len(rows)
+        
+        matches = []
+        for stored, cache_key, width, height, detail in rows:
+            distance = bin((stored & ((1 << 64) - 1)) ^ value).count("1")
+            if distance <= self.max_distance and cache_key != exclude:
+                matches.append((distance, cache_key, (width, height), detail))
+        matches.sort(key=lambda match: match[:2])
+        return matches
+
+    def record_hit(self):
+        with self._lock:
+            self.stats["hits"] += 1
+
+    def record_rejected(self):
+        with self._lock:
+            self.stats["rejected"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats, max_distance=self.max_distance, detail_tolerance=PHASH_DETAIL_TOLERANCE)
+            try:
+                stats["entries"] = self._db().execute("SELECT COUNT(*) FROM phash").fetchone()[0]
+            except sqlite3.Error:
+                stats["entries"] = 0
+        return stats
+
+
+def _flatten_pil_image(image, grayscale):
+    """แปลงภาพ PIL เป็น L/RGB โดยวางส่วนโปร่งใสบนพื้นขาว (รองรับ RGBA/LA/P)"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGBA', rgba.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, rgba)
+    return image.convert('L' if grayscale else 'RGB')
+
+
+def decode_image_array(image_bytes, image=None, grayscale=False, max_side=OCR_MAX_SIDE):
+    """ถอดรหัสภาพเป็น NumPy array (BGR หรือ grayscale) โดยตรงจาก bytes
+    
+    JPEG ขนาดใหญ่จะถอดรหัสแบบย่อ 1/2, 1/4, 1/8 ตั้งแต่ขั้น decode
+    ถ้า OpenCV อ่านไม่ได้ (เช่น GIF) จะใช้ PIL แทน
+    """
+    if image_bytes is None:
+        array = np.asarray(_flatten_pil_image(image, grayscale))
+        return array if grayscale else cv2.cvtColor(array, cv2.COLOR_RGB2BGR)
+    
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    array = None
+    
+    if image_bytes[:3] == b'\xff\xd8\xff':
+        # JPEG: อ่านขนาดจาก header แล้วเลือก reduced decode ที่ยังใหญ่กว่า max_side
+        width, height = Image.open(io.BytesIO(image_bytes)).size
+        for factor in (8, 4, 2):
+            if max(width, height) // factor >= max_side:
+                flag = getattr(cv2, f"IMREAD_REDUCED_{'GRAYSCALE' if grayscale else 'COLOR'}_{factor}")
+                array = cv2.imdecode(buffer, flag)
+                break
+    
+    if array is None:
+        array = cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED)
+    
+    if array is None:
+        return decode_image_array(None, Image.open(io.BytesIO(image_bytes)), grayscale, max_side)
+    
+    if array.dtype != np.uint8:
+        # PNG 16-bit
+        array = (array >> 8).astype(np.uint8)
+    
+    if array.ndim == 3 and array.shape[2] == 4:
+        # วางส่วนโปร่งใสบนพื้นขาว
+        alpha = array[:, :, 3:4].astype(np.uint16)
+        array = ((array[:, :, :3] * alpha + 255 * (255 - alpha)) // 255).astype(np.uint8)
+    
+    if grayscale and array.ndim == 3:
+        array = cv2.cvtColor(array, cv2.COLOR_BGR2GRAY)
+    elif not grayscale and array.ndim == 2:
+        array = cv2.cvtColor(array, cv2.COLOR_GRAY2BGR)
+    return array
+
+
+def downscale_array(array, max_side=OCR_MAX_SIDE):
+    """ย่อภาพให้ด้านยาวไม่เกิน max_side (ไม่ขยายภาพเล็ก)"""
+    height, width = array.shape[:2]
+    if max(height, width) <= max_side:
+        return array
+    scale = max_side / float(max(height, width))
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    return cv2.resize(array, size, interpolation=cv2.INTER_AREA)
+
+
+@functools.lru_cache(maxsize=None)
+def manga_close_kernel():
+    return np.ones((2, 2), np.uint8)
+
+
+def enhance_manga_array(gray):
+    """ปรับภาพมังงะ grayscale แบบ in-place: contrast -> ลบ noise -> Otsu -> closing"""
+    # เพิ่ม contrast
+    cv2.convertScaleAbs(gray, dst=gray, alpha=1.5, beta=0)
+    
+    # ลบ noise
+    cv2.medianBlur(gray, 3, dst=gray)
+    
+    # Threshold เพื่อให้ข้อความชัดเจน
+    cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=gray)
+    
+    # ขยายข้อความให้ชัดเจน
+    cv2.morphologyEx(gray, cv2.MORPH_CLOSE, manga_close_kernel(), dst=gray)
+    return gray
+
+
+def encode_png(array):
+    """encode PNG แบบบีบอัดเร็ว (บีบแรงขึ้นเฉพาะเมื่อไฟล์ใหญ่เกินลิมิตอัพโหลด)"""
+    ok, encoded = cv2.imencode('.png', array, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
+    if ok and len(encoded) > OCR_MAX_UPLOAD_BYTES and PNG_COMPRESSION < 9:
+        ok, encoded = cv2.imencode('.png', array, [cv2.IMWRITE_PNG_COMPRESSION, 9])
+    if not ok:
+        raise ValueError("ไม่สามารถ encode ภาพได้")
+    return encoded.tobytes()
+
+
+def decode_for_ocr(image_bytes, image, is_manga, timings):
+    """ขั้น decode + ย่อภาพของ pipeline OCR (บันทึกเวลาลง timings)"""
+    started = time.perf_counter()
+    array = decode_image_array(image_bytes, image, grayscale=is_manga)
+    timings["decode"] = (time.perf_counter() - started) * 1000
+    
+    started = time.perf_counter()
+    array = downscale_array(array)
+    timings["resize"] = (time.perf_counter() - started) * 1000
+    return array
+
+
+def encode_for_ocr(array, is_manga, timings):
+    """ขั้นปรับภาพมังงะ + encode PNG ของ pipeline OCR (บันทึกเวลาลง timings)"""
+    if is_manga:
+        started = time.perf_counter()
+        if not array.flags.writeable:
+            array = array.copy()
+        enhance_manga_array(array)
+        timings["enhance"] = (time.perf_counter() - started) * 1000
+    
+    started = time.perf_counter()
+    png_bytes = encode_png(array)
+    timings["encode"] = (time.perf_counter() - started) * 1000
+    return png_bytes
+
+
+def prepare_image_for_ocr(image_bytes, image, is_manga):
+    """pipeline ภาพก่อน OCR: decode -> ย่อ -> ปรับภาพ -> encode
+    
+    คืน (png_bytes, (width, height), timings) โดย timings เป็นมิลลิวินาทีต่อขั้น
+    """
+    timings = {}
+    array = decode_for_ocr(image_bytes, image, is_manga, timings)
+    png_bytes = encode_for_ocr(array, is_manga, timings)
+    height, width = array.shape[:2]
+    return png_bytes, (width, height), timings
+
+
+def exit_with_parent(parent_pid):
+    """initializer ของ process pool ภาพ: ออกเองเมื่อ process ที่สร้าง pool ตาย (เช่น worker ถูก kill)
+    
+    process ใน pool ถือ pipe ของคิวงานไว้ทั้งสองฝั่ง จึงไม่ได้รับ EOF เมื่อ process แม่หายไป
+    """
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def _merge_boxes(boxes):
+    """รวมกรอบ (x, y, w, h) ที่ซ้อนหรือชนกันจนไม่เหลือคู่ที่ทับกัน"""
+    boxes = [list(box) for box in boxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                ax, ay, aw, ah = boxes[i]
+                bx, by, bw, bh = boxes[j]
+                if ax <= bx + bw and bx <= ax + aw and ay <= by + bh and by <= ay + ah:
+                    x, y = min(ax, bx), min(ay, by)
+                    boxes[i] = [x, y, max(ax + aw, bx + bw) - x, max(ay + ah, by + bh) - y]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(box) for box in boxes]
+
+
+def detect_text_regions(gray, padding=OCR_REGION_PADDING, max_boxes=2 * OCR_REGION_MAX_COUNT):
+    """หาบริเวณที่น่าจะมีข้อความในภาพ grayscale คืน list ของ (x, y, w, h)
+    
+    ใช้ 2 แบบรวมกัน: กลุ่ม connected component ขนาดตัวอักษร (screentone ซึ่งเป็นจุดเล็กมาก
+    และเส้นยาวถูกกรองออกด้วยขนาด) และ speech bubble ทั้งลูกที่มีตัวอักษรอยู่ข้างใน
+    กรอบก่อนรวมเกิน max_boxes คืน [] (หน้าแน่นเกินไป ส่งทั้งหน้า) ไม่ต้องเสียเวลารวมกรอบ
+    """
+    height, width = gray.shape[:2]
+    page_area = float(height * width)
+    dark = gray < 110
+    
+    # 1) กลุ่มตัวอักษร: connected component สีเข้มขนาดตัวอักษร รวมกันเป็น block
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(dark.astype(np.uint8), connectivity=8)
+    w, h, area = stats[:, 2], stats[:, 3], stats[:, 4]
+    glyph = (
+        (h >= 5) & (h <= 64) & (w >= 2) & (w <= 64) & (area >= 10)
+        & (area <= 0.9 * w * h) & (w <= 6 * h) & (h <= 8 * w)
+    )
+    glyph[0] = False
+    if not glyph.any():
+        return []
+    centers = centroids[glyph]
+    
+    def glyphs_in(bx, by, bw, bh):
+        return np.count_nonzero(
+            (centers[:, 0] >= bx) & (centers[:, 0] < bx + bw)
+            & (centers[:, 1] >= by) & (centers[:, 1] < by + bh)
+        )
+    
+    blocks = []
+    size = max(3, int(np.median(h[glyph])))
+    mask = cv2.dilate(glyph[labels].astype(np.uint8), np.ones((size, size), np.uint8))
+    count, _, block_stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if count - 1 > max_boxes:
+        return []
+    for bx, by, bw, bh, _ in block_stats[1:count]:
+        if glyphs_in(bx, by, bw, bh) >= 3 and bw * bh <= 0.15 * page_area:
+            blocks.append((int(bx), int(by), int(bw), int(bh)))
+    
+    # 2) speech bubble: บริเวณขาวปิดที่มีรูปทรงโค้งนูน (กรอบเต็มประมาณ pi/4 ของ bounding box)
+    #    และมีตัวอักษรอยู่ข้างใน กล่องบรรยายสี่เหลี่ยมยังได้จาก block ในขั้นที่ 1
+    white = (cv2.GaussianBlur(gray, (3, 3), 0) >= 220).astype(np.uint8)
+    count, white_labels, stats, _ = cv2.connectedComponentsWithStats(white, connectivity=4)
+    index = np.arange(count)
+    x, y, w, h, area = (stats[:, i].astype(np.int64) for i in range(5))
+    candidate = (
+        (index > 0)
+        & (area >= 0.002 * page_area) & (area <= 0.25 * page_area)
+        & (w * 5 >= h) & (h * 5 >= w)
+        & (x > 0) & (y > 0) & (x + w < width) & (y + h < height)
+    )
+    bubbles = []
+    for label in index[candidate]:
+        bx, by, bw, bh = int(x[label]), int(y[label]), int(w[label]), int(h[label])
+        component = (white_labels[by:by + bh, bx:bx + bw] == label).astype(np.uint8)
+        contours, _ = cv2.findContours(component, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        outline = max(contours, key=cv2.contourArea)
+        filled = cv2.contourArea(outline)
+        hull = cv2.contourArea(cv2.convexHull(outline))
+        if not 0.6 <= filled / float(bw * bh) <= 0.9 or hull <= 0 or filled / hull < 0.9:
+            continue
+        if glyphs_in(bx, by, bw, bh) >= 3:
+            bubbles.append((bx, by, bw, bh))
+    
+    def inside_bubble(box):
+        cx, cy = box[0] + box[2] / 2.0, box[1] + box[3] / 2.0
+        return any(bx <= cx <= bx + bw and by <= cy <= by + bh for bx, by, bw, bh in bubbles)
+    
+    boxes = bubbles + [box for box in blocks if not inside_bubble(box)]
+    if len(boxes) > max_boxes:
+        return []
+    regions = []
+    for x, y, w, h in boxes:
+        x0, y0 = max(0, x - padding), max(0, y - padding)
+        x1, y1 = min(width, x + w + padding), min(height, y + h + padding)
+        regions.append((x0, y0, x1 - x0, y1 - y0))
+    return _merge_boxes(regions)
+
+
+def pack_mosaic(array, regions, gap=OCR_MOSAIC_GAP):
+    """ตัดภาพตาม regions แล้ววางเรียงแบบ shelf packing บนพื้นขาว
+    
+    คืน (mosaic, placements) โดย placement แต่ละอันบอกตำแหน่งใน mosaic (x, y, w, h)
+    และตำแหน่งบนหน้าเดิม (page_x, page_y)
+    """
+    total_area = sum((w + gap) * (h + gap) for _, _, w, h in regions)
+    widest = max(w for _, _, w, _ in regions)
+    limit = max(widest + 2 * gap, min(array.shape[1], int(math.sqrt(total_area) * 1.3)))
+    
+    placements = []
+    x, y, shelf_height = gap, gap, 0
+    for page_x, page_y, w, h in sorted(regions, key=lambda box: -box[3]):
+        if x > gap and x + w + gap > limit:
+            x, y, shelf_height = gap, y + shelf_height + gap, 0
+        placements.append({"x": x, "y": y, "w": w, "h": h, "page_x": page_x, "page_y": page_y})
+        x += w + gap
+        shelf_height = max(shelf_height, h)
+    
+    mosaic_width = max(p["x"] + p["w"] for p in placements) + gap
+    mosaic_height = y + shelf_height + gap
+    mosaic = np.full((mosaic_height, mosaic_width) + array.shape[2:], 255, dtype=np.uint8)
+    for p in placements:
+        mosaic[p["y"]:p["y"] + p["h"], p["x"]:p["x"] + p["w"]] = \
+            array[p["page_y"]:p["page_y"] + p["h"], p["page_x"]:p["page_x"] + p["w"]]
+    return mosaic, placements
+
+
+def prepare_regions_for_ocr(image_bytes, image, is_manga):
+    """เหมือน prepare_image_for_ocr แต่ส่งเฉพาะบริเวณที่มีข้อความ (รวมเป็น mosaic ภาพเดียว)
+    
+    คืน (png_bytes, (width, height), timings, placements) โดย (width, height) คือขนาดหน้า
+    ที่ย่อแล้ว และ placements เป็น None ถ้าหา region ไม่ได้/ครอบคลุมเกินไป (ส่งทั้งหน้า)
+    """
+    timings = {}
+    array = decode_for_ocr(image_bytes, image, is_manga, timings)
+    height, width = array.shape[:2]
+    
+    started = time.perf_counter()
+    gray = array if array.ndim == 2 else cv2.cvtColor(array, cv2.COLOR_BGR2GRAY)
+    regions = detect_text_regions(gray)
+    coverage = sum(w * h for _, _, w, h in regions) / float(width * height)
+    placements = None
+    if regions and len(regions) <= OCR_REGION_MAX_COUNT and coverage <= OCR_REGION_MAX_COVERAGE:
+        array, placements = pack_mosaic(array, regions)
+    timings["regions"] = (time.perf_counter() - started) * 1000
+    
+    png_bytes = encode_for_ocr(array, is_manga, timings)
+    return png_bytes, (width, height), timings, placements
+
+
+def perceptual_hash(image_bytes, image=None):
+    """dHash 64 บิต: ย่อ grayscale เป็น 9x8 แล้วเทียบความสว่างของ pixel ที่ติดกันในแนวนอน
+    
+    ทนต่อการบีบอัดซ้ำและการย่อ/ขยาย (JPEG ใช้ reduced decode จึงเร็วมาก) แต่ละเอียดไม่พอจะเห็นข้อความ
+    ใช้หาผู้สมัครเท่านั้น ต้องยืนยันด้วย detail_fingerprint
+    """
+    gray = decode_image_array(image_bytes, image, grayscale=True, max_side=64)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+DETAIL_SIZE = 512
+DETAIL_CELL = 16
+
+
+def detail_fingerprint(image_bytes, image=None):
+    """ภาพย่อ grayscale 512x512 (blur เล็กน้อยให้ screentone เรียบ) เข้ารหัส JPEG สำหรับยืนยันภาพใกล้เคียง
+    
+    ความละเอียดนี้ยังเห็นตัวอักษรใน speech bubble ซึ่ง dHash 9x8 มองไม่เห็น
+    คืน None ถ้า encode ไม่ได้ (ภาพนี้จะไม่ถูกใช้/เก็บในดัชนี phash)
+    """
+    gray = decode_image_array(image_bytes, image, grayscale=True, max_side=DETAIL_SIZE * 2)
+    small = cv2.resize(gray, (DETAIL_SIZE, DETAIL_SIZE), interpolation=cv2.INTER_AREA)
+    small = cv2.GaussianBlur(small, (0, 0), 1)
+    ok, encoded = cv2.imencode('.jpg', small, [cv2.IMWRITE_JPEG_QUALITY, 70])
+    if not ok:
+        return None
+    return encoded.tobytes()
+
+
+def detail_difference(detail_a, detail_b):
+    """ความต่างเฉลี่ยของช่อง 16x16 px ที่ต่างกันมากที่สุด (0-255) ระหว่างภาพย่อสองภาพ
+    
+    ใช้ค่าสูงสุดรายช่องแทนค่าเฉลี่ยทั้งภาพ ข้อความที่ต่างกันในบริเวณเล็กๆ จึงไม่ถูกเฉลี่ยหายไป
+    """
+    a = cv2.imdecode(np.frombuffer(detail_a, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    b = cv2.imdecode(np.frombuffer(detail_b, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if a is None or b is None or a.shape != b.shape:
+        return float('inf')
+    cells = DETAIL_SIZE // DETAIL_CELL
+    diff = cv2.absdiff(a, b).astype(np.float32).reshape(cells, DETAIL_CELL, cells, DETAIL_CELL)
+    return float(diff.mean(axis=(1, 3)).max())
+
+
+def same_aspect(size_a, size_b, tolerance=0.01):
+    """สัดส่วนภาพเท่ากัน (ภาพที่ถูก crop ใช้พิกัดเดิมไม่ได้เพราะ rescale_overlay ปรับแค่สเกล)"""
+    aspect_a = size_a[0] / float(size_a[1])
+    aspect_b = size_b[0] / float(size_b[1])
+    return abs(aspect_a - aspect_b) <= tolerance * aspect_b
+
+
+def ocr_overlay_size(size):
+    """ขนาดภาพหลังเตรียม OCR (ที่พิกัด overlay อ้างอิง) จากขนาดภาพต้นฉบับ"""
+    width, height = size
+    limit = min(width, height) if needs_tiling(size) else max(width, height)
+    if limit <= OCR_MAX_SIDE:
+        return width, height
+    scale = OCR_MAX_SIDE / float(limit)
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def rescale_overlay(text_overlay, from_size, to_size):
+    """ปรับพิกัดใน TextOverlay จากภาพขนาด from_size เป็น to_size"""
+    sx = to_size[0] / float(from_size[0])
+    sy = to_size[1] / float(from_size[1])
+    lines = []
+    for line in (text_overlay or {}).get("Lines", []):
+        words = [
+            dict(
+                word,
+                Left=int(round(word["Left"] * sx)),
+                Top=int(round(word["Top"] * sy)),
+                Width=int(round(word["Width"] * sx)),
+                Height=int(round(word["Height"] * sy))
+            )
+            for word in line.get("Words", [])
+        ]
+        scaled = dict(line, Words=words)
+        if "MinTop" in line:
+            scaled["MinTop"] = int(round(line["MinTop"] * sy))
+        if "MaxHeight" in line:
+            scaled["MaxHeight"] = int(round(line["MaxHeight"] * sy))
+        lines.append(scaled)
+    return dict(text_overlay or {}, Lines=lines)
+
+
+def image_dimensions(image_bytes, image=None):
+    """ขนาด (width, height) ของภาพจาก header โดยไม่ถอดรหัสทั้งภาพ (None ถ้าอ่านไม่ได้)"""
+    if image_bytes is None:
+        return image.size
+    try:
+        return Image.open(io.BytesIO(image_bytes)).size
+    except Exception:
+        return None
+
+
+def check_image_size(size):
+    """ปฏิเสธภาพที่อ่าน header ไม่ได้หรือมี pixel เกิน IMAGE_MAX_PIXELS ก่อนถอดรหัส (กัน decompression bomb)"""
+    if size is None:
+        raise ValueError("ไม่รู้จักรูปแบบภาพ")
+    if IMAGE_MAX_PIXELS and size[0] * size[1] > IMAGE_MAX_PIXELS:
+        raise ValueError(f"ภาพใหญ่เกินไป ({size[0]}x{size[1]})")
+
+
+def needs_tiling(size):
+    """ภาพสัดส่วนสุดขั้ว (ย่อทั้งภาพแล้วอ่านไม่ออก) ต้อง OCR แบบ tile"""
+    return bool(OCR_TILE_ASPECT) and size is not None and min(size) > 0 \
+        and max(size) / float(min(size)) >= OCR_TILE_ASPECT
+
+
+def tile_spans(length, tile_length=OCR_TILE_LENGTH, overlap=OCR_TILE_OVERLAP, max_tiles=OCR_TILE_MAX):
+    """แบ่งความยาว length เป็นช่วง [start, end) ที่ซ้อนกัน overlap (ขยาย tile ถ้าเกิน max_tiles)"""
+    if length <= tile_length:
+        return [(0, length)]
+    step = tile_length - overlap
+    if math.ceil((length - overlap) / float(step)) > max_tiles:
+        step = int(math.ceil((length - overlap) / float(max_tiles)))
+        tile_length = step + overlap
+    spans = []
+    start = 0
+    while True:
+        end = min(length, start + tile_length)
+        spans.append((max(0, end - tile_length), end))
+        if end >= length:
+            return spans
+        start += step
+
+
+def prepare_tiles_for_ocr(image_bytes, image, is_manga):
+    """ตัดภาพยาวเป็น tile ที่ซ้อนกันตามแกนยาว โดยคงความละเอียด (ย่อเฉพาะด้านสั้นที่เกิน OCR_MAX_SIDE)
+    
+    คืน (tiles, (width, height), timings) โดย tiles เป็น list ของ
+    {"image": png, "offset": [x, y], "span": [start, end]}
+    """
+    timings = {}
+    started = time.perf_counter()
+    # ไม่ใช้ reduced decode เพราะจะทำให้ด้านสั้นเล็กเกินไป
+    array = decode_image_array(image_bytes, image, grayscale=is_manga, max_side=sys.maxsize)
+    timings["decode"] = (time.perf_counter() - started) * 1000
+    
+    started = time.perf_counter()
+    height, width = array.shape[:2]
+    short_side = min(height, width)
+    if short_side > OCR_MAX_SIDE:
+        array = downscale_array(array, int(OCR_MAX_SIDE * max(height, width) / float(short_side)))
+        height, width = array.shape[:2]
+    timings["resize"] = (time.perf_counter() - started) * 1000
+    
+    vertical = height >= width
+    tiles = []
+    encode_timings = {}
+    for start, end in tile_spans(height if vertical else width):
+        tile = array[start:end] if vertical else array[:, start:end]
+        tile = np.ascontiguousarray(tile)
+        tile_timings = {}
+        png_bytes = encode_for_ocr(tile, is_manga, tile_timings)
+        for stage, ms in tile_timings.items():
+            encode_timings[stage] = encode_timings.get(stage, 0.0) + ms
+        tiles.append({"image": png_bytes, "offset": [0, start] if vertical else [start, 0], "span": [start, end]})
+    timings.update(encode_timings)
+    return tiles, (width, height), timings
+
+
+def _line_box(line):
+    words = line.get("Words") or []
+    if not words:
+        return None
+    left = min(w["Left"] for w in words)
+    top = min(w["Top"] for w in words)
+    right = max(w["Left"] + w["Width"] for w in words)
+    bottom = max(w["Top"] + w["Height"] for w in words)
+    return left, top, right, bottom
+
+
+def merge_tile_overlays(tile_overlays, tiles, total_length):
+    """รวม TextOverlay ของแต่ละ tile เป็นพิกัดภาพเต็ม และตัดบรรทัดซ้ำในช่วงที่ tile ซ้อนกัน
+    
+    แต่ละ tile "เป็นเจ้าของ" ช่วงตั้งแต่กึ่งกลางของช่วงซ้อนด้านบนถึงกึ่งกลางช่วงซ้อนด้านล่าง
+    บรรทัดจะถูกเก็บจาก tile ที่เป็นเจ้าของจุดกึ่งกลางของบรรทัดเท่านั้น บรรทัดที่ถูกตัดครึ่งที่ขอบ tile
+    จึงได้จาก tile ถัดไปที่เห็นทั้งบรรทัด
+    """
+    axis = 1 if all(tile["offset"][0] == 0 for tile in tiles) else 0
+    
+    lines = []
+    for index, (overlay, tile) in enumerate(zip(tile_overlays, tiles)):
+        start, end = tile["span"]
+        own_start = 0 if index == 0 else (start + tiles[index - 1]["span"][1]) / 2.0
+        own_end = total_length if index == len(tiles) - 1 else (end + tiles[index + 1]["span"][0]) / 2.0
+        dx, dy = tile["offset"]
+        for line in (overlay or {}).get("Lines", []):
+            words = [dict(w, Left=w["Left"] + dx, Top=w["Top"] + dy) for w in line.get("Words", [])]
+            moved = dict(line, Words=words)
+            if words:
+                moved["MinTop"] = min(w["Top"] for w in words)
+            box = _line_box(moved)
+            if box is None:
+                continue
+            center = (box[axis] + box[axis + 2]) / 2.0
+            if own_start <= center < own_end or (index == len(tiles) - 1 and center == own_end):
+                lines.append(moved)
+    
+    # กันซ้ำอีกชั้น: บรรทัดข้อความเดียวกันที่กรอบทับกันเกินครึ่ง
+    kept = []
+    for line in lines:
+        box = _line_box(line)
+        text = re.sub(r'\s+', '', line.get("LineText", ""))
+        duplicate = False
+        for other in kept:
+            other_box = _line_box(other)
+            if re.sub(r'\s+', '', other.get("LineText", "")) != text:
+                continue
+            ix = max(0, min(box[2], other_box[2]) - max(box[0], other_box[0]))
+            iy = max(0, min(box[3], other_box[3]) - max(box[1], other_box[1]))
+            smaller = min((box[2] - box[0]) * (box[3] - box[1]), (other_box[2] - other_box[0]) * (other_box[3] - other_box[1]))
+            if smaller > 0 and ix * iy > 0.5 * smaller:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(line)
+    
+    return {"Lines": kept, "HasOverlay": bool(kept)}
+
+
+def remap_mosaic_overlay(text_overlay, placements, right_to_left=False):
+    """แปลงพิกัดใน TextOverlay จาก mosaic กลับเป็นพิกัดบนหน้าเดิม
+    
+    บรรทัดที่ OCR รวมคำจากหลาย crop จะถูกแยกตาม crop คืน (text_overlay, text)
+    โดยเรียงบรรทัดตามตำแหน่ง crop บนหน้า (บนลงล่าง, มังงะขวาไปซ้าย)
+    """
+    def placement_for(word):
+        cx = word["Left"] + word["Width"] / 2.0
+        cy = word["Top"] + word["Height"] / 2.0
+        for index, p in enumerate(placements):
+            if p["x"] <= cx <= p["x"] + p["w"] and p["y"] <= cy <= p["y"] + p["h"]:
+                return index
+        # คำที่เลยขอบ crop เล็กน้อย ใช้ crop ที่ใกล้ที่สุด
+        return min(
+            range(len(placements)),
+            key=lambda i: abs(cx - (placements[i]["x"] + placements[i]["w"] / 2.0))
+            + abs(cy - (placements[i]["y"] + placements[i]["h"] / 2.0))
+        )
+    
+    grouped = {}
+    for line in (text_overlay or {}).get("Lines", []):
+        joiner = " " if " " in line.get("LineText", "") else ""
+        parts = OrderedDict()
+        for word in line.get("Words", []):
+            index = placement_for(word)
+            p = placements[index]
+            parts.setdefault(index, []).append(dict(
+                word,
+                Left=word["Left"] - p["x"] + p["page_x"],
+                Top=word["Top"] - p["y"] + p["page_y"]
+            ))
+        for index, words in parts.items():
+            grouped.setdefault(index, []).append({
+                "LineText": joiner.join(w["WordText"] for w in words),
+                "Words": words,
+                "MaxHeight": max(w["Height"] for w in words),
+                "MinTop": min(w["Top"] for w in words)
+            })
+    
+    order = sorted(
+        grouped,
+        key=lambda i: (placements[i]["page_y"], -placements[i]["page_x"] if right_to_left else placements[i]["page_x"])
+    )
+    lines = []
+    for index in order:
+        lines.extend(sorted(grouped[index], key=lambda line: line["MinTop"]))
+    text = "\n".join(line["LineText"] for line in lines)
+    return dict(text_overlay or {}, Lines=lines), text
+
+
+class OCREngine(abc.ABC):
+    """interface ของ OCR backend
+    
+    recognize() รับ PNG bytes ที่เตรียมแล้ว และคืน dict รูปแบบเดียวกับ
+    improve_ocr_accuracy ({"success", "text", "text_overlay", ...} หรือ {"error"})
+    exception ที่หลุดออกมา OCRRouter จะแปลงเป็น {"error"} แล้วลอง engine ถัดไป
+    """
+
+    name = "base"
+
+    def available(self):
+        return True
+
+    @abc.abstractmethod
+    def recognize(self, image_bytes, is_manga, language):
+        """OCR ภาพหนึ่งภาพ คืน dict ผลลัพธ์หรือ {"error": ...}"""
+
+
+class OCRSpaceEngine(OCREngine):
+    """OCR.space API (remote)"""
+
+    name = "ocr_space"
+
+    def __init__(self, app):
+        self.app = app
+
+    def recognize(self, image_bytes, is_manga, language):
+        return self.app._call_ocr_space(image_bytes, is_manga, language)
+
+
+class TesseractEngine(OCREngine):
+    """Tesseract ในเครื่อง (offline) ต้องมี pytesseract และ tesseract-ocr"""
+
+    name = "tesseract"
+
+    def __init__(self, app, config=TESSERACT_CONFIG):
+        self.app = app
+        self.config = config
+        self._languages = None
+
+    def available(self):
+        if pytesseract is None:
+            return False
+        if self._languages is None:
+            try:
+                self._languages = set(pytesseract.get_languages(config=''))
+            except Exception:
+                self._languages = set()
+        return bool(self._languages)
+
+    def _language(self, language):
+        # โค้ดภาษาของ OCR.space (eng+jpn+...) ตรงกับ traineddata ของ Tesseract ใช้เฉพาะที่ติดตั้งไว้
+        wanted = [code for code in language.split('+') if code in self._languages]
+        return '+'.join(wanted) or 'eng'
+
+    def recognize(self, image_bytes, is_manga, language):
+        if not self.available():
+            return {"error": "Tesseract ไม่พร้อมใช้งาน"}
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            data = pytesseract.image_to_data(
+                image,
+                lang=self._language(language),
+                config=self.config,
+                output_type=pytesseract.Output.DICT
+            )
+        except Exception as e:
+            return {"error": f"Tesseract Error: {str(e)}"}
+        
+        # รวมคำเป็นบรรทัดตาม (block, paragraph, line) ให้ได้ TextOverlay แบบ OCR.space
+        lines = OrderedDict()
+        for i, word in enumerate(data.get("text", [])):
+            word = (word or "").strip()
+            if not word or float(data["conf"][i]) < 0:
+                continue
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            lines.setdefault(key, []).append({
+                "WordText": word,
+                "Left": data["left"][i],
+                "Top": data["top"][i],
+                "Height": data["height"][i],
+                "Width": data["width"][i]
+            })
+        
+        overlay_lines = []
+        for words in lines.values():
+            joiner = "" if self.app.detect_language_advanced("".join(w["WordText"] for w in words)) in ('ja', 'zh', 'th') else " "
+            overlay_lines.append({
+                "LineText": joiner.join(w["WordText"] for w in words),
+                "Words": words,
+                "MaxHeight": max(w["Height"] for w in words),
+                "MinTop": min(w["Top"] for w in words)
+            })
+        
+        text = "\n".join(line["LineText"] for line in overlay_lines).strip()
+        if not text:
+            return {"error": OCR_NO_TEXT_ERROR}
+        
+        text_overlay = {"Lines": overlay_lines, "HasOverlay": True}
+        return self.app.ocr_success_result(
+            text, text_overlay, {"ParsedText": text, "TextOverlay": text_overlay, "engine": self.name}
+        )
+
+
+class OCRRouter:
+    """เลือก OCR engine ตาม policy และสลับไป engine สำรองเมื่อช้าหรือล้มเหลว"""
+
+    def __init__(self, engines, latency, policy=OCR_ROUTING, fallback_after=OCR_FALLBACK_AFTER):
+        self.engines = OrderedDict((engine.name, engine) for engine in engines)
+        self.latency = latency
+        self.policy = policy
+        self.fallback_after = fallback_after
+        self.executor = ThreadPoolExecutor(max_workers=OCR_CONCURRENCY * 2)
+
+    def order(self, preferred=None):
+        """ลำดับ engine ที่จะลอง (เฉพาะที่พร้อมใช้งาน)"""
+        names = [name for name, engine in self.engines.items() if engine.available()]
+        if self.policy == 'local':
+            names.sort(key=lambda name: name != 'tesseract')
+        elif self.policy == 'fastest':
+            # engine ที่ยังไม่มีข้อมูล latency ได้ลองก่อน เพื่อเก็บข้อมูล
+            names.sort(key=lambda name: self.latency.percentile(f"ocr:{name}", 50) or 0.0)
+        if preferred in names:
+            names.remove(preferred)
+            names.insert(0, preferred)
+        return names
+
+    def _run(self, name, image_bytes, is_manga, language):
+        start = time.time()
+        try:
+            result = self.engines[name].recognize(image_bytes, is_manga, language)
+        except Exception as e:
+            # engine พังไม่ควรหยุด fallback chain
+            result = {"error": f"{name}: {str(e)}"}
+        # "ไม่พบข้อความ" ถือว่า engine ทำงานปกติ
+        ok = bool(result.get("success")) or result.get("error") == OCR_NO_TEXT_ERROR
+        self.latency.record(f"ocr:{name}", time.time() - start, ok)
+        return dict(result, engine=name)
+
+    def recognize(self, image_bytes, is_manga, language, preferred=None):
+        """OCR ด้วย engine แรกตามลำดับ ถ้าล้มเหลวหรือเกิน fallback_after วินาทีจะเริ่ม engine ถัดไป"""
+        if preferred == 'auto':
+            preferred = None
+        names = self.order(preferred)
+        if not names:
+            return {"error": "ไม่มี OCR engine ที่พร้อมใช้งาน"}
+        
+        futures = {}
+        last_result = {"error": "ไม่มี OCR engine ที่พร้อมใช้งาน"}
+        for name in names:
+            futures[self.executor.submit(self._run, name, image_bytes, is_manga, language)] = name
+            pending = set(futures)
+            while pending:
+                done, pending = wait(
+                    pending,
+                    timeout=self.fallback_after or None,
+                    return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    del futures[future]
+                    result = future.result()
+                    if result.get("success") or result.get("error") == OCR_NO_TEXT_ERROR:
+                        return result
+                    last_result = result
+                if not done:
+                    # engine ปัจจุบันช้าเกินไป เริ่ม engine ถัดไปคู่ขนาน
+                    break
+        
+        # ลองครบทุก engine แล้ว รอผลที่ยังค้างอยู่
+        for future in as_completed(list(futures)):
+            result = future.result()
+            if result.get("success") or result.get("error") == OCR_NO_TEXT_ERROR:
+                return result
+            last_result = result
+        return last_result
+
+    def get_stats(self):
+        return {
+            "policy": self.policy,
+            "order": self.order(),
+            "engines": {name: engine.available() for name, engine in self.engines.items()}
+        }
+
+
+class ProfessionalTranslationApp:
+    def __init__(self):
+        # metrics ต่อขั้น/provider (/api/metrics) และ profiler สำหรับ request ที่ช้า
+        self.metrics = MetricsRegistry()
+        self.profiler = SlowRequestProfiler()
+        
+        # HTTP client กลาง: connection pool ต่อ host + retry + circuit breaker
+        self.http = HTTPClient(metrics=self.metrics)
+        self.image_fetcher = ImageFetcher(self.http)
+        
+        # หลาย API keys สำหรับ fallback (โควตาต่อ key ตั้งผ่าน OCR_API_KEYS)
+        self.ocr_keys = OCRKeyScheduler(
+            parse_ocr_key_quotas(OCR_API_KEYS, OCR_KEY_SHARES),
+            breaker_for=lambda key: self.http.breaker(f"ocr:{key}")
+        )
+        self.ocr_api_keys = self.ocr_keys.keys
+        
+        # แคชผล OCR ตาม hash ของภาพ + is_manga + language
+        self.ocr_cache = TieredCache(
+            "ocr",
+            max_entries=OCR_CACHE_SIZE,
+            db_path=OCR_CACHE_DB,
+            ttl=OCR_CACHE_TTL,
+            max_disk_entries=OCR_CACHE_MAX_DISK_ENTRIES
+        )
+        # ดัชนี perceptual hash ชี้ไปยัง key ในแคชด้านบน (หาภาพเดียวกันจาก mirror อื่น)
+        self.phash_index = PerceptualHashIndex(PHASH_DB)
+        
+        # Pool สำหรับ batch pipeline (CPU / อัพโหลด OCR / แปลภาษา) และ OCR ทีละ tile ของภาพยาว
+        self.cpu_pool = ThreadPoolExecutor(max_workers=BATCH_CPU_WORKERS)
+        self.ocr_pool = ThreadPoolExecutor(max_workers=OCR_CONCURRENCY)
+        self.batch_translate_pool = ThreadPoolExecutor(max_workers=BATCH_TRANSLATE_WORKERS)
+        self.tile_pool = ThreadPoolExecutor(max_workers=OCR_CONCURRENCY)
+        # process pool ของ pipeline ภาพ (CPU_PROCESSES > 0) สร้างเมื่อใช้ครั้งแรกใน process ที่ใช้จริง
+        self._image_processes = None
+        self._image_processes_lock = threading.Lock()
+        
+        # สำหรับยิง API แปลภาษาพร้อมกัน + เก็บ latency ของแต่ละ provider
+        self.translation_executor = ThreadPoolExecutor(max_workers=TRANSLATION_WORKERS)
+        # ก้อนของข้อความยาว (แยก pool เพราะโหมด concurrent ใช้ translation_executor ซ้อนอยู่ข้างใน)
+        self.chunk_pool = ThreadPoolExecutor(max_workers=TRANSLATION_CHUNK_WORKERS)
+        self.provider_latency = LatencyTracker(metrics=self.metrics)
+        
+        # OCR backends: OCR.space (remote) + Tesseract (local, ถ้าติดตั้งไว้)
+        self.ocr_router = OCRRouter(
+            [OCRSpaceEngine(self), TesseractEngine(self)],
+            self.provider_latency
+        )
+        
+        # Translation memory: ข้อความซ้ำไม่ต้องเรียก API ใหม่
+        self.translation_memory = TieredCache(
+            "translation_memory",
+            max_entries=TRANSLATION_MEMORY_SIZE,
+            db_path=TRANSLATION_MEMORY_DB,
+            ttl=TRANSLATION_MEMORY_TTL,
+            max_disk_entries=TRANSLATION_MEMORY_MAX_DISK_ENTRIES
+        )
+        
+        # รวม OCR/การแปลที่ซ้ำกันขณะกำลังทำอยู่ให้เรียก API ครั้งเดียว
+        self.ocr_flights = SingleFlight()
+        self.translation_flights = SingleFlight()
+        
+        # รองรับหลายภาษาแบบละเอียด
+        self.supported_languages = {
+            'th': {'name': 'Thai', 'emoji': '🇹🇭'},
+            'en': {'name': 'English', 'emoji': '🇺🇸'},
+            'ja': {'name': 'Japanese', 'emoji': '🇯🇵'},
+            'ko': {'name': 'Korean', 'emoji': '🇰🇷'},
+            'zh': {'name': 'Chinese', 'emoji': '🇨🇳'},
+            'fr': {'name': 'French', 'emoji': '🇫🇷'},
+            'es': {'name': 'Spanish', 'emoji': '🇪🇸'},
+            'de': {'name': 'German', 'emoji': '🇩🇪'},
+            'ru': {'name': 'Russian', 'emoji': '🇷🇺'},
+            'vi': {'name': 'Vietnamese', 'emoji': '🇻🇳'},
+            'id': {'name': 'Indonesian', 'emoji': '🇮🇩'},
+            'hi': {'name': 'Hindi', 'emoji': '🇮🇳'},
+        }
+        
+        # Context dictionary สำหรับการแปลที่เข้าใจบริบท
+        self.context_phrases = {
+            'ja': {
+                'manga': {
+                    'お前': 'you (informal/male)',
+                    '俺': 'I (male)',
+                    '私': 'I (female/formal)',
+                    '君': 'you (friendly)',
+                    'ありがとう': 'thank you',
+                    'すみません': 'excuse me/sorry',
+                }
+            },
+            'ko': {
+                'manga': {
+                    '나는': 'I',
+                    '너': 'you',
+                    '감사합니다': 'thank you',
+                }
+            }
+        }
+        
+        # คำแทนที่ในคำแปลมังงะ (ตามภาษาต้นทาง) เช่นปรับคำสรรพนาม
+        self.manga_rewrites = {
+            'ja': {
+                'คุณ (ชาย)': 'แก',
+                'ฉัน (ชาย)': 'กู',
+                'ฉัน (หญิง)': 'ฉัน',
+            }
+        }
+        
+        # รวม glossary ในโค้ดกับไฟล์ภายนอกเป็น automaton (แทนที่ในรอบเดียว)
+        self.glossary = GlossaryStore(
+            {lang: contexts.get('manga', {}) for lang, contexts in self.context_phrases.items()},
+            self.manga_rewrites,
+            GLOSSARY_DIR,
+            GLOSSARY_RELOAD_INTERVAL
+        )
+    
+    def warm_up(self):
+        """เตรียมสิ่งที่ request แรกต้องใช้ (WARMUP=1 เรียกก่อนเปิด port)
+        
+        เปิด connection ไปยัง provider และตรวจ OCR engine คู่ขนานกับการโหลด OpenCV/NumPy,
+        pipeline ภาพขนาดเล็ก และฐานข้อมูลแคช คืนเวลาที่ใช้ของแต่ละส่วน (ms)
+        """
+        started = time.perf_counter()
+        background = [
+            self.translation_executor.submit(self.http.warm, url)
+            for url in (OCR_SPACE_URL, MYMEMORY_URL, LIBRETRANSLATE_URL)
+        ]
+        # ตรวจ engine (Tesseract: import pytesseract + ถามรายการภาษาจาก binary)
+        background.append(self.translation_executor.submit(self.ocr_router.order))
+        timings = {}
+        
+        step = time.perf_counter()
+        sample = io.BytesIO()
+        Image.new('RGB', (64, 96), 'white').save(sample, format='JPEG')
+        prepare_image_for_ocr(sample.getvalue(), None, True)
+        detect_text_regions(decode_image_array(sample.getvalue(), grayscale=True))
+        self.detect_language_advanced("warm up ウォームアップ")
+        timings["image_pipeline"] = (time.perf_counter() - step) * 1000
+        
+        if CPU_PROCESSES > 0:
+            # เริ่ม process ทุกตัวใน pool และโหลด OpenCV/NumPy ในแต่ละตัว
+            step = time.perf_counter()
+            pool = self.image_process_pool()
+            wait([pool.submit(prepare_image_for_ocr, sample.getvalue(), None, True) for _ in range(CPU_PROCESSES)])
+            timings["image_processes"] = (time.perf_counter() - step) * 1000
+        
+        step = time.perf_counter()
+        self.ocr_cache.get("warm-up")
+        self.translation_memory.get("warm-up")
+        self.phash_index.get_stats()
+        timings["caches"] = (time.perf_counter() - step) * 1000
+        
+        step = time.perf_counter()
+        wait(background, timeout=HTTP_WARM_TIMEOUT)
+        timings["background"] = (time.perf_counter() - step) * 1000
+        timings["total"] = (time.perf_counter() - started) * 1000
+        print(f"warm-up เสร็จใน {timings['total']:.0f} ms")
+        return timings
+    
+    def get_ocr_key(self):
+        """เลือก OCR API key ที่เหลืองบมากที่สุด (คืน None ถ้าทุก key หมดโควตา/พักอยู่)"""
+        return self.ocr_keys.acquire()
+    
+    def enhance_manga_image(self, image):
+        """ปรับปรุงภาพมังงะให้ OCR ทำงานได้ดีขึ้น"""
+        try:
+            # แปลงเป็น grayscale (รองรับ RGBA/palette) สำหรับ OpenCV
+            if isinstance(image, Image.Image):
+                gray = np.array(_flatten_pil_image(image, grayscale=True))
+            elif len(image.shape) == 3:
+                gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+            else:
+                gray = image.copy()
+            
+            return Image.fromarray(enhance_manga_array(gray))
+            
+        except Exception as e:
+            print(f"Image enhancement error: {e}")
+            return image
+    
+    def detect_language_advanced(self, text):
+        """ตรวจจับภาษาอย่างแม่นยำ (จัดกลุ่ม codepoint ด้วย NumPy ในรอบเดียว)
+        
+        แยกได้เฉพาะภาษาที่มีตัวอักษรของตัวเอง (th/ja/ko/zh/ru/hi/vi) ภาษาละตินอื่น (fr/es/de/id)
+        จะได้ 'en' ต้องเลือกภาษาต้นทางเอง
+        """
+        boundaries, labels = script_tables()
+        codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        positions = np.searchsorted(boundaries, codepoints, side='right')
+        inside = positions[positions % 2 == 1] // 2
+        counts = np.bincount(labels[inside], minlength=len(SCRIPT_NAMES))
+        
+        # นับตัวอักษรแต่ละภาษา (ญี่ปุ่น = คานะ + คันจิ, จีน = ตัวอักษรจีนทั้งหมด)
+        han = counts[SCRIPT_NAMES.index('han')]
+        asian_counts = [
+            ('th', counts[SCRIPT_NAMES.index('thai')]),
+            ('ja', counts[SCRIPT_NAMES.index('kana')] + han),
+            ('ko', counts[SCRIPT_NAMES.index('hangul')]),
+            ('zh', han),
+        ]
+        
+        # ตรวจสอบภาษาที่มีมากที่สุด (เท่ากันให้ภาษาที่อยู่ก่อนชนะ เหมือนเดิม)
+        detected_lang, best = max(asian_counts, key=lambda item: item[1])
+        if best > 0:
+            return detected_lang
+        
+        # ไม่พบตัวอักษรเอเชีย: ตรวจ Cyrillic / Devanagari / ตัวอักษรเฉพาะของเวียดนาม
+        # เทียบกับจำนวนตัวอักษรละติน (ตัวอักษรหลุดมาตัวเดียวในประโยคอังกฤษไม่นับ)
+        latin = counts[SCRIPT_NAMES.index('latin')]
+        other_counts = [
+            ('ru', counts[SCRIPT_NAMES.index('cyrillic')]),
+            ('hi', counts[SCRIPT_NAMES.index('devanagari')]),
+            ('vi', counts[SCRIPT_NAMES.index('vietnamese')]),
+        ]
+        detected_lang, best = max(other_counts, key=lambda item: item[1])
+        if best > 0 and best >= SCRIPT_MIN_SHARE[detected_lang] * (best + latin):
+            return detected_lang
+        
+        # ถ้าไม่พบตัวอักษรเฉพาะภาษาใด ให้ถือว่าเป็นอังกฤษ
+        return 'en'
+    
+    def load_image_bytes(self, image_input):
+        """โหลดข้อมูลภาพดิบจาก bytes / URL / base64 (คืน None ถ้าเป็นภาพ PIL อยู่แล้ว)"""
+        if isinstance(image_input, (bytes, bytearray, memoryview)):
+            # อัพโหลดแบบ binary (multipart / body ดิบ) ส่งต่อให้ decoder ได้ทันที
+            return bytes(image_input)
+        if isinstance(image_input, str):
+            if image_input.startswith('http'):
+                return self.image_fetcher.fetch(image_input)
+            # data URI หรือ base64 ล้วน: ถอดเฉพาะส่วนหลัง ","
+            return base64.b64decode(image_input[image_input.find(',') + 1:])
+        return None
+    
+    def ocr_cache_key(self, image_bytes, image, is_manga, language):
+        """สร้าง cache key จาก hash ของภาพที่ถอดรหัสแล้ว + พารามิเตอร์ OCR"""
+        digest = hashlib.sha256()
+        if image_bytes is not None:
+            digest.update(image_bytes)
+        else:
+            digest.update(f"{image.mode}:{image.size}".encode())
+            digest.update(image.tobytes())
+        return f"{digest.hexdigest()}:{int(bool(is_manga))}:{language}"
+    
+    def improve_ocr_accuracy(self, image_input, is_manga=False, language='eng+tha+jpn+kor', engine=None):
+        """OCR ที่แม่นยำขึ้น (มีแคชผลลัพธ์ตามเนื้อหาภาพ, engine: 'ocr_space' / 'tesseract' / None = ตาม policy)"""
+        try:
+            job = self.prepare_ocr_job(image_input, is_manga, language)
+        except Exception as e:
+            return {"error": f"เกิดข้อผิดพลาด: {str(e)}"}
+        return self.finish_ocr_job(job, is_manga, language, engine)
+    
+    def prepare_ocr_job(self, image_input, is_manga, language):
+        """ขั้น CPU: โหลดภาพ ตรวจแคช และเตรียม PNG สำหรับอัพโหลด"""
+        started = time.perf_counter()
+        image_bytes = self.load_image_bytes(image_input)
+        dimensions = image_dimensions(image_bytes, image_input)
+        check_image_size(dimensions)
+        cache_key = self.ocr_cache_key(image_bytes, image_input, is_manga, language)
+        load_ms = (time.perf_counter() - started) * 1000
+        
+        cached = self.ocr_cache.get(cache_key)
+        if cached is not None:
+            return {"cache_key": cache_key, "result": dict(cached, cache_hit=True, timings={"load": load_ms})}
+        
+        phash = None
+        detail = None
+        if self.phash_index.max_distance > 0:
+            started = time.perf_counter()
+            detail = detail_fingerprint(image_bytes, image_input)
+        if detail is not None:
+            phash = {
+                "hash": perceptual_hash(image_bytes, image_input),
+                "detail": detail,
+                "variant": f"{int(bool(is_manga))}:{language}"
+            }
+            near = self.find_near_duplicate(phash, cache_key, ocr_overlay_size(dimensions))
+            phash_ms = (time.perf_counter() - started) * 1000
+            if near is not None:
+                return {"cache_key": cache_key, "result": dict(near, timings={"load": load_ms, "phash": phash_ms})}
+        
+        if needs_tiling(dimensions):
+            # เว็บตูนยาวมาก: OCR หลาย tile ที่ความละเอียดเดิมแทนการย่อทั้งภาพ
+            tiles, size, timings = self.run_image_stage(prepare_tiles_for_ocr, image_bytes, image_input, is_manga)
+            job = {"tiles": tiles}
+        else:
+            png_bytes, size, timings, placements = self.prepare_ocr_image(image_bytes, image_input, is_manga)
+            job = {"image": png_bytes, "placements": placements}
+        
+        job.update(
+            cache_key=cache_key,
+            phash=phash,
+            overlay_size={"width": size[0], "height": size[1]},
+            timings=dict(load=load_ms, **timings)
+        )
+        return job
+    
+    def find_near_duplicate(self, phash, cache_key, overlay_size):
+        """หาผล OCR ของภาพที่ใกล้เคียง (บีบอัดซ้ำ/ย่อ) แล้วปรับพิกัดให้ตรงกับภาพนี้
+        
+        ผู้สมัครจาก dHash ต้องมีสัดส่วนภาพเท่ากันและภาพย่อ 512px ต่างไม่เกิน PHASH_DETAIL_TOLERANCE
+        (หน้าที่ภาพเหมือนกันแต่ข้อความต่างกันจะไม่ผ่าน) ผลที่พบจะถูกเก็บลงแคชด้วย key ของภาพนี้ด้วย
+        ครั้งถัดไปจึงเป็น exact hit
+        """
+        for distance, candidate_key, stored_size, detail in self.phash_index.lookup(
+            phash["hash"], phash["variant"], exclude=cache_key
+        ):
+            if (
+                not detail
+                or not same_aspect(overlay_size, stored_size)
+                or detail_difference(phash["detail"], detail) > PHASH_DETAIL_TOLERANCE
+            ):
+                self.phash_index.record_rejected()
+                continue
+            
+            stored = self.ocr_cache.get(candidate_key)
+            if stored is None:
+                # ผลเดิมหมดอายุ/ถูก evict จากแคชไปแล้ว
+                continue
+            
+            result = dict(
+                stored,
+                text_overlay=rescale_overlay(stored.get("text_overlay"), stored_size, overlay_size),
+                overlay_size={"width": overlay_size[0], "height": overlay_size[1]}
+            )
+            self.ocr_cache.set(cache_key, result)
+            self.phash_index.add(phash["hash"], cache_key, phash["variant"], overlay_size, phash["detail"])
+            self.phash_index.record_hit()
+            return dict(result, cache_hit=True, near_duplicate=True, phash_distance=distance)
+        return None
+    
+    def finish_ocr_job(self, job, is_manga, language, engine=None):
+        """ขั้น OCR: ส่งให้ engine ตาม routing policy (ถ้ายังไม่มีในแคช) แล้วเก็บผลลงแคช
+        
+        ภาพเดียวกันที่เข้ามาพร้อมกันจะรอผลจาก OCR ครั้งเดียว
+        """
+        if "result" in job:
+            return job["result"]
+        
+        started = time.perf_counter()
+        result, shared = self.ocr_flights.do(
+            f"{job['cache_key']}:{engine or 'auto'}", self._recognize_job, job, is_manga, language, engine
+        )
+        timings = dict(job.get("timings", {}), ocr=(time.perf_counter() - started) * 1000)
+        if shared:
+            result = dict(result, coalesced=True)
+        return dict(result, timings=timings)
+    
+    def _recognize_job(self, job, is_manga, language, engine):
+        if "tiles" in job:
+            futures = [
+                self.tile_pool.submit(self.ocr_router.recognize, tile["image"], is_manga, language, engine)
+                for tile in job["tiles"]
+            ]
+            result = self.merge_tile_results(job, [future.result() for future in futures])
+        else:
+            result = self.ocr_router.recognize(job["image"], is_manga, language, engine)
+        return self.store_ocr_result(job, result, is_manga)
+    
+    def merge_tile_results(self, job, results):
+        """รวมผล OCR ของทุก tile เป็นผลเดียว (tile ที่ error ถูกข้าม ถ้าทุก tile ไม่สำเร็จคืน error)"""
+        succeeded = [result for result in results if result.get("success")]
+        failed = [result for result in results if not result.get("success") and result.get("error") != OCR_NO_TEXT_ERROR]
+        if not succeeded:
+            return failed[0] if failed else {"error": OCR_NO_TEXT_ERROR}
+        
+        size = job["overlay_size"]
+        vertical = all(tile["offset"][0] == 0 for tile in job["tiles"])
+        text_overlay = merge_tile_overlays(
+            [result.get("text_overlay") if result.get("success") else None for result in results],
+            job["tiles"],
+            size["height"] if vertical else size["width"]
+        )
+        text = "\n".join(line.get("LineText", "") for line in text_overlay["Lines"]).strip()
+        if not text:
+            return {"error": OCR_NO_TEXT_ERROR}
+        
+        merged = self.ocr_success_result(text, text_overlay, {"ParsedText": text, "TextOverlay": text_overlay})
+        merged["engine"] = succeeded[0].get("engine")
+        merged["ocr_tiles"] = len(results)
+        if failed:
+            merged["ocr_tile_errors"] = len(failed)
+        return merged
+    
+    def store_ocr_result(self, job, result, is_manga):
+        """แปลงพิกัดจาก mosaic กลับเป็นพิกัดหน้า (ถ้ามี) แล้วเก็บผลที่สำเร็จลงแคช"""
+        if result.get("success"):
+            if job.get("placements"):
+                text_overlay, text = remap_mosaic_overlay(
+                    result.get("text_overlay"), job["placements"], right_to_left=is_manga
+                )
+                result = dict(
+                    result,
+                    text=text,
+                    word_count=len(text.split()),
+                    text_overlay=text_overlay,
+                    ocr_regions=len(job["placements"])
+                )
+            # ตำแหน่งใน text_overlay อ้างอิงภาพที่ย่อแล้วขนาดนี้
+            result["overlay_size"] = job["overlay_size"]
+            if not result.get("ocr_tile_errors"):
+                # ผลที่ขาดบาง tile ไม่เก็บแคช ให้ request ถัดไปลองใหม่
+                self.ocr_cache.set(job["cache_key"], result)
+                if job.get("phash"):
+                    size = job["overlay_size"]
+                    self.phash_index.add(
+                        job["phash"]["hash"], job["cache_key"], job["phash"]["variant"],
+                        (size["width"], size["height"]), job["phash"]["detail"]
+                    )
+        return result
+    
+    def prepare_ocr_image(self, image_bytes, image_input, is_manga):
+        """decode/ย่อ/ปรับภาพ/encode แบบ NumPy ตลอด pipeline คืน (png, (w, h), timings, placements)
+        
+        ตาม OCR_REGIONS จะส่งเฉพาะบริเวณข้อความเป็น mosaic (placements ใช้แปลงพิกัดกลับ)
+        """
+        if OCR_REGIONS == 'all' or (OCR_REGIONS == 'manga' and is_manga):
+            return self.run_image_stage(prepare_regions_for_ocr, image_bytes, image_input, is_manga)
+        png_bytes, size, timings = self.run_image_stage(prepare_image_for_ocr, image_bytes, image_input, is_manga)
+        return png_bytes, size, timings, None
+    
+    def image_process_pool(self):
+        """process pool ของ pipeline ภาพ (spawn เพราะ process นี้มี thread อยู่แล้ว fork ไม่ปลอดภัย)"""
+        with self._image_processes_lock:
+            if self._image_processes is None:
+                self._image_processes = ProcessPoolExecutor(
+                    max_workers=CPU_PROCESSES,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=exit_with_parent,
+                    initargs=(os.getpid(),)
+                )
+            return self._image_processes
+    
+    def run_image_stage(self, function, image_bytes, image_input, is_manga):
+        """รันขั้นเตรียมภาพ (prepare_*_for_ocr) ใน process pool ถ้าเปิด CPU_PROCESSES
+        
+        ส่งแค่ bytes ข้าม process ภาพ PIL จาก Gradio (image_bytes เป็น None) ทำใน process นี้
+        """
+        if CPU_PROCESSES <= 0 or image_bytes is None:
+            return function(image_bytes, image_input, is_manga)
+        return self.image_process_pool().submit(function, image_bytes, None, is_manga).result()
+    
+    def ocr_success_result(self, text, text_overlay, raw_result):
+        """ประกอบผล OCR ที่สำเร็จ (รูปแบบเดียวกันทุก engine)"""
+        # ตรวจจับภาษา
+        detected_lang = self.detect_language_advanced(text)
+        
+        return {
+            "success": True,
+            "text": text,
+            "word_count": len(text.split()),
+            "detected_language": detected_lang,
+            "text_overlay": text_overlay,  # ตำแหน่งข้อความสำหรับซ้อนภาพ
+            "raw_result": raw_result  # ข้อมูลดิบสำหรับการประมวลผลเพิ่มเติม
+        }
+    
+    def ocr_space_form(self, api_key, is_manga, language):
+        """พารามิเตอร์ของ OCR.space API"""
+        return {
+            "apikey": api_key,
+            "language": language,
+            "isOverlayRequired": True,  # ขอตำแหน่งข้อความสำหรับ Chrome Extension
+            "OCREngine": 2,
+            "scale": True,
+            "isTable": is_manga,  # สำหรับมังงะที่มีการจัดข้อความ
+            "detectOrientation": True,
+        }
+    
+    def handle_ocr_space_response(self, status, result, api_key):
+        """ตีความ response ของ OCR.space และแจ้งผลให้ key scheduler
+        
+        คืน (ผลลัพธ์, None) หรือ (None, error) เมื่อควรลอง key ถัดไป
+        """
+        if status in OCR_RATE_LIMIT_STATUS:
+            # key นี้โดน rate limit พัก key แล้วลอง key ถัดไป
+            self.ocr_keys.report(api_key, 'rate_limited')
+            return None, f"API Error: {status}"
+        
+        if status != 200 or not isinstance(result, dict):
+            # status อื่น (เช่น 403 key ถูกระงับ) หรือ 200 ที่ body ไม่ใช่ JSON: พัก key แล้วลอง key ถัดไป
+            self.ocr_keys.report(api_key, 'errored')
+            if status != 200:
+                return None, f"API Error: {status}"
+            return None, "OCR Error: response ไม่ใช่ JSON"
+        
+        if result.get("IsErroredOnProcessing"):
+            # key นี้มีปัญหา (เช่นเกินโควตา) ลอง key ถัดไป
+            self.http.breaker(f"ocr:{api_key}").record_failure()
+            self.ocr_keys.report(api_key, 'errored')
+            return None, f"OCR Error: {result.get('ErrorMessage', 'Unknown error')}"
+        
+        self.ocr_keys.report(api_key, 'ok')
+        
+        parsed_results = result.get("ParsedResults", [])
+        if parsed_results:
+            text_data = parsed_results[0]
+            text = text_data.get("ParsedText", "").strip()
+            
+            if text:
+                return self.ocr_success_result(text, text_data.get("TextOverlay", {}), text_data), None
+        
+        return {"error": OCR_NO_TEXT_ERROR}, None
+    
+    def _call_ocr_space(self, img_byte_arr, is_manga, language):
+        """เรียก OCR.space (retry ระดับ network อยู่ใน HTTPClient, ที่นี่สลับ key เมื่อ key มีปัญหา)"""
+        last_error = "OCR API ไม่พร้อมใช้งานชั่วคราว"
+        
+        for attempt in range(OCR_KEY_ATTEMPTS):
+            api_key = self.get_ocr_key()
+            if api_key is None:
+                break
+            breaker = self.http.breaker(f"ocr:{api_key}")
+            
+            # OCR.space API
+            try:
+                response = self.http.request(
+                    "POST",
+                    OCR_SPACE_URL,
+                    breaker=breaker,
+                    retries=OCR_MAX_RETRIES,
+                    retry_status=OCR_RETRY_STATUS,
+                    files={"image": img_byte_arr},
+                    data=self.ocr_space_form(api_key, is_manga, language),
+                    timeout=30
+                )
+            except CircuitOpenError:
+                continue
+            except Exception as e:
+                return {"error": f"เกิดข้อผิดพลาด: {str(e)}"}
+            
+            payload = None
+            if response.status_code == 200:
+                try:
+                    payload = response.json()
+                except ValueError:
+                    pass
+            result, error = self.handle_ocr_space_response(response.status_code, payload, api_key)
+            if result is not None:
+                return result
+            last_error = error
+        
+        return {"error": last_error}
+    
+    def translation_memory_key(self, text, source_lang, target_lang, context_type):
+        """สร้าง key ของ translation memory จากข้อความที่ normalize แล้ว"""
+        normalized = unicodedata.normalize('NFKC', text)
+        normalized = re.sub(r'\s+', ' ', normalized).strip()
+        raw = f"{source_lang}|{target_lang}|{context_type}|{normalized}"
+        if context_type == 'manga':
+            # glossary ใช้เฉพาะโหมดมังงะ: แก้ glossary แล้วคำแปลเดิมไม่ถูกใช้อีก
+            raw += f"|{self.glossary.revision(source_lang)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def _translate_mymemory(self, text, source_lang, target_lang):
+        """แปลด้วย MyMemory API คืนคำแปลหรือ None"""
+        start = time.time()
+        translated = None
+        try:
+            params = {
+                "q": text[:TRANSLATION_MAX_CHARS],
+                "langpair": f"{source_lang}|{target_lang}",
+                "de": "manga_translator@example.com",
+                "mt": "1"  # Machine translation
+            }
+            response = self.http.request(
+                "GET",
+                MYMEMORY_URL,
+                breaker=self.http.breaker("MyMemory"),
+                retries=TRANSLATION_MAX_RETRIES,
+                params=params,
+                timeout=10
+            )
+            if response.status_code == 200:
+                result = response.json()
+                candidate = result["responseData"]["translatedText"]
+                if candidate and candidate.strip() and candidate != text:
+                    translated = candidate
+        except CircuitOpenError:
+            # circuit เปิดอยู่ ไม่นับเป็น latency จริงของ provider
+            return None
+        except:
+            pass
+        self.provider_latency.record("MyMemory", time.time() - start, translated is not None)
+        return translated
+    
+    def _translate_libretranslate(self, text, source_lang, target_lang):
+        """แปลด้วย LibreTranslate คืนคำแปลหรือ None"""
+        start = time.time()
+        translated = None
+        try:
+            payload = {
+                "q": text[:TRANSLATION_MAX_CHARS],
+                "source": source_lang,
+                "target": target_lang,
+                "format": "text"
+            }
+            response = self.http.request(
+                "POST",
+                LIBRETRANSLATE_URL,
+                breaker=self.http.breaker("LibreTranslate"),
+                retries=TRANSLATION_MAX_RETRIES,
+                json=payload,
+                headers={"Content-Type": "application/json"},
+                timeout=10
+            )
+            if response.status_code == 200:
+                result = response.json()
+                candidate = result.get("translatedText", "").strip()
+                if candidate and candidate != text:
+                    translated = candidate
+        except CircuitOpenError:
+            # circuit เปิดอยู่ ไม่นับเป็น latency จริงของ provider
+            return None
+        except:
+            pass
+        self.provider_latency.record("LibreTranslate", time.time() - start, translated is not None)
+        return translated
+    
+    def _translate_sequential(self, text, source_lang, target_lang):
+        """เรียก MyMemory แล้วตามด้วย LibreTranslate (พฤติกรรมเดิม)"""
+        translation_attempts = []
+        
+        # Attempt 1: MyMemory API
+        translated = self._translate_mymemory(text, source_lang, target_lang)
+        if translated:
+            translation_attempts.append(("MyMemory", translated))
+        
+        # Attempt 2: LibreTranslate
+        translated = self._translate_libretranslate(text, source_lang, target_lang)
+        if translated:
+            translation_attempts.append(("LibreTranslate", translated))
+        
+        return translation_attempts
+    
+    def hedge_deadline(self):
+        """เวลาที่ยอมรอ MyMemory (p90 ของ latency จริง จำกัดอยู่ในช่วง MIN-MAX)"""
+        p90 = self.provider_latency.percentile("MyMemory", 90)
+        if p90 is None:
+            return TRANSLATION_HEDGE_MAX
+        return min(TRANSLATION_HEDGE_MAX, max(TRANSLATION_HEDGE_MIN, p90 * 1.2))
+    
+    def _translate_hedged(self, text, source_lang, target_lang):
+        """ยิง MyMemory และ LibreTranslate พร้อมกัน
+        
+        คืนผล MyMemory ทันทีที่ได้ ถ้า MyMemory ล้มเหลวหรือเลย hedge deadline
+        จะใช้ผล LibreTranslate แทน ส่วน request ที่แพ้จะถูกปล่อยทิ้ง (ไม่รอผล)
+        """
+        providers = {
+            self.translation_executor.submit(self._translate_mymemory, text, source_lang, target_lang): "MyMemory",
+            self.translation_executor.submit(self._translate_libretranslate, text, source_lang, target_lang): "LibreTranslate",
+        }
+        deadline = time.time() + self.hedge_deadline()
+        results = {}
+        pending = set(providers)
+        
+        while pending:
+            remaining = deadline - time.time()
+            done, pending = wait(
+                pending,
+                timeout=remaining if remaining > 0 else None,
+                return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                results[providers[future]] = future.result()
+            
+            if results.get("MyMemory"):
+                return [("MyMemory", results["MyMemory"])]
+            
+            preferred_failed = "MyMemory" in results
+            if (preferred_failed or time.time() >= deadline) and results.get("LibreTranslate"):
+                return [("LibreTranslate", results["LibreTranslate"])]
+        
+        return []
+    
+    def preprocess_for_context(self, text, source_lang, context_type):
+        """ประมวลผลข้อความก่อนแปล (สำหรับมังงะ: แทรกความหมายของคำศัพท์เฉพาะ)"""
+        if context_type != 'manga':
+            return text
+        
+        # แทนที่คำศัพท์เฉพาะก่อนแปล (คำที่ยาวกว่าชนะ ไม่แทนซ้อนกัน)
+        automaton = self.glossary.get('phrases', source_lang)
+        return automaton.replace(text) if automaton else text
+    
+    def _translate_best(self, processed_text, source_lang, target_lang, mode=None):
+        """เรียก provider ตามโหมด แล้วคืน (api_name, คำแปล) ที่ดีที่สุด หรือ None"""
+        if (mode or TRANSLATION_MODE) == 'concurrent':
+            translation_attempts = self._translate_hedged(processed_text, source_lang, target_lang)
+        else:
+            translation_attempts = self._translate_sequential(processed_text, source_lang, target_lang)
+        
+        if not translation_attempts:
+            return None
+        
+        # ให้ความสำคัญกับ MyMemory ก่อน (มักจะดีกว่าสำหรับภาษาตะวันออก)
+        for api_name, translation in translation_attempts:
+            if api_name == "MyMemory":
+                return api_name, translation
+        return translation_attempts[0]
+    
+    def _begin_translation(self, text, target_lang, source_lang, context_type):
+        """ขั้นก่อนเรียก API: ตรวจจับภาษา ภาษาเดียวกัน และ translation memory
+        
+        คืน (result, state) ถ้า result ไม่ใช่ None แปลว่าตอบได้ทันทีไม่ต้องเรียก API
+        """
+        # ตรวจจับภาษาต้นทาง
+        if source_lang == 'auto':
+            source_lang = self.detect_language_advanced(text)
+        
+        if source_lang == target_lang:
+            return {
+                "success": True,
+                "translated_text": text,
+                "source_lang": source_lang,
+                "target_lang": target_lang,
+                "context_used": "same_language"
+            }, None
+        
+        # ข้อความที่เคยแปลแล้ว ไม่ต้องเรียก API
+        memory_key = self.translation_memory_key(text, source_lang, target_lang, context_type)
+        remembered = self.translation_memory.get(memory_key)
+        if remembered is not None:
+            return {
+                "success": True,
+                "translated_text": remembered["translated_text"],
+                "source_lang": source_lang,
+                "target_lang": target_lang,
+                "api_used": remembered["api_used"],
+                "context_type": context_type,
+                "cache_hit": True
+            }, None
+        
+        # ประมวลผลข้อความก่อนแปล (สำหรับมังงะ)
+        return None, {
+            "source_lang": source_lang,
+            "memory_key": memory_key,
+            "processed_text": self.preprocess_for_context(text, source_lang, context_type)
+        }
+    
+    def _finish_translation(self, best, state, target_lang, context_type):
+        """ขั้นหลังเรียก API: ปรับคำแปล บันทึก translation memory และประกอบผลลัพธ์"""
+        if not best:
+            return {"error": "ไม่สามารถแปลข้อความได้ในขณะนี้"}
+        
+        best_api, best_translation = best
+        source_lang = state["source_lang"]
+        
+        # ปรับปรุงคำแปลสำหรับบริบทมังงะ
+        if context_type == 'manga':
+            best_translation = self.post_process_manga_translation(best_translation, source_lang)
+        
+        self.translation_memory.set(
+            state["memory_key"],
+            {"translated_text": best_translation, "api_used": best_api},
+            tag=f"{source_lang}|{target_lang}"
+        )
+        
+        return {
+            "success": True,
+            "translated_text": best_translation,
+            "source_lang": source_lang,
+            "target_lang": target_lang,
+            "api_used": best_api,
+            "context_type": context_type
+        }
+    
+    def context_aware_translate(self, text, target_lang='th', source_lang='auto', context_type='general', mode=None):
+        """การแปลที่เข้าใจบริบท (mode: 'sequential' หรือ 'concurrent')"""
+        if not text or not text.strip():
+            return {"error": "กรุณาป้อนข้อความ"}
+        
+        try:
+            result, state = self._begin_translation(text, target_lang, source_lang, context_type)
+            if result is not None:
+                return result
+            
+            # ข้อความเดียวกันที่กำลังแปลอยู่จะรอผลจากการเรียก API ครั้งเดียว
+            result, shared = self.translation_flights.do(
+                state["memory_key"], self._translate_state, state, target_lang, context_type, mode
+            )
+            return dict(result, coalesced=True) if shared else result
+            
+        except Exception as e:
+            return {"error": f"เกิดข้อผิดพลาดในการแปล: {str(e)}"}
+    
+    def _translate_state(self, state, target_lang, context_type, mode):
+        # ลองใช้หลาย API แล้วเลือกคำแปลที่ดีที่สุด (ข้อความยาวแบ่งแปลเป็นก้อนพร้อมกัน)
+        chunks = split_translation_chunks(state["processed_text"])
+        if len(chunks) == 1:
+            best = self._translate_best(state["processed_text"], state["source_lang"], target_lang, mode)
+            return self._finish_translation(best, state, target_lang, context_type)
+        
+        best = self._translate_chunks(chunks, state["source_lang"], target_lang, mode)
+        result = self._finish_translation(best, state, target_lang, context_type)
+        return dict(result, chunks=len(chunks)) if result.get("success") else result
+    
+    def _translate_chunks(self, chunks, source_lang, target_lang, mode):
+        """แปลทุกก้อนพร้อมกันใน chunk pool แล้วต่อกลับตามลำดับ (ก้อนไหนแปลไม่ได้ = ไม่สำเร็จทั้งหมด)"""
+        futures = [
+            self.chunk_pool.submit(self._translate_best, text, source_lang, target_lang, mode)
+            for text, _ in chunks
+        ]
+        results = []
+        for future in futures:
+            result = future.result()
+            if result is None:
+                for pending in futures:
+                    pending.cancel()
+                return None
+            results.append(result)
+        return combine_chunk_results(results, chunks, target_lang)
+    
+    def post_process_manga_translation(self, text, source_lang):
+        """ปรับปรุงคำแปลสำหรับมังงะ"""
+        # ลบวงเล็บซ้ำซ้อน
+        text = re.sub(r'\(\(.*?\)\)', '', text)
+        
+        # ปรับปรุงการเว้นวรรค
+        text = re.sub(r'\s+', ' ', text)
+        
+        # ปรับปรุงคำสรรพนาม/คำเรียกตาม glossary ของภาษาต้นทาง
+        automaton = self.glossary.get('rewrites', source_lang)
+        if automaton:
+            text = automaton.replace(text)
+        
+        return text.strip()
+    
+    def overlay_line_boxes(self, text_overlay):
+        """ดึงข้อความและกรอบ (bounding box) ของแต่ละบรรทัดจาก TextOverlay"""
+        lines = []
+        for line in (text_overlay or {}).get("Lines", []) or []:
+            words = line.get("Words", []) or []
+            text = (line.get("LineText") or " ".join(w.get("WordText", "") for w in words)).strip()
+            if not text:
+                continue
+            
+            bbox = None
+            if words:
+                left = min(w.get("Left", 0) for w in words)
+                top = min(w.get("Top", 0) for w in words)
+                right = max(w.get("Left", 0) + w.get("Width", 0) for w in words)
+                bottom = max(w.get("Top", 0) + w.get("Height", 0) for w in words)
+                bbox = {"left": left, "top": top, "width": right - left, "height": bottom - top}
+            
+            lines.append({"text": text, "bbox": bbox})
+        return lines
+    
+    def translate_lines(self, texts, target_lang, source_lang, context_type='general', memo=None):
+        """แปลหลายบรรทัดโดยตัดตัวซ้ำ และรวมหลายบรรทัดเป็น request เดียวเท่าที่ทำได้
+        
+        memo คือ dict ที่ใช้ร่วมกันได้ทั้ง batch ((ภาษาต้นทาง, ข้อความ) -> คำแปล)
+        หน้าที่ตรวจจับภาษาต่างกันจึงไม่ใช้คำแปลของกันและกัน
+        คืน dict ข้อความ -> คำแปล (ไม่มี key สำหรับบรรทัดที่แปลไม่ได้)
+        """
+        translations = {}
+        for done in self.iter_translate_lines(texts, target_lang, source_lang, context_type, memo):
+            translations.update(done)
+        return translations
+    
+    def iter_translate_lines(self, texts, target_lang, source_lang, context_type='general', memo=None,
+                             chunk_chars=LINE_BATCH_CHARS):
+        """เหมือน translate_lines แต่ yield dict ข้อความ -> คำแปล ทีละก้อนที่แปลเสร็จ
+        
+        ก้อนแรกคือบรรทัดที่มีใน memo/translation memory อยู่แล้ว (ไม่ต้องเรียก API)
+        ก้อนละไม่เกิน chunk_chars ตัวอักษร แปลพร้อมกันใน chunk pool แล้ว yield ตามลำดับที่เสร็จ
+        """
+        memo = memo if memo is not None else {}
+        translations = {}
+        pending = []
+        
+        for text in dict.fromkeys(texts):
+            if (source_lang, text) in memo:
+                translations[text] = memo[(source_lang, text)]
+                continue
+            if source_lang == target_lang:
+                translations[text] = text
+                continue
+            remembered = self.translation_memory.get(
+                self.translation_memory_key(text, source_lang, target_lang, context_type)
+            )
+            if remembered is not None:
+                translations[text] = remembered["translated_text"]
+            else:
+                pending.append(text)
+        
+        # รวมบรรทัดเป็นก้อนไม่เกิน chunk_chars ตัวอักษร
+        chunks, current, size = [], [], 0
+        for text in pending:
+            processed = self.preprocess_for_context(text, source_lang, context_type).replace("\n", " ")
+            if current and size + len(processed) + 1 > chunk_chars:
+                chunks.append(current)
+                current, size = [], 0
+            current.append((text, processed))
+            size += len(processed) + 1
+        if current:
+            chunks.append(current)
+        
+        if translations:
+            memo.update(((source_lang, text), translated) for text, translated in translations.items())
+            yield translations
+        
+        futures = [
+            self.chunk_pool.submit(self._translate_line_chunk, chunk, source_lang, target_lang) for chunk in chunks
+        ]
+        try:
+            for future in as_completed(futures):
+                translations = {}
+                for text, (api_name, translated) in future.result().items():
+                    if context_type == 'manga':
+                        translated = self.post_process_manga_translation(translated, source_lang)
+                    translations[text] = translated
+                    self.translation_memory.set(
+                        self.translation_memory_key(text, source_lang, target_lang, context_type),
+                        {"translated_text": translated, "api_used": api_name},
+                        tag=f"{source_lang}|{target_lang}"
+                    )
+                if translations:
+                    memo.update(((source_lang, text), translated) for text, translated in translations.items())
+                    yield translations
+        finally:
+            # client เลิกรอ (ปิด generator) ก้อนที่ยังไม่เริ่มไม่ต้องแปล
+            for future in futures:
+                future.cancel()
+    
+    def _translate_line_chunk(self, chunk, source_lang, target_lang):
+        """แปลก้อนบรรทัดด้วย request เดียว (คั่นด้วยขึ้นบรรทัดใหม่)
+        
+        ถ้าจำนวนบรรทัดที่ได้กลับมาไม่ตรงกัน จะแปลทีละบรรทัดแทนเพื่อให้ตำแหน่งถูกต้อง
+        """
+        results = {}
+        if len(chunk) > 1:
+            best = self._translate_best("\n".join(p for _, p in chunk), source_lang, target_lang)
+            if best:
+                api_name, translated = best
+                parts = [part.strip() for part in translated.split("\n")]
+                if len(parts) == len(chunk) and all(parts):
+                    for (text, _), part in zip(chunk, parts):
+                        results[text] = (api_name, part)
+                    return results
+        
+        for text, processed in chunk:
+            best = self._translate_best(processed, source_lang, target_lang)
+            if best:
+                results[text] = best
+        return results
+    
+    def translate_overlay_lines(self, text_overlay, target_lang, source_lang, context_type='general', memo=None):
+        """แปลทีละบรรทัดของ TextOverlay แล้วผูกคำแปลกับกรอบของบรรทัดนั้น"""
+        lines = self.overlay_line_boxes(text_overlay)
+        translations = self.translate_lines(
+            [line["text"] for line in lines], target_lang, source_lang, context_type, memo
+        )
+        for line in lines:
+            line["translated_text"] = translations.get(line["text"])
+        return lines
+    
+    def ocr_language_setting(self, is_manga):
+        return 'jpn+kor+chi_sim' if is_manga else 'eng+tha+jpn+kor+chi_sim'
+    
+    def process_image_with_overlay(self, image_input, target_lang='th', is_manga=False, per_line=False, ocr_engine=None,
+                                   include_timings=False):
+        """ประมวลผลภาพและส่งคืนข้อมูลสำหรับซ้อนคำแปล (per_line=True แปลแยกทีละบรรทัด)"""
+        start_time = time.time()
+        
+        # OCR
+        ocr_result = self.improve_ocr_accuracy(
+            image_input, is_manga, self.ocr_language_setting(is_manga), ocr_engine
+        )
+        
+        return self.build_overlay_response(
+            ocr_result, target_lang, is_manga, start_time, per_line, include_timings=include_timings
+        )
+    
+    def stream_image_with_overlay(self, image_input, target_lang='th', is_manga=False, ocr_engine=None,
+                                  response_format='verbose'):
+        """แบบ stream ของ process_image_with_overlay: yield (event, data) ดู overlay_events"""
+        start_time = time.time()
+        ocr_result = self.improve_ocr_accuracy(
+            image_input, is_manga, self.ocr_language_setting(is_manga), ocr_engine
+        )
+        yield from self.overlay_events(ocr_result, target_lang, is_manga, start_time, response_format)
+    
+    def overlay_events(self, ocr_result, target_lang, is_manga, start_time, response_format='verbose'):
+        """yield (event, data) ตามลำดับ: ocr (ข้อความ + กรอบ ก่อนแปล), line (ทีละบรรทัดที่แปลเสร็จ)
+        และ done (สรุปพร้อม timings) หรือ error
+        
+        แปลทีละบรรทัดเสมอ client จึงวาดกรอบได้ทันทีที่ OCR เสร็จแล้วเติมคำแปลตามมา
+        """
+        if ocr_result.get("error"):
+            yield "error", self.finish_overlay_response(
+                {"error": ocr_result["error"]}, ocr_result, is_manga, start_time, include_timings=True
+            )
+            return
+        
+        context_type = 'manga' if is_manga else 'general'
+        source_lang = ocr_result["detected_language"]
+        lines = self.overlay_line_boxes(ocr_result.get("text_overlay", {}))
+        yield "ocr", shape_response({
+            "success": True,
+            "original_text": ocr_result["text"],
+            "source_lang": source_lang,
+            "target_lang": target_lang,
+            "text_overlay": ocr_result.get("text_overlay", {}),
+            "lines": lines,
+            "word_count": ocr_result["word_count"],
+            "is_manga": is_manga,
+            "timings": {stage: round(ms, 1) for stage, ms in (ocr_result.get("timings") or {}).items()}
+        }, response_format)
+        
+        translate_started = time.perf_counter()
+        for translations in self.iter_translate_lines(
+            [line["text"] for line in lines], target_lang, source_lang, context_type,
+            chunk_chars=STREAM_LINE_BATCH_CHARS
+        ):
+            for index, line in enumerate(lines):
+                if line["text"] in translations:
+                    line["translated_text"] = translations[line["text"]]
+                    yield "line", {"index": index, "text": line["text"], "translated_text": line["translated_text"]}
+        
+        untranslated = [index for index, line in enumerate(lines) if line.get("translated_text") is None]
+        if lines and len(untranslated) == len(lines):
+            result = {"error": "OCR สำเร็จแต่แปลไม่ได้: ไม่สามารถแปลข้อความได้ในขณะนี้"}
+        else:
+            result = {
+                "success": True,
+                "translated_text": "\n".join(line.get("translated_text") or line["text"] for line in lines),
+                "source_lang": source_lang,
+                "target_lang": target_lang,
+                "untranslated": untranslated,
+                "processing_time": f"{time.time() - start_time:.2f}s",
+                "word_count": ocr_result["word_count"],
+                "is_manga": is_manga
+            }
+        result = self.finish_overlay_response(
+            result, ocr_result, is_manga, start_time, translate_started, include_timings=True
+        )
+        yield ("done" if result.get("success") else "error"), result
+    
+    def build_overlay_response(self, ocr_result, target_lang, is_manga, start_time, per_line=False, memo=None,
+                               include_timings=False):
+        """แปลข้อความจากผล OCR แล้วประกอบ response สำหรับซ้อนคำแปล"""
+        if ocr_result.get("error"):
+            return self.finish_overlay_response(
+                {"error": ocr_result["error"]}, ocr_result, is_manga, start_time, include_timings=include_timings
+            )
+        
+        context_type = 'manga' if is_manga else 'general'
+        translate_started = time.perf_counter()
+        if per_line:
+            result = self._build_per_line_response(ocr_result, target_lang, is_manga, start_time, context_type, memo)
+        else:
+            # แปลภาษา
+            translate_result = self.context_aware_translate(
+                ocr_result["text"], 
+                target_lang, 
+                ocr_result["detected_language"],
+                context_type
+            )
+            result = self.overlay_result(ocr_result, translate_result, is_manga, start_time)
+        
+        return self.finish_overlay_response(
+            result, ocr_result, is_manga, start_time, translate_started, include_timings
+        )
+    
+    def finish_overlay_response(self, result, ocr_result, is_manga, start_time, translate_started=None,
+                                include_timings=False):
+        """บันทึกเวลาแต่ละขั้นลง metrics และแนบ timings (มิลลิวินาที) เมื่อร้องขอ"""
+        timings = dict(ocr_result.get("timings") or {})
+        if translate_started is not None:
+            timings["translate"] = (time.perf_counter() - translate_started) * 1000
+        timings["total"] = (time.time() - start_time) * 1000
+        
+        if ocr_result.get("cache_hit"):
+            ocr_outcome = "cache_hit"
+        elif ocr_result.get("coalesced"):
+            ocr_outcome = "coalesced"
+        elif ocr_result.get("success"):
+            ocr_outcome = "ok"
+        elif ocr_result.get("error") == OCR_NO_TEXT_ERROR:
+            ocr_outcome = "no_text"
+        else:
+            ocr_outcome = "error"
+        self.metrics.observe_stages(
+            timings, is_manga, "ok" if result.get("success") else "error", {"ocr": ocr_outcome}
+        )
+        
+        if include_timings:
+            result["timings"] = {stage: round(ms, 1) for stage, ms in timings.items()}
+        return result
+    
+    def overlay_result(self, ocr_result, translate_result, is_manga, start_time):
+        """ประกอบ response จากผล OCR และผลการแปลทั้งก้อน"""
+        if translate_result.get("error"):
+            return {"error": f"OCR สำเร็จแต่แปลไม่ได้: {translate_result['error']}"}
+        
+        processing_time = time.time() - start_time
+        
+        return {
+            "success": True,
+            "original_text": ocr_result["text"],
+            "translated_text": translate_result["translated_text"],
+            "source_lang": translate_result["source_lang"],
+            "target_lang": translate_result["target_lang"],
+            "text_overlay": ocr_result.get("text_overlay", {}),
+            "processing_time": f"{processing_time:.2f}s",
+            "word_count": ocr_result["word_count"],
+            "is_manga": is_manga,
+            # API ส่งเฉพาะเมื่อขอใน fields (ดู shape_response)
+            "raw_result": ocr_result.get("raw_result")
+        }
+    
+    def _build_per_line_response(self, ocr_result, target_lang, is_manga, start_time, context_type, memo=None):
+        """response แบบแปลทีละบรรทัด พร้อมกรอบของแต่ละบรรทัด"""
+        text_overlay = ocr_result.get("text_overlay", {})
+        source_lang = ocr_result["detected_language"]
+        lines = self.translate_overlay_lines(text_overlay, target_lang, source_lang, context_type, memo)
+        
+        if lines and all(line["translated_text"] is None for line in lines):
+            return {"error": "OCR สำเร็จแต่แปลไม่ได้: ไม่สามารถแปลข้อความได้ในขณะนี้"}
+        
+        processing_time = time.time() - start_time
+        
+        return {
+            "success": True,
+            "original_text": ocr_result["text"],
+            "translated_text": "\n".join(line["translated_text"] or line["text"] for line in lines),
+            "source_lang": source_lang,
+            "target_lang": target_lang,
+            "text_overlay": text_overlay,
+            "lines": lines,
+            "processing_time": f"{processing_time:.2f}s",
+            "word_count": ocr_result["word_count"],
+            "is_manga": is_manga,
+            "raw_result": ocr_result.get("raw_result")
+        }
+    
+    def process_batch(self, pages, target_lang='th', is_manga=False, per_line=False, ocr_engine=None,
+                      include_timings=False):
+        """ประมวลผลหลายหน้าแบบ pipeline และ yield ผลแต่ละหน้าตามลำดับที่เสร็จ
+        
+        ขั้น decode/ปรับภาพรันบน CPU pool, อัพโหลด OCR จำกัดจำนวนพร้อมกันด้วย
+        OCR pool และการแปลของหน้าหนึ่งทำซ้อนกับ OCR ของหน้าถัดไป
+        เริ่มหน้าใหม่ได้ไม่เกิน BATCH_MAX_IN_FLIGHT หน้าที่ client ยังไม่ได้อ่าน และถ้า client เลิกอ่าน
+        (ปิด generator) หน้าที่เหลือจะไม่ถูกส่ง OCR/แปลต่อ
+        """
+        language = self.ocr_language_setting(is_manga)
+        completed = queue.Queue()
+        line_memo = {}  # บรรทัดซ้ำกันข้ามหน้าใน batch เดียวกันแปลครั้งเดียว
+        cancelled = threading.Event()
+        futures = []
+        
+        def submit(pool, fn, *args):
+            future = pool.submit(fn, *args)
+            futures.append(future)
+            return future
+        
+        def finish(index, result):
+            completed.put(dict(result, index=index))
+        
+        def guard(index, stage):
+            # ส่ง error ของหน้านั้นออกไปแทนที่จะทำให้ทั้ง batch ค้าง
+            def callback(future):
+                try:
+                    stage(future.result())
+                except Exception as e:
+                    finish(index, {"error": f"เกิดข้อผิดพลาด: {str(e)}"})
+            return callback
+        
+        def start_page(index, image_input):
+            start_time = time.time()
+            
+            def after_translate(result):
+                finish(index, result)
+            
+            def after_ocr(ocr_result):
+                if cancelled.is_set():
+                    return
+                future = submit(
+                    self.batch_translate_pool, self.build_overlay_response, ocr_result, target_lang, is_manga,
+                    start_time, per_line, line_memo, include_timings
+                )
+                future.add_done_callback(guard(index, after_translate))
+            
+            def after_prepare(job):
+                if cancelled.is_set():
+                    return
+                future = submit(self.ocr_pool, self.finish_ocr_job, job, is_manga, language, ocr_engine)
+                future.add_done_callback(guard(index, after_ocr))
+            
+            future = submit(self.cpu_pool, self.prepare_ocr_job, image_input, is_manga, language)
+            future.add_done_callback(guard(index, after_prepare))
+        
+        remaining = iter(enumerate(pages))
+        
+        def start_next():
+            for index, page in remaining:
+                start_page(index, page.get('image', '') if isinstance(page, dict) else page)
+                return
+        
+        try:
+            for _ in range(min(BATCH_MAX_IN_FLIGHT, len(pages))):
+                start_next()
+            for _ in range(len(pages)):
+                result = completed.get()
+                # client อ่านไปหนึ่งหน้าแล้ว เริ่มหน้าถัดไป
+                start_next()
+                yield result
+        finally:
+            # client ปิดการเชื่อมต่อกลางคัน: ไม่ส่งขั้นถัดไปและยกเลิกงานที่ยังไม่เริ่ม (ไม่เปลืองโควตา OCR)
+            cancelled.set()
+            for future in futures:
+                future.cancel()
+
+# สร้าง instance
+app = ProfessionalTranslationApp()
+
+class APIRequest(Request):
+    """ขนาด body สูงสุดตาม route: batch หลายหน้าใช้ BATCH_MAX_REQUEST_BYTES ที่เหลือใช้ MAX_REQUEST_BYTES"""
+
+    @property
+    def max_content_length(self):
+        return BATCH_MAX_REQUEST_BYTES if self.path == BATCH_PATH else MAX_REQUEST_BYTES
+
+
+# Flask API สำหรับ Chrome Extension
+flask_app = Flask(__name__)
+flask_app.request_class = APIRequest
+# ภาษาไทย/CJK เป็น UTF-8 ตรงๆ (\uXXXX ใหญ่กว่าราว 2 เท่า)
+flask_app.json.ensure_ascii = False
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain')
+
+
+@flask_app.after_request
+def compress_response(response):
+    """บีบอัด response ตาม Accept-Encoding (stream ของ batch บีบอัดในตัว route เอง)"""
+    if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers \
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    body, encoding = compress_body(response.get_data(), request.headers.get('Accept-Encoding'))
+    if encoding:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+RAW_IMAGE_MIMETYPES = ('application/octet-stream',)
+
+
+@flask_app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify({"error": f"request ใหญ่เกิน {request.max_content_length // (1024 * 1024)} MB"}), 413
+
+
+def parse_flag(value):
+    """ค่า boolean จาก JSON หรือ form/query string ("1", "true", "yes", "on")"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def is_raw_image_mimetype(mimetype):
+    return mimetype.startswith('image/') or mimetype in RAW_IMAGE_MIMETYPES
+
+
+def overlay_options(options):
+    """(target_lang, is_manga, per_line, ocr_engine, include_timings) จากตัวเลือกของ request"""
+    return (
+        options.get('target_lang', 'th'),
+        parse_flag(options.get('is_manga', False)),
+        parse_flag(options.get('per_line', False)),
+        options.get('ocr_engine') or None,
+        parse_flag(options.get('include_timings', False))
+    )
+
+
+RESPONSE_FORMATS = ('verbose', 'compact')
+# field ที่ส่งเสมอแม้เลือก fields (สถานะ และลำดับหน้าของ batch)
+ALWAYS_FIELDS = ('success', 'error', 'index')
+
+
+def response_options(options):
+    """(format, fields) จากตัวเลือกของ request: format=verbose|compact, fields="a,b" หรือ list (None = ทุก field)"""
+    fields = options.get('fields')
+    if isinstance(fields, str):
+        fields = [name.strip() for name in fields.split(',') if name.strip()]
+    return options.get('format') or 'verbose', set(fields) if fields else None
+
+
+def compact_overlay(text_overlay):
+    """TextOverlay (Lines/Words) เป็น array แยกคอลัมน์: คำที่ i อยู่ในบรรทัด line[i]"""
+    overlay = {"lines": [], "words": [], "line": [], "left": [], "top": [], "width": [], "height": []}
+    for line in (text_overlay or {}).get("Lines", []) or []:
+        words = line.get("Words", []) or []
+        index = len(overlay["lines"])
+        overlay["lines"].append(line.get("LineText") or " ".join(word.get("WordText", "") for word in words))
+        for word in words:
+            overlay["line"].append(index)
+            overlay["words"].append(word.get("WordText", ""))
+            overlay["left"].append(word.get("Left", 0))
+            overlay["top"].append(word.get("Top", 0))
+            overlay["width"].append(word.get("Width", 0))
+            overlay["height"].append(word.get("Height", 0))
+    return overlay
+
+
+def compact_lines(lines):
+    """ผลแปลทีละบรรทัดเป็น array แยกคอลัมน์ (บรรทัดที่ไม่มีกรอบได้ค่า null)"""
+    columns = {"text": [], "translated_text": [], "left": [], "top": [], "width": [], "height": []}
+    for line in lines:
+        bbox = line.get("bbox") or {}
+        columns["text"].append(line["text"])
+        columns["translated_text"].append(line.get("translated_text"))
+        for name in ("left", "top", "width", "height"):
+            columns[name].append(bbox.get(name))
+    return columns
+
+
+def shape_response(result, response_format='verbose', fields=None):
+    """จัดรูป response ตาม format และ fields
+    
+    ค่าเริ่มต้นคือรูปแบบเดิม (verbose, ไม่มี raw_result) ส่วน raw_result ส่งเมื่อระบุใน fields เท่านั้น
+    """
+    result = dict(result)
+    if response_format == 'compact':
+        if "text_overlay" in result:
+            result["overlay"] = compact_overlay(result.pop("text_overlay"))
+        if isinstance(result.get("lines"), list):
+            result["lines"] = compact_lines(result["lines"])
+    if fields is None:
+        result.pop("raw_result", None)
+        return result
+    return {name: value for name, value in result.items() if name in fields or name in ALWAYS_FIELDS}
+
+
+def choose_encoding(accept_encoding):
+    """เลือก content-coding จาก Accept-Encoding (br > gzip, None = ไม่บีบอัด)"""
+    accepted = set()
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.partition(';')
+        match = re.search(r'q\s*=\s*([0-9.]+)', params)
+        try:
+            quality = float(match.group(1)) if match else 1.0
+        except ValueError:
+            quality = 0.0
+        if coding.strip() and quality > 0:
+            accepted.add(coding.strip().lower())
+    if brotli is not None and ('br' in accepted or '*' in accepted):
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress_body(body, accept_encoding):
+    """คืน (body, encoding) บีบอัดเมื่อใหญ่กว่า COMPRESS_MIN_BYTES และ client รองรับ"""
+    encoding = choose_encoding(accept_encoding) if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY), encoding
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), encoding
+    return body, None
+
+
+def compress_stream(chunks, encoding):
+    """บีบอัด stream (เช่น NDJSON) โดย flush ทุก chunk ให้ client อ่านผลแต่ละหน้าได้ทันที"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def sse_event(event, data):
+    """ข้อความ Server-Sent Events หนึ่ง event (data เป็น JSON บรรทัดเดียว)"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def read_image_request():
+    """อ่านภาพ + ตัวเลือกจาก request คืน (image_input, options)
+    
+    รองรับ JSON (image เป็น base64/URL), multipart/form-data (ไฟล์ชื่อ image)
+    และ body ดิบ (image/* หรือ application/octet-stream, ตัวเลือกอยู่ใน query string)
+    แบบ binary ส่ง bytes ให้ decoder โดยตรงโดยไม่ผ่าน base64/JSON
+    """
+    if request.mimetype == 'multipart/form-data':
+        options = request.form.to_dict()
+        upload = request.files.get('image')
+        return (upload.read() if upload else options.get('image', '')), options
+    if is_raw_image_mimetype(request.mimetype):
+        return request.get_data(cache=False), request.args.to_dict()
+    options = request.get_json() or {}
+    return options.get('image', ''), options
+
+
+@flask_app.route('/api/translate-with-overlay', methods=['POST'])
+def api_translate_with_overlay():
+    """API สำหรับ Chrome Extension ที่ต้องการซ้อนคำแปล"""
+    try:
+        image_data, options = read_image_request()
+        target_lang, is_manga, per_line, ocr_engine, include_timings = overlay_options(options)
+        response_format, fields = response_options(options)
+        if response_format not in RESPONSE_FORMATS:
+            return jsonify({"error": f"format ต้องเป็น {' หรือ '.join(RESPONSE_FORMATS)}"}), 400
+        
+        result = app.profiler.run(
+            "translate-with-overlay", app.process_image_with_overlay,
+            image_data, target_lang, is_manga, per_line, ocr_engine, include_timings
+        )
+        app.metrics.inc(
+            "requests_total", endpoint="translate-with-overlay", outcome="ok" if result.get("success") else "error"
+        )
+        return jsonify(shape_response(result, response_format, fields))
+        
+    except RequestEntityTooLarge as e:
+        return request_too_large(e)
+    except Exception as e:
+        app.metrics.inc("requests_total", endpoint="translate-with-overlay", outcome="exception")
+        return jsonify({"error": str(e)}), 500
+
+@flask_app.route('/api/translate-with-overlay/stream', methods=['POST'])
+def api_translate_with_overlay_stream():
+    """แบบ Server-Sent Events: event ocr ทันทีที่ OCR เสร็จ, line ทีละบรรทัดที่แปลเสร็จ แล้วปิดด้วย done/error"""
+    try:
+        image_data, options = read_image_request()
+    except RequestEntityTooLarge as e:
+        return request_too_large(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    target_lang, is_manga, _, ocr_engine, _ = overlay_options(options)
+    response_format, _ = response_options(options)
+    if response_format not in RESPONSE_FORMATS:
+        return jsonify({"error": f"format ต้องเป็น {' หรือ '.join(RESPONSE_FORMATS)}"}), 400
+    
+    def generate():
+        outcome = "exception"
+        try:
+            for event, data in app.stream_image_with_overlay(image_data, target_lang, is_manga, ocr_engine,
+                                                             response_format):
+                if event in ("done", "error"):
+                    outcome = "ok" if event == "done" else "error"
+                yield sse_event(event, data)
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            app.metrics.inc("requests_total", endpoint="translate-with-overlay-stream", outcome=outcome)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@flask_app.route(BATCH_PATH, methods=['POST'])
+def api_translate_batch():
+    """API แปลทั้งตอน: ส่งผลแต่ละหน้ากลับเป็น NDJSON ตามลำดับที่เสร็จ
+    
+    ส่งเป็น JSON (pages = list ของ base64/URL) หรือ multipart/form-data (ไฟล์ชื่อ pages หลายไฟล์ตามลำดับหน้า)
+    """
+    if request.mimetype == 'multipart/form-data':
+        data = request.form.to_dict()
+        pages = [upload.read() for upload in request.files.getlist('pages')]
+    else:
+        data = request.get_json(silent=True) or {}
+        pages = data.get('pages') or []
+    target_lang, is_manga, per_line, ocr_engine, include_timings = overlay_options(data)
+    response_format, fields = response_options(data)
+    
+    if response_format not in RESPONSE_FORMATS:
+        return jsonify({"error": f"format ต้องเป็น {' หรือ '.join(RESPONSE_FORMATS)}"}), 400
+    if not isinstance(pages, list) or not pages:
+        return jsonify({"error": "กรุณาส่ง pages เป็น list ของภาพ"}), 400
+    if len(pages) > BATCH_MAX_PAGES:
+        return jsonify({"error": f"ส่งได้ไม่เกิน {BATCH_MAX_PAGES} หน้าต่อครั้ง"}), 413
+    
+    def generate():
+        for result in app.process_batch(pages, target_lang, is_manga, per_line, ocr_engine, include_timings):
+            app.metrics.inc(
+                "requests_total", endpoint="translate-batch", outcome="ok" if result.get("success") else "error"
+            )
+            yield (json.dumps(shape_response(result, response_format, fields), ensure_ascii=False) + "\n").encode('utf-8')
+    
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    body = compress_stream(generate(), encoding) if encoding else generate()
+    response = Response(stream_with_context(body), mimetype='application/x-ndjson')
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@flask_app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """สถิติ hit/miss ของแคช (ตัวนับเป็นของ worker ที่ตอบ ดู worker_pid)"""
+    return jsonify({
+        "worker_pid": os.getpid(),
+        "ocr": app.ocr_cache.get_stats(),
+        "translation_memory": app.translation_memory.get_stats(),
+        "near_duplicate": app.phash_index.get_stats(),
+        "image_fetch": app.image_fetcher.get_stats(),
+        "coalescing": {
+            "ocr": app.ocr_flights.get_stats(),
+            "translation": app.translation_flights.get_stats()
+        }
+    })
+
+@flask_app.route('/api/admin/translation-memory', methods=['GET', 'DELETE'])
+def admin_translation_memory():
+    """ดูขนาด/hit ratio ของ translation memory หรือลบตามคู่ภาษา"""
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({"error": "unauthorized"}), 401
+    
+    if request.method == 'DELETE':
+        source_lang = request.args.get('source_lang')
+        target_lang = request.args.get('target_lang')
+        if not source_lang or not target_lang:
+            return jsonify({"error": "ต้องระบุ source_lang และ target_lang"}), 400
+        removed = app.translation_memory.purge(tag=f"{source_lang}|{target_lang}")
+        return jsonify({
+            "success": True,
+            "purged": removed,
+            "language_pair": f"{source_lang}|{target_lang}"
+        })
+    
+    return jsonify(app.translation_memory.get_stats())
+
+@flask_app.route('/api/admin/glossary/reload', methods=['POST'])
+def admin_glossary_reload():
+    """บังคับโหลด glossary จากไฟล์ใหม่ทันที"""
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({"error": "unauthorized"}), 401
+    
+    app.glossary.reload(force=True)
+    return jsonify({"success": True, "glossaries": app.glossary.get_stats()})
+
+@flask_app.route('/api/ocr-keys/stats', methods=['GET'])
+def ocr_key_stats():
+    """การใช้งานและโควตาคงเหลือของ OCR key แต่ละตัว"""
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify(app.ocr_keys.get_stats())
+
+@flask_app.route('/api/providers/latency', methods=['GET'])
+def provider_latency_stats():
+    """latency ของ provider แปลภาษา และ hedge deadline ปัจจุบัน"""
+    return jsonify({
+        "providers": app.provider_latency.get_stats(),
+        "hedge_deadline": app.hedge_deadline(),
+        "http": app.http.get_stats(),
+        "ocr_engines": app.ocr_router.get_stats(),
+        "mode": TRANSLATION_MODE
+    })
+
+@flask_app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """metrics ต่อขั้น/provider ในรูปแบบ Prometheus text format
+    
+    ค่าเป็นของ worker ที่ตอบ request นี้เท่านั้น (หลาย worker มี label worker_pid ให้ sum ข้าม worker)
+    """
+    if PREFORK:
+        return Response(app.metrics.render(worker_pid=os.getpid()), mimetype='text/plain; version=0.0.4')
+    return Response(app.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@flask_app.route('/api/admin/profiles', methods=['GET'])
+def admin_profiles():
+    """profile ของ request ที่ช้าซึ่งถูกสุ่มเก็บไว้ (เปิดด้วย PROFILE_SAMPLE_RATE)"""
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify({
+        "sample_rate": app.profiler.sample_rate,
+        "slow_ms": app.profiler.slow_ms,
+        "profiles": app.profiler.get_recent()
+    })
+
+@flask_app.route('/api/health', methods=['GET'])
+def health_check():
+    return jsonify({
+        "status": "healthy", 
+        "service": "Professional Translation API",
+        "mode": APP_MODE,
+        "workers": WORKERS,
+        "worker_pid": os.getpid(),
+        "features": ["context_aware", "manga_support", "overlay_data", "ocr_cache", "translation_memory", "batch", "metrics", "text_regions", "near_duplicate", "binary_upload", "compact_response", "sse_stream"]
+    })
+
+def run_flask(sock=None):
+    if sock is None:
+        flask_app.run(host='0.0.0.0', port=API_PORT, debug=False, use_reloader=False)
+        return
+    from werkzeug.serving import make_server
+    make_server('0.0.0.0', API_PORT, flask_app, threaded=True, fd=sock.fileno()).serve_forever()
+
+
+class AdmissionRejected(Exception):
+    """request ถูกปฏิเสธทันทีเพราะระบบเต็ม (429 ต่อ client / 503 ทั้งระบบ)"""
+
+    def __init__(self, status, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """จำกัดงานที่ทำพร้อมกัน คิวรอ และจำนวน request ต่อ client สำหรับโหมด async"""
+
+    def __init__(self, max_in_flight=ASYNC_MAX_IN_FLIGHT, max_queue=ASYNC_MAX_QUEUE,
+                 per_client_limit=ASYNC_PER_CLIENT_LIMIT, queue_timeout=ASYNC_QUEUE_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.per_client_limit = per_client_limit
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._per_client = {}
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self.stats = {"admitted": 0, "rejected_client": 0, "rejected_queue": 0, "rejected_timeout": 0}
+
+    @contextlib.asynccontextmanager
+    async def admit(self, client_id):
+        if self._per_client.get(client_id, 0) >= self.per_client_limit:
+            self.stats["rejected_client"] += 1
+            raise AdmissionRejected(429, "ส่ง request พร้อมกันมากเกินไป", 1)
+        if self.in_flight >= self.max_in_flight and self.waiting >= self.max_queue:
+            self.stats["rejected_queue"] += 1
+            raise AdmissionRejected(503, "ระบบกำลังทำงานเต็มกำลัง กรุณาลองใหม่", 2)
+        
+        self._per_client[client_id] = self._per_client.get(client_id, 0) + 1
+        try:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.stats["rejected_timeout"] += 1
+                raise AdmissionRejected(503, "รอคิวนานเกินไป กรุณาลองใหม่", 2)
+            finally:
+                self.waiting -= 1
             
-            # Threshold เพื่อให้ข้อความชัดเจน
-            _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+                self._semaphore.release()
+        finally:
+            self._per_client[client_id] -= 1
+            if not self._per_client[client_id]:
+                del self._per_client[client_id]
+
+    def get_stats(self):
+        return dict(self.stats, in_flight=self.in_flight, waiting=self.waiting, clients=len(self._per_client))
+
+
+class AsyncSingleFlight:
+    """SingleFlight สำหรับ coroutine บน event loop เดียว
+    
+    งานจริงรันเป็น task แยก ผู้รอคนใดถูกยกเลิกก็ไม่กระทบคนอื่นที่รอผลเดียวกัน
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key, factory):
+        """คืน (ผลลัพธ์, shared) factory คือฟังก์ชันที่คืน coroutine ของงานจริง"""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done, key=key: self._tasks.pop(key, None))
+        return await asyncio.shield(task), shared
+
+    def get_stats(self):
+        return {"in_flight": len(self._tasks), "leaders": self.leaders, "shared": self.shared}
+
+
+class AsyncHTTPClient:
+    """HTTP client แบบ non-blocking (aiohttp) ใช้ circuit breaker ร่วมกับ HTTPClient"""
+
+    def __init__(self, http, pool_size=HTTP_POOL_SIZE):
+        self.http = http
+        self.pool_size = pool_size
+        self._session = None
+
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_size, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def request_json(self, method, url, breaker=None, retries=0, retry_status=None, timeout=10, **kwargs):
+        """ส่ง request พร้อม retry แบบเดียวกับ HTTPClient.request คืน (status, json)"""
+        retry_status = HTTPClient.RETRY_STATUS if retry_status is None else retry_status
+        for attempt in range(retries + 1):
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(breaker.name)
             
-            # ขยายข้อความให้ชัดเจน
-            kernel = np.ones((2,2), np.uint8)
-            binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+            last_attempt = attempt == retries
+            started = time.perf_counter()
+            try:
+                async with self.session().request(
+                    method, url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs
+                ) as response:
+                    status = response.status
+                    data = await response.json(content_type=None) if status == 200 else None
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                if breaker is not None:
+                    breaker.record_failure()
+                self.http.observe(breaker, started, "network_error", not last_attempt)
+                if last_attempt:
+                    raise
+                await asyncio.sleep(self.http.backoff(attempt))
+                continue
+            except BaseException:
+                # ถูกยกเลิก (CancelledError จาก hedged call ที่แพ้) คืน trial ไม่งั้น breaker ค้าง half-open ตลอดไป
+                if breaker is not None:
+                    breaker.release()
+                raise
             
-            return Image.fromarray(binary)
+            if status in retry_status:
+                if breaker is not None:
+                    breaker.record_failure()
+                self.http.observe(breaker, started, f"http_{status}", not last_attempt)
+                if last_attempt:
+                    return status, data
+                await asyncio.sleep(self.http.backoff(attempt))
+                continue
             
-        except Exception as e:
-            print(f"Image enhancement error: {e}")
-            return image
-    
-    def detect_language_advanced(self, text):
-        """ตรวจจับภาษาอย่างแม่นยำ"""
-        # นับตัวอักษรแต่ละภาษา
-        thai_count = len([c for c in text if '\u0e00' <= c <= '\u0e7f'])
-        japanese_count = len([c for c in text if '\u3040' <= c <= '\u309f' or '\u30a0' <= c <= '\u30ff' or '\u4e00' <= c <= '\u9fff'])
-        korean_count = len([c for c in text if '\uac00' <= c <= '\ud7a3'])
-        chinese_count = len([c for c in text if '\u4e00' <= c <= '\u9fff' and not ('\u3040' <= c <= '\u309f' or '\u30a0' <= c <= '\u30ff')])
-        
-        # ตรวจสอบภาษาที่มีมากที่สุด
-        counts = {
-            'th': thai_count,
-            'ja': japanese_count,
-            'ko': korean_count,
-            'zh': chinese_count
-        }
-        
-        detected_lang = max(counts, key=counts.get)
-        
-        # ถ้าไม่พบตัวอักษรเอเชีย ให้ถือว่าเป็นอังกฤษ
-        if counts[detected_lang] == 0:
-            return 'en'
-        
-        return detected_lang
+            if breaker is not None:
+                breaker.record_success()
+            self.http.observe(breaker, started, "ok" if status == 200 else f"http_{status}")
+            return status, data
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class AsyncTranslationPipeline:
+    """pipeline OCR + แปลภาษาแบบ coroutine สำหรับ SERVER_MODE=async
     
-    def improve_ocr_accuracy(self, image_input, is_manga=False, language='eng+tha+jpn+kor'):
-        """OCR ที่แม่นยำขึ้น"""
-        max_retries = 2
+    งาน network ไม่ block thread ส่วนงาน CPU (decode/ปรับภาพ) และ engine ที่เป็น
+    sync (เช่น Tesseract) รันใน thread pool เดิมของแอป
+    """
+
+    def __init__(self, translator):
+        self.app = translator
+        self.client = AsyncHTTPClient(translator.http)
+        self.admission = AdmissionController()
+        self.ocr_flights = AsyncSingleFlight()
+        self.translation_flights = AsyncSingleFlight()
+        self.chunk_limit = asyncio.Semaphore(TRANSLATION_CHUNK_WORKERS)
+
+    async def call_ocr_space(self, image_bytes, is_manga, language):
+        app = self.app
+        last_error = "OCR API ไม่พร้อมใช้งานชั่วคราว"
         
-        for attempt in range(max_retries):
+        for attempt in range(OCR_KEY_ATTEMPTS):
+            api_key = app.get_ocr_key()
+            if api_key is None:
+                break
+            breaker = app.http.breaker(f"ocr:{api_key}")
+            
+            form = aiohttp.FormData()
+            for name, value in app.ocr_space_form(api_key, is_manga, language).items():
+                form.add_field(name, str(value))
+            form.add_field("image", image_bytes, filename="image.png", content_type="image/png")
+            
             try:
-                # โหลดภาพ
-                if isinstance(image_input, str):
-                    if image_input.startswith('http'):
-                        response = requests.get(image_input, timeout=15)
-                        image = Image.open(io.BytesIO(response.content))
-                    else:
-                        image_data = base64.b64decode(image_input.split(',')[1])
-                        image = Image.open(io.BytesIO(image_data))
-                else:
-                    image = image_input
-                
-                # ปรับปรุงภาพสำหรับมังงะ
-                if is_manga:
-                    image = self.enhance_manga_image(image)
-                
-                # ปรับขนาดภาพ
-                if max(image.size) > 1200:
-                    image.thumbnail((1200, 1200))
-                
-                # แปลงภาพเป็น bytes
-                img_byte_arr = io.BytesIO()
-                image.save(img_byte_arr, format='PNG', optimize=True)
-                img_byte_arr = img_byte_arr.getvalue()
-                
-                # OCR.space API
-                data = {
-                    "apikey": self.get_ocr_key(),
-                    "language": language,
-                    "isOverlayRequired": True,  # ขอตำแหน่งข้อความสำหรับ Chrome Extension
-                    "OCREngine": 2,
-                    "scale": True,
-                    "isTable": is_manga,  # สำหรับมังงะที่มีการจัดข้อความ
-                    "detectOrientation": True,
-                }
-                
-                response = requests.post(
-                    "https://api.ocr.space/parse/image",
-                    files={"image": img_byte_arr},
-                    data=data,
+                status, result = await self.client.request_json(
+                    "POST",
+                    OCR_SPACE_URL,
+                    breaker=breaker,
+                    retries=OCR_MAX_RETRIES,
+                    retry_status=OCR_RETRY_STATUS,
+                    data=form,
                     timeout=30
                 )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    if result.get("IsErroredOnProcessing"):
-                        if attempt < max_retries - 1:
-                            continue
-                        return {"error": f"OCR Error: {result.get('ErrorMessage', 'Unknown error')}"}
-                    
-                    parsed_results = result.get("ParsedResults", [])
-                    if parsed_results:
-                        text_data = parsed_results[0]
-                        text = text_data.get("ParsedText", "").strip()
-                        
-                        if text:
-                            # ตรวจจับภาษา
-                            detected_lang = self.detect_language_advanced(text)
-                            
-                            return {
-                                "success": True,
-                                "text": text,
-                                "word_count": len(text.split()),
-                                "detected_language": detected_lang,
-                                "text_overlay": text_data.get("TextOverlay", {}),  # ตำแหน่งข้อความสำหรับซ้อนภาพ
-                                "raw_result": text_data  # ข้อมูลดิบสำหรับการประมวลผลเพิ่มเติม
-                            }
-                    
-                    if attempt < max_retries - 1:
-                        continue
-                    return {"error": "ไม่พบข้อความในภาพ"}
-                else:
-                    if attempt < max_retries - 1:
-                        continue
-                    return {"error": f"API Error: {response.status_code}"}
-                    
+            except CircuitOpenError:
+                continue
+            except ValueError:
+                # 200 ที่ body ไม่ใช่ JSON (retry ครบแล้ว) ให้ handle_ocr_space_response พัก key นี้
+                status, result = 200, None
             except Exception as e:
-                if attempt < max_retries - 1:
-                    continue
                 return {"error": f"เกิดข้อผิดพลาด: {str(e)}"}
-    
-    def context_aware_translate(self, text, target_lang='th', source_lang='auto', context_type='general'):
-        """การแปลที่เข้าใจบริบท"""
-        if not text or not text.strip():
-            return {"error": "กรุณาป้อนข้อความ"}
+            
+            result, error = app.handle_ocr_space_response(status, result, api_key)
+            if result is not None:
+                return result
+            last_error = error
         
+        return {"error": last_error}
+
+    async def _run_engine(self, name, image_bytes, is_manga, language):
+        router = self.app.ocr_router
+        start = time.time()
         try:
-            # ตรวจจับภาษาต้นทาง
-            if source_lang == 'auto':
-                source_lang = self.detect_language_advanced(text)
-            
-            if source_lang == target_lang:
-                return {
-                    "success": True,
-                    "translated_text": text,
-                    "source_lang": source_lang,
-                    "target_lang": target_lang,
-                    "context_used": "same_language"
-                }
-            
-            # ประมวลผลข้อความก่อนแปล (สำหรับมังงะ)
-            processed_text = text
-            if context_type == 'manga' and source_lang in self.context_phrases:
-                # แทนที่คำศัพท์เฉพาะก่อนแปล
-                for phrase, meaning in self.context_phrases[source_lang]['manga'].items():
-                    if phrase in text:
-                        processed_text = processed_text.replace(phrase, f"{phrase} ({meaning})")
-            
-            # ลองใช้หลาย API
-            translation_attempts = []
-            
-            # Attempt 1: MyMemory API
-            try:
-                params = {
-                    "q": processed_text[:1000],
+            if name == OCRSpaceEngine.name:
+                result = await self.call_ocr_space(image_bytes, is_manga, language)
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(
+                    router.executor, router.engines[name].recognize, image_bytes, is_manga, language
+                )
+        except Exception as e:
+            # engine พังไม่ควรหยุด fallback chain
+            result = {"error": f"{name}: {str(e)}"}
+        ok = bool(result.get("success")) or result.get("error") == OCR_NO_TEXT_ERROR
+        router.latency.record(f"ocr:{name}", time.time() - start, ok)
+        return dict(result, engine=name)
+
+    async def recognize(self, image_bytes, is_manga, language, preferred=None):
+        """เหมือน OCRRouter.recognize แต่ engine ที่ช้าเกินจะถูกยกเลิกเมื่อได้ผลแล้ว"""
+        names = self.app.ocr_router.order(None if preferred == 'auto' else preferred)
+        if not names:
+            return {"error": "ไม่มี OCR engine ที่พร้อมใช้งาน"}
+        
+        fallback_after = self.app.ocr_router.fallback_after or None
+        tasks = set()
+        last_result = {"error": "ไม่มี OCR engine ที่พร้อมใช้งาน"}
+        try:
+            for index, name in enumerate(names):
+                tasks.add(asyncio.ensure_future(self._run_engine(name, image_bytes, is_manga, language)))
+                is_last = index == len(names) - 1
+                while tasks:
+                    done, tasks = await asyncio.wait(
+                        tasks,
+                        timeout=None if is_last else fallback_after,
+                        return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        result = task.result()
+                        if result.get("success") or result.get("error") == OCR_NO_TEXT_ERROR:
+                            return result
+                        last_result = result
+                    if not done:
+                        break
+            return last_result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def translate_mymemory(self, text, source_lang, target_lang):
+        start = time.time()
+        translated = None
+        try:
+            status, result = await self.client.request_json(
+                "GET",
+                MYMEMORY_URL,
+                breaker=self.app.http.breaker("MyMemory"),
+                retries=TRANSLATION_MAX_RETRIES,
+                params={
+                    "q": text[:TRANSLATION_MAX_CHARS],
                     "langpair": f"{source_lang}|{target_lang}",
                     "de": "manga_translator@example.com",
-                    "mt": "1"  # Machine translation
-                }
-                response = requests.get(
-                    "https://api.mymemory.translated.net/get",
-                    params=params,
-                    timeout=10
-                )
-                if response.status_code == 200:
-                    result = response.json()
-                    translated = result["responseData"]["translatedText"]
-                    if translated and translated.strip() and translated != processed_text:
-                        translation_attempts.append(("MyMemory", translated))
-            except:
-                pass
-            
-            # Attempt 2: LibreTranslate
-            try:
-                payload = {
-                    "q": processed_text[:1000],
-                    "source": source_lang,
-                    "target": target_lang,
-                    "format": "text"
-                }
-                response = requests.post(
-                    "https://libretranslate.de/translate",
-                    json=payload,
-                    headers={"Content-Type": "application/json"},
-                    timeout=10
+                    "mt": "1"
+                },
+                timeout=10
+            )
+            if status == 200:
+                candidate = result["responseData"]["translatedText"]
+                if candidate and candidate.strip() and candidate != text:
+                    translated = candidate
+        except CircuitOpenError:
+            return None
+        except Exception:
+            pass
+        self.app.provider_latency.record("MyMemory", time.time() - start, translated is not None)
+        return translated
+
+    async def translate_libretranslate(self, text, source_lang, target_lang):
+        start = time.time()
+        translated = None
+        try:
+            status, result = await self.client.request_json(
+                "POST",
+                LIBRETRANSLATE_URL,
+                breaker=self.app.http.breaker("LibreTranslate"),
+                retries=TRANSLATION_MAX_RETRIES,
+                json={"q": text[:TRANSLATION_MAX_CHARS], "source": source_lang, "target": target_lang, "format": "text"},
+                timeout=10
+            )
+            if status == 200:
+                candidate = result.get("translatedText", "").strip()
+                if candidate and candidate != text:
+                    translated = candidate
+        except CircuitOpenError:
+            return None
+        except Exception:
+            pass
+        self.app.provider_latency.record("LibreTranslate", time.time() - start, translated is not None)
+        return translated
+
+    async def translate_best(self, text, source_lang, target_lang, mode=None):
+        """เลือกคำแปลแบบเดียวกับ _translate_best (MyMemory ก่อน) โหมด concurrent ยกเลิกตัวที่แพ้จริง"""
+        if (mode or TRANSLATION_MODE) != 'concurrent':
+            translated = await self.translate_mymemory(text, source_lang, target_lang)
+            if translated:
+                return "MyMemory", translated
+            translated = await self.translate_libretranslate(text, source_lang, target_lang)
+            return ("LibreTranslate", translated) if translated else None
+        
+        tasks = {
+            asyncio.ensure_future(self.translate_mymemory(text, source_lang, target_lang)): "MyMemory",
+            asyncio.ensure_future(self.translate_libretranslate(text, source_lang, target_lang)): "LibreTranslate",
+        }
+        deadline = time.time() + self.app.hedge_deadline()
+        results = {}
+        pending = set(tasks)
+        try:
+            while pending:
+                remaining = deadline - time.time()
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=remaining if remaining > 0 else None,
+                    return_when=asyncio.FIRST_COMPLETED
                 )
-                if response.status_code == 200:
-                    result = response.json()
-                    translated = result.get("translatedText", "").strip()
-                    if translated and translated != processed_text:
-                        translation_attempts.append(("LibreTranslate", translated))
-            except:
-                pass
-            
-            # เลือกคำแปลที่ดีที่สุด
-            if translation_attempts:
-                # ให้ความสำคัญกับ MyMemory ก่อน (มักจะดีกว่าสำหรับภาษาตะวันออก)
-                for api_name, translation in translation_attempts:
-                    if api_name == "MyMemory":
-                        best_translation = translation
-                        break
-                else:
-                    best_translation = translation_attempts[0][1]
+                for task in done:
+                    results[tasks[task]] = task.result()
                 
-                # ปรับปรุงคำแปลสำหรับบริบทมังงะ
-                if context_type == 'manga':
-                    best_translation = self.post_process_manga_translation(best_translation, source_lang)
-                
-                return {
-                    "success": True,
-                    "translated_text": best_translation,
-                    "source_lang": source_lang,
-                    "target_lang": target_lang,
-                    "api_used": translation_attempts[0][0],
-                    "context_type": context_type
-                }
-            
-            return {"error": "ไม่สามารถแปลข้อความได้ในขณะนี้"}
-            
+                if results.get("MyMemory"):
+                    return "MyMemory", results["MyMemory"]
+                if ("MyMemory" in results or time.time() >= deadline) and results.get("LibreTranslate"):
+                    return "LibreTranslate", results["LibreTranslate"]
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def context_aware_translate(self, text, target_lang='th', source_lang='auto', context_type='general'):
+        app = self.app
+        if not text or not text.strip():
+            return {"error": "กรุณาป้อนข้อความ"}
+        try:
+            # translation memory อยู่บน SQLite (มี lock) จึงเรียกใน thread pool ไม่ block event loop
+            result, state = await asyncio.get_running_loop().run_in_executor(
+                None, app._begin_translation, text, target_lang, source_lang, context_type
+            )
+            if result is not None:
+                return result
+            result, shared = await self.translation_flights.do(
+                state["memory_key"], lambda: self._translate_state(state, target_lang, context_type)
+            )
+            return dict(result, coalesced=True) if shared else result
         except Exception as e:
             return {"error": f"เกิดข้อผิดพลาดในการแปล: {str(e)}"}
-    
-    def post_process_manga_translation(self, text, source_lang):
-        """ปรับปรุงคำแปลสำหรับมังงะ"""
-        # ลบวงเล็บซ้ำซ้อน
-        text = re.sub(r'\(\(.*?\)\)', '', text)
+
+    async def _translate_state(self, state, target_lang, context_type):
+        chunks = split_translation_chunks(state["processed_text"])
+        if len(chunks) == 1:
+            best = await self.translate_best(state["processed_text"], state["source_lang"], target_lang)
+            return await self.finish_translation(best, state, target_lang, context_type)
         
-        # ปรับปรุงการเว้นวรรค
-        text = re.sub(r'\s+', ' ', text)
+        tasks = [
+            asyncio.ensure_future(self.translate_chunk(text, state["source_lang"], target_lang))
+            for text, _ in chunks
+        ]
+        results = []
+        try:
+            for task in tasks:
+                result = await task
+                if result is None:
+                    break
+                results.append(result)
+        finally:
+            for task in tasks:
+                task.cancel()
+        best = combine_chunk_results(results, chunks, target_lang) if len(results) == len(chunks) else None
+        result = await self.finish_translation(best, state, target_lang, context_type)
+        return dict(result, chunks=len(chunks)) if result.get("success") else result
+
+    async def finish_translation(self, best, state, target_lang, context_type):
+        """_finish_translation (บันทึก translation memory ลง SQLite) ใน thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.app._finish_translation, best, state, target_lang, context_type
+        )
+
+    async def translate_chunk(self, text, source_lang, target_lang):
+        """แปลหนึ่งก้อนของข้อความยาว (พร้อมกันไม่เกิน TRANSLATION_CHUNK_WORKERS ก้อน)"""
+        async with self.chunk_limit:
+            return await self.translate_best(text, source_lang, target_lang)
+
+    async def _recognize_job(self, job, is_manga, language, ocr_engine):
+        if "tiles" in job:
+            results = await asyncio.gather(*[
+                self.recognize(tile["image"], is_manga, language, ocr_engine) for tile in job["tiles"]
+            ])
+            result = self.app.merge_tile_results(job, list(results))
+        else:
+            result = await self.recognize(job["image"], is_manga, language, ocr_engine)
+        # เก็บแคช OCR + ดัชนี phash (SQLite) ใน thread pool
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.app.store_ocr_result, job, result, is_manga
+        )
+
+    async def ocr_image(self, image_input, is_manga, ocr_engine=None):
+        """ขั้นเตรียมภาพ (thread pool) + OCR แบบ non-blocking คืนผลแบบเดียวกับ improve_ocr_accuracy"""
+        app = self.app
+        loop = asyncio.get_running_loop()
+        language = app.ocr_language_setting(is_manga)
         
-        # สำหรับภาษาญี่ปุ่น: ปรับปรุงคำสรรพนาม
-        if source_lang == 'ja':
-            text = text.replace('คุณ (ชาย)', 'แก')
-            text = text.replace('ฉัน (ชาย)', 'กู')
-            text = text.replace('ฉัน (หญิง)', 'ฉัน')
+        # ขั้น CPU ใน thread pool
+        try:
+            job = await loop.run_in_executor(app.cpu_pool, app.prepare_ocr_job, image_input, is_manga, language)
+        except Exception as e:
+            return {"error": f"เกิดข้อผิดพลาด: {str(e)}"}
         
-        return text.strip()
-    
-    def process_image_with_overlay(self, image_input, target_lang='th', is_manga=False):
-        """ประมวลผลภาพและส่งคืนข้อมูลสำหรับซ้อนคำแปล"""
+        # ขั้น OCR
+        if "result" in job:
+            return job["result"]
+        started = time.perf_counter()
+        # ภาพเดียวกันที่เข้ามาพร้อมกันรอผลจาก OCR ครั้งเดียว
+        ocr_result, shared = await self.ocr_flights.do(
+            f"{job['cache_key']}:{ocr_engine or 'auto'}",
+            lambda: self._recognize_job(job, is_manga, language, ocr_engine)
+        )
+        if shared:
+            ocr_result = dict(ocr_result, coalesced=True)
+        return dict(ocr_result, timings=dict(job["timings"], ocr=(time.perf_counter() - started) * 1000))
+
+    async def process_image_with_overlay(self, image_input, target_lang='th', is_manga=False,
+                                         per_line=False, ocr_engine=None, include_timings=False):
+        """เทียบเท่า ProfessionalTranslationApp.process_image_with_overlay แบบ non-blocking"""
+        app = self.app
+        loop = asyncio.get_running_loop()
         start_time = time.time()
+        ocr_result = await self.ocr_image(image_input, is_manga, ocr_engine)
         
-        # OCR
-        language_setting = 'jpn+kor+chi_sim' if is_manga else 'eng+tha+jpn+kor+chi_sim'
-        ocr_result = self.improve_ocr_accuracy(image_input, is_manga, language_setting)
-        
-        if ocr_result.get("error"):
-            return {"error": ocr_result["error"]}
+        if ocr_result.get("error") or per_line:
+            # แบบทีละบรรทัดใช้ตัวรวม request ของเวอร์ชัน sync ใน thread pool
+            return await loop.run_in_executor(
+                app.batch_translate_pool, app.build_overlay_response,
+                ocr_result, target_lang, is_manga, start_time, per_line, None, include_timings
+            )
         
-        # แปลภาษา
-        context_type = 'manga' if is_manga else 'general'
-        translate_result = self.context_aware_translate(
-            ocr_result["text"], 
-            target_lang, 
+        # ขั้นแปลภาษา
+        translate_started = time.perf_counter()
+        translate_result = await self.context_aware_translate(
+            ocr_result["text"],
+            target_lang,
             ocr_result["detected_language"],
-            context_type
+            'manga' if is_manga else 'general'
         )
+        result = app.overlay_result(ocr_result, translate_result, is_manga, start_time)
+        return app.finish_overlay_response(
+            result, ocr_result, is_manga, start_time, translate_started, include_timings
+        )
+
+    def client_id(self, request):
+        """ระบุ client จาก IP ที่เชื่อมต่อ (X-Client-Id / X-Forwarded-For เฉพาะเมื่อ ASYNC_TRUST_PROXY)"""
+        if ASYNC_TRUST_PROXY:
+            client_id = request.headers.get('X-Client-Id')
+            if client_id:
+                return client_id
+            forwarded = request.headers.get('X-Forwarded-For')
+            if forwarded:
+                return forwarded.split(',')[0].strip()
+        return request.remote or 'unknown'
+
+    @staticmethod
+    def close_after(loop, pending, close, executor=None):
+        """เรียก close (เช่นปิด generator ที่ถูกดึงด้วย next ใน executor) หลัง next ที่ค้างอยู่จบ
         
-        if translate_result.get("error"):
-            return {"error": f"OCR สำเร็จแต่แปลไม่ได้: {translate_result['error']}"}
-        
-        processing_time = time.time() - start_time
-        
-        return {
-            "success": True,
-            "original_text": ocr_result["text"],
-            "translated_text": translate_result["translated_text"],
-            "source_lang": translate_result["source_lang"],
-            "target_lang": translate_result["target_lang"],
-            "text_overlay": ocr_result.get("text_overlay", {}),
-            "processing_time": f"{processing_time:.2f}s",
-            "word_count": ocr_result["word_count"],
-            "is_manga": is_manga
-        }
+        client หลุดระหว่างรอ next ได้ ถ้าปิดทันทีจะเจอ 'generator already executing'
+        """
+        if pending is None or pending.done():
+            close()
+        else:
+            pending.add_done_callback(lambda _: loop.run_in_executor(executor, close))
 
-# สร้าง instance
-app = ProfessionalTranslationApp()
+    async def handle_translate_with_overlay(self, request):
+        """POST /api/translate-with-overlay (โหมด async)"""
+        try:
+            async with self.admission.admit(self.client_id(request)):
+                image_input, options = await self.read_image_request(request)
+                response_format, fields = response_options(options)
+                if response_format not in RESPONSE_FORMATS:
+                    return web.json_response(
+                        {"error": f"format ต้องเป็น {' หรือ '.join(RESPONSE_FORMATS)}"}, status=400
+                    )
+                result = await self.process_image_with_overlay(image_input, *overlay_options(options))
+                self.app.metrics.inc(
+                    "requests_total", endpoint="translate-with-overlay",
+                    outcome="ok" if result.get("success") else "error"
+                )
+                return self.json_response(request, shape_response(result, response_format, fields))
+        except AdmissionRejected as e:
+            self.app.metrics.inc("requests_total", endpoint="translate-with-overlay", outcome=f"rejected_{e.status}")
+            return web.json_response(
+                {"error": e.message}, status=e.status, headers={"Retry-After": str(e.retry_after)}
+            )
+        except Exception as e:
+            return web.json_response({"error": str(e)}, status=500)
 
-# Flask API สำหรับ Chrome Extension
-flask_app = Flask(__name__)
+    async def handle_translate_with_overlay_stream(self, request):
+        """POST /api/translate-with-overlay/stream (โหมด async) ส่ง event ทันทีโดยไม่ผ่าน WSGI fallback ที่ buffer ทั้งก้อน"""
+        try:
+            async with self.admission.admit(self.client_id(request)):
+                image_input, options = await self.read_image_request(request)
+                target_lang, is_manga, _, ocr_engine, _ = overlay_options(options)
+                response_format, _ = response_options(options)
+                if response_format not in RESPONSE_FORMATS:
+                    return web.json_response(
+                        {"error": f"format ต้องเป็น {' หรือ '.join(RESPONSE_FORMATS)}"}, status=400
+                    )
+                
+                start_time = time.time()
+                ocr_result = await self.ocr_image(image_input, is_manga, ocr_engine)
+                response = web.StreamResponse(headers=SSE_HEADERS)
+                response.content_type = 'text/event-stream'
+                response.charset = 'utf-8'
+                await response.prepare(request)
+                
+                # ขั้นแปลทีละบรรทัดใช้ตัวรวม request ของเวอร์ชัน sync ใน thread pool ทีละ event
+                loop = asyncio.get_running_loop()
+                events = self.app.overlay_events(ocr_result, target_lang, is_manga, start_time, response_format)
+                outcome = "exception"
+                pending = None
+                try:
+                    while True:
+                        pending = loop.run_in_executor(self.app.batch_translate_pool, next, events, None)
+                        item = await pending
+                        if item is None:
+                            break
+                        if item[0] in ("done", "error"):
+                            outcome = "ok" if item[0] == "done" else "error"
+                        await response.write(sse_event(*item))
+                except ConnectionResetError:
+                    # client ปิดการเชื่อมต่อก่อนจบ stream
+                    return response
+                except Exception as e:
+                    await response.write(sse_event("error", {"error": str(e)}))
+                finally:
+                    self.close_after(loop, pending, events.close, self.app.batch_translate_pool)
+                    self.app.metrics.inc("requests_total", endpoint="translate-with-overlay-stream", outcome=outcome)
+                await response.write_eof()
+                return response
+        except AdmissionRejected as e:
+            self.app.metrics.inc(
+                "requests_total", endpoint="translate-with-overlay-stream", outcome=f"rejected_{e.status}"
+            )
+            return web.json_response(
+                {"error": e.message}, status=e.status, headers={"Retry-After": str(e.retry_after)}
+            )
+        except Exception as e:
+            return web.json_response({"error": str(e)}, status=500)
 
-@flask_app.route('/api/translate-with-overlay', methods=['POST'])
-def api_translate_with_overlay():
-    """API สำหรับ Chrome Extension ที่ต้องการซ้อนคำแปล"""
-    try:
-        data = request.get_json()
-        image_data = data.get('image', '')
-        target_lang = data.get('target_lang', 'th')
-        is_manga = data.get('is_manga', False)
+    def json_response(self, request, payload, status=200):
+        """JSON (UTF-8) บีบอัดตาม Accept-Encoding แบบเดียวกับฝั่ง Flask"""
+        body, encoding = compress_body(
+            json.dumps(payload, ensure_ascii=False).encode('utf-8'), request.headers.get('Accept-Encoding')
+        )
+        headers = {"Vary": "Accept-Encoding"}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return web.Response(body=body, status=status, content_type='application/json', headers=headers)
+
+    async def read_image_request(self, request):
+        """เหมือน read_image_request ของ Flask: JSON, multipart/form-data หรือ body ดิบ"""
+        if request.content_type == 'multipart/form-data':
+            form = await request.post()
+            options = {name: value for name, value in form.items() if not isinstance(value, web.FileField)}
+            upload = form.get('image')
+            if isinstance(upload, web.FileField):
+                return upload.file.read(), options
+            return options.get('image', ''), options
+        if is_raw_image_mimetype(request.content_type):
+            return await request.read(), dict(request.query)
+        options = await request.json()
+        return options.get('image', ''), options
+
+    async def handle_admission_stats(self, request):
+        return web.json_response(dict(
+            self.admission.get_stats(),
+            worker_pid=os.getpid(),
+            coalescing={
+                "ocr": self.ocr_flights.get_stats(),
+                "translation": self.translation_flights.get_stats()
+            }
+        ))
+
+    async def handle_wsgi_fallback(self, request):
+        """endpoint อื่นๆ (stats/admin/batch) ส่งต่อให้ Flask app ใน thread pool
         
-        result = app.process_image_with_overlay(image_data, target_lang, is_manga)
-        return jsonify(result)
+        response ที่ไม่มี Content-Length (เช่น NDJSON ของ /api/translate-batch) ส่งต่อทีละก้อนทันทีที่ได้
+        """
+        from werkzeug.test import EnvironBuilder, run_wsgi_app
         
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        if request.path == BATCH_PATH:
+            request = request.clone(client_max_size=BATCH_MAX_REQUEST_BYTES)
+        body = await request.read()
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() != 'content-length']
+        builder = EnvironBuilder(
+            path=request.path, method=request.method, query_string=request.query_string,
+            headers=headers, data=body
+        )
+        loop = asyncio.get_running_loop()
+        # ทุกขั้นของ WSGI app (รวม stream_with_context) ต้องเห็น context ของ Flask ชุดเดียวกันแม้รันคนละ thread
+        context = contextvars.copy_context()
+        app_iter = pending = None
+        try:
+            app_iter, status, response_headers = await loop.run_in_executor(
+                None, context.run, run_wsgi_app, flask_app, builder.get_environ()
+            )
+            status = int(status.split()[0])
+            skip = ('content-length', 'transfer-encoding', 'connection')
+            forward = {k: v for k, v in response_headers.items() if k.lower() not in skip}
+            
+            if 'Content-Length' in response_headers:
+                payload = await loop.run_in_executor(None, context.run, b"".join, app_iter)
+                return web.Response(status=status, body=payload, headers=forward)
+            
+            response = web.StreamResponse(status=status, headers=forward)
+            await response.prepare(request)
+            chunks = iter(app_iter)
+            try:
+                while True:
+                    pending = loop.run_in_executor(None, context.run, next, chunks, None)
+                    chunk = await pending
+                    if chunk is None:
+                        break
+                    await response.write(chunk)
+            except ConnectionResetError:
+                # client ปิดการเชื่อมต่อก่อนจบ stream
+                return response
+            await response.write_eof()
+            return response
+        finally:
+            def cleanup():
+                if hasattr(app_iter, 'close'):
+                    context.run(app_iter.close)
+                builder.close()
+            self.close_after(loop, pending, cleanup)
 
-@flask_app.route('/api/health', methods=['GET'])
-def health_check():
-    return jsonify({
-        "status": "healthy", 
-        "service": "Professional Translation API",
-        "features": ["context_aware", "manga_support", "overlay_data"]
-    })
 
-def run_flask():
-    flask_app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
+def create_async_api(translator=None):
+    """สร้าง aiohttp application สำหรับ SERVER_MODE=async"""
+    pipeline = AsyncTranslationPipeline(translator or app)
+    web_app = web.Application(client_max_size=MAX_REQUEST_BYTES)
+    web_app["pipeline"] = pipeline
+    web_app.router.add_post('/api/translate-with-overlay', pipeline.handle_translate_with_overlay)
+    web_app.router.add_post('/api/translate-with-overlay/stream', pipeline.handle_translate_with_overlay_stream)
+    web_app.router.add_get('/api/admission/stats', pipeline.handle_admission_stats)
+    web_app.router.add_route('*', '/{tail:.*}', pipeline.handle_wsgi_fallback)
+    
+    async def close_client(_):
+        await pipeline.client.close()
+    web_app.on_cleanup.append(close_client)
+    return web_app
 
-# Gradio Interface
-with gr.Blocks(
-    title="Professional Translator - แม่นยำสูง", 
-    theme=gr.themes.Soft(),
-    css="""
-    .gradio-container {
-        max-width: 1400px !important;
-    }
-    .accuracy-badge {
-        background: #4CAF50;
-        color: white;
-        padding: 4px 8px;
-        border-radius: 12px;
-        font-size: 12px;
-    }
+
+def run_async_api(sock=None):
+    """รัน API แบบ async (event loop เดียว รองรับ client จำนวนมากโดยไม่ต้องใช้ thread ต่อ request)"""
+    async def serve():
+        runner = web.AppRunner(create_async_api())
+        await runner.setup()
+        site = web.SockSite(runner, sock) if sock is not None else web.TCPSite(runner, '0.0.0.0', API_PORT)
+        await site.start()
+        await asyncio.Event().wait()
+    
+    asyncio.run(serve())
+
+
+def run_api_server(sock=None):
+    """รัน API ตาม SERVER_MODE (sock = socket ที่เปิดไว้แล้วของ pre-fork worker)"""
+    if SERVER_MODE == 'async':
+        if web is None:
+            print("SERVER_MODE=async ต้องติดตั้ง aiohttp ใช้ Flask แทน")
+        else:
+            return run_async_api(sock)
+    run_flask(sock)
+
+
+def preload_modules():
+    """import OpenCV/NumPy/PIL ใน process แม่ก่อน fork ให้ worker ใช้หน้าหน่วยความจำร่วมกัน (copy-on-write)"""
+    for module in (cv2, np, Image):
+        if isinstance(module, LazyModule):
+            module._load()
+
+
+def open_api_socket():
+    """socket ของ API ที่ worker ทุกตัว accept ร่วมกัน"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('0.0.0.0', API_PORT))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    return sock
+
+
+def fork_api_worker(sock, index):
+    """fork worker หนึ่งตัว คืน pid ให้ process แม่ (worker ไม่กลับมาที่โค้ดของ process แม่)"""
+    pid = os.fork()
+    if pid:
+        return pid
+    
+    status = 1
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        if WARMUP:
+            # warm-up หลัง fork: thread pool และ connection ของแต่ละ worker ต้องสร้างใน process ตัวเอง
+            app.warm_up()
+        print(f"API worker {index} (pid {os.getpid()}) พร้อมรับ request")
+        run_api_server(sock)
+        status = 0
+    except KeyboardInterrupt:
+        status = 0
+    except BaseException as e:
+        print(f"API worker {index} error: {e}")
+    finally:
+        os._exit(status)
+
+
+def run_prefork_api(workers=WORKERS, parent_pid=None):
+    """pre-fork: เปิด socket ครั้งเดียวแล้ว fork worker หลายตัวที่รับ request จาก socket เดียวกัน
+    
+    แต่ละ worker มี GIL ของตัวเอง แคช OCR/translation memory ใช้ร่วมกันผ่าน SQLite
+    process แม่ดูแล worker อย่างเดียว (เริ่มใหม่เมื่อ worker ตาย, SIGTERM/SIGINT ปิดทุกตัว)
+    parent_pid: ปิดทุก worker เมื่อ process นี้ตาย (Gradio ของโหมด full)
     """
-) as demo:
-    gr.Markdown("""
-    # 🎯 Professional Translator - ความแม่นยำสูง
-    **ใช้ AI ล่าสุด • เข้าใจบริบท • ซ้อนคำแปลบนภาพได้**
-    """)
-    
-    with gr.Tab("🧠 แปลแบบเข้าใจบริบท"):
-        gr.Markdown("### การแปลที่เข้าใจความหมายจริงๆ")
-        
-        with gr.Row():
-            with gr.Column():
-                context_text = gr.Textbox(
-                    label="ข้อความต้นทาง",
-                    placeholder="ป้อนข้อความที่ต้องการแปล...",
-                    lines=5
-                )
-                
-                with gr.Row():
-                    context_source = gr.Dropdown(
-                        choices=[("auto", "🔍 ตรวจจับอัตโนมัติ")] + 
-                                [(code, f"{info['emoji']} {info['name']}") for code, info in app.supported_languages.items()],
-                        label="ภาษาต้นทาง",
-                        value="auto"
+    preload_modules()
+    sock = open_api_socket()
+    children = {fork_api_worker(sock, index): index for index in range(workers)}
+    stopping = False
+    
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"API {workers} workers บน port {API_PORT}")
+    
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if parent_pid is not None and os.getppid() != parent_pid and not stopping:
+                stop(None, None)
+            time.sleep(0.5)
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"API worker {index} (pid {pid}) หยุดทำงาน (status {status}) เริ่มใหม่")
+        time.sleep(1)
+        children[fork_api_worker(sock, index)] = index
+    sock.close()
+
+
+def start_api_supervisor():
+    """โหมด full + WORKERS > 1: fork process ดูแล API worker แยกจาก Gradio (ก่อน Gradio สร้าง thread)"""
+    parent_pid = os.getpid()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_prefork_api(parent_pid=parent_pid)
+        finally:
+            os._exit(0)
+    
+    def stop_supervisor():
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(pid, signal.SIGTERM)
+    atexit.register(stop_supervisor)
+
+def create_interface():
+    """สร้าง Gradio UI (import gradio เฉพาะโหมด full)"""
+    import gradio as gr
+    
+    with gr.Blocks(
+        title="Professional Translator - แม่นยำสูง", 
+        theme=gr.themes.Soft(),
+        css="""
+        .gradio-container {
+            max-width: 1400px !important;
+        }
+        .accuracy-badge {
+            background: #4CAF50;
+            color: white;
+            padding: 4px 8px;
+            border-radius: 12px;
+            font-size: 12px;
+        }
+        """
+    ) as demo:
+        gr.Markdown("""
+        # 🎯 Professional Translator - ความแม่นยำสูง
+        **ใช้ AI ล่าสุด • เข้าใจบริบท • ซ้อนคำแปลบนภาพได้**
+        """)
+    
+        with gr.Tab("🧠 แปลแบบเข้าใจบริบท"):
+            gr.Markdown("### การแปลที่เข้าใจความหมายจริงๆ")
+        
+            with gr.Row():
+                with gr.Column():
+                    context_text = gr.Textbox(
+                        label="ข้อความต้นทาง",
+                        placeholder="ป้อนข้อความที่ต้องการแปล...",
+                        lines=5
                     )
+                
+                    with gr.Row():
+                        context_source = gr.Dropdown(
+                            choices=[("auto", "🔍 ตรวจจับอัตโนมัติ")] + 
+                                    [(code, f"{info['emoji']} {info['name']}") for code, info in app.supported_languages.items()],
+                            label="ภาษาต้นทาง",
+                            value="auto"
+                        )
                     
-                    context_target = gr.Dropdown(
-                        choices=[(code, f"{info['emoji']} {info['name']}") for code, info in app.supported_languages.items()],
-                        label="ภาษาปลายทาง",
-                        value="th"
-                    )
+                        context_target = gr.Dropdown(
+                            choices=[(code, f"{info['emoji']} {info['name']}") for code, info in app.supported_languages.items()],
+                            label="ภาษาปลายทาง",
+                            value="th"
+                        )
                 
-                context_type = gr.Radio(
-                    choices=[
-                        ("general", "📝 ทั่วไป"),
-                        ("manga", "🎌 มังงะ/การ์ตูน"),
-                        ("formal", "💼 ทางการ")
-                    ],
-                    label="บริบทการแปล",
-                    value="general"
-                )
+                    context_type = gr.Radio(
+                        choices=[
+                            ("general", "📝 ทั่วไป"),
+                            ("manga", "🎌 มังงะ/การ์ตูน"),
+                            ("formal", "💼 ทางการ")
+                        ],
+                        label="บริบทการแปล",
+                        value="general"
+                    )
                 
-                context_btn = gr.Button("🧠 แปลแบบเข้าใจบริบท", variant="primary")
+                    context_btn = gr.Button("🧠 แปลแบบเข้าใจบริบท", variant="primary")
             
-            with gr.Column():
-                context_output = gr.Textbox(
-                    label="ผลการแปล",
-                    lines=5,
-                    show_copy_button=True
-                )
+                with gr.Column():
+                    context_output = gr.Textbox(
+                        label="ผลการแปล",
+                        lines=5,
+                        show_copy_button=True
+                    )
                 
-                gr.Markdown("""
-                **✨ คุณสมบัติพิเศษ:**
-                - เข้าใจบริบทมังงะและการ์ตูน
-                - รู้จักคำศัพท์เฉพาะ
-                - ปรับรูปแบบการแปลตามบริบท
-                """)
-        
-        def handle_context_translate(text, source, target, context):
-            result = app.context_aware_translate(text, target, source, context)
-            if result.get("success"):
-                return f"🎯 แปลแบบเข้าใจบริบท ({context}):\n\n{result['translated_text']}"
-            else:
-                return f"❌ {result.get('error', 'เกิดข้อผิดพลาด')}"
+                    gr.Markdown("""
+                    **✨ คุณสมบัติพิเศษ:**
+                    - เข้าใจบริบทมังงะและการ์ตูน
+                    - รู้จักคำศัพท์เฉพาะ
+                    - ปรับรูปแบบการแปลตามบริบท
+                    """)
         
-        context_btn.click(
-            handle_context_translate,
-            inputs=[context_text, context_source, context_target, context_type],
-            outputs=[context_output]
-        )
+            def handle_context_translate(text, source, target, context):
+                result = app.context_aware_translate(text, target, source, context)
+                if result.get("success"):
+                    return f"🎯 แปลแบบเข้าใจบริบท ({context}):\n\n{result['translated_text']}"
+                else:
+                    return f"❌ {result.get('error', 'เกิดข้อผิดพลาด')}"
+        
+            context_btn.click(
+                handle_context_translate,
+                inputs=[context_text, context_source, context_target, context_type],
+                outputs=[context_output]
+            )
     
-    with gr.Tab("📖 มังงะแม่นยำสูง"):
-        gr.Markdown("### 🎌 โหมดมังงะ - ประมวลผลภาพพิเศษ")
+        with gr.Tab("📖 มังงะแม่นยำสูง"):
+            gr.Markdown("### 🎌 โหมดมังงะ - ประมวลผลภาพพิเศษ")
         
-        with gr.Row():
-            with gr.Column():
-                manga_image_high = gr.Image(
-                    label="อัพโหลดภาพมังงะ",
-                    type="pil",
-                    sources=["upload", "clipboard", "url"],
-                    height=300
-                )
+            with gr.Row():
+                with gr.Column():
+                    manga_image_high = gr.Image(
+                        label="อัพโหลดภาพมังงะ",
+                        type="pil",
+                        sources=["upload", "clipboard"],
+                        height=300
+                    )
                 
-                manga_target_high = gr.Dropdown(
-                    choices=[(code, info['name']) for code, info in app.supported_languages.items() 
-                            if code not in ['ja', 'ko', 'zh']],
-                    label="แปลเป็นภาษา",
-                    value="th"
-                )
+                    manga_target_high = gr.Dropdown(
+                        choices=[(code, info['name']) for code, info in app.supported_languages.items() 
+                                if code not in ['ja', 'ko', 'zh']],
+                        label="แปลเป็นภาษา",
+                        value="th"
+                    )
                 
-                advanced_btn = gr.Button("🎌 ประมวลผลมังงะแบบแม่นยำ", variant="stop")
+                    advanced_btn = gr.Button("🎌 ประมวลผลมังงะแบบแม่นยำ", variant="stop")
             
-            with gr.Column():
-                manga_original = gr.Textbox(
-                    label="ข้อความต้นทางที่ตรวจพบ",
-                    lines=4,
-                    show_copy_button=True
-                )
-                manga_translated_high = gr.Textbox(
-                    label="ผลการแปล (เข้าใจบริบท)",
-                    lines=4,
-                    show_copy_button=True
-                )
+                with gr.Column():
+                    manga_original = gr.Textbox(
+                        label="ข้อความต้นทางที่ตรวจพบ",
+                        lines=4,
+                        show_copy_button=True
+                    )
+                    manga_translated_high = gr.Textbox(
+                        label="ผลการแปล (เข้าใจบริบท)",
+                        lines=4,
+                        show_copy_button=True
+                    )
         
-        def handle_advanced_manga(image, target_lang):
-            result = app.process_image_with_overlay(image, target_lang, True)
-            if result.get("success"):
-                return (
-                    f"📖 ต้นทาง ({result['source_lang']}):\n\n{result['original_text']}",
-                    f"🌐 แปลเป็น {app.supported_languages[result['target_lang']]['name']}:\n\n{result['translated_text']}\n\n⏱️ ใช้เวลา: {result['processing_time']}"
-                )
-            else:
-                return f"❌ {result.get('error')}", ""
+            def handle_advanced_manga(image, target_lang):
+                result = app.process_image_with_overlay(image, target_lang, True)
+                if result.get("success"):
+                    return (
+                        f"📖 ต้นทาง ({result['source_lang']}):\n\n{result['original_text']}",
+                        f"🌐 แปลเป็น {app.supported_languages[result['target_lang']]['name']}:\n\n{result['translated_text']}\n\n⏱️ ใช้เวลา: {result['processing_time']}"
+                    )
+                else:
+                    return f"❌ {result.get('error')}", ""
         
-        advanced_btn.click(
-            handle_advanced_manga,
-            inputs=[manga_image_high, manga_target_high],
-            outputs=[manga_original, manga_translated_high]
-        )
+            advanced_btn.click(
+                handle_advanced_manga,
+                inputs=[manga_image_high, manga_target_high],
+                outputs=[manga_original, manga_translated_high]
+            )
     
-    with gr.Tab("🔧 สำหรับ Developer"):
-        gr.Markdown("### API สำหรับ Chrome Extension")
-        
-        with gr.Row():
-            with gr.Column():
-                gr.Markdown("""
-                **🎯 Endpoint พิเศษสำหรับซ้อนคำแปล:**
-                ```http
-                POST /api/translate-with-overlay
-                {
-                  "image": "base64_image_data",
-                  "target_lang": "th",
-                  "is_manga": false
-                }
-                ```
+        with gr.Tab("🔧 สำหรับ Developer"):
+            gr.Markdown("### API สำหรับ Chrome Extension")
+        
+            with gr.Row():
+                with gr.Column():
+                    gr.Markdown("""
+                    **🎯 Endpoint พิเศษสำหรับซ้อนคำแปล:**
+                    ```http
+                    POST /api/translate-with-overlay
+                    {
+                      "image": "base64_image_data",
+                      "target_lang": "th",
+                      "is_manga": false,
+                      "per_line": false,
+                      "include_timings": false
+                    }
+                    ```
                 
-                **📋 Response:**
-                ```json
-                {
-                  "success": true,
-                  "original_text": "原文",
-                  "translated_text": "คำแปล",
-                  "text_overlay": {
-                    "Lines": [
-                      {
-                        "LineText": "ข้อความ",
-                        "Words": [
+                    **📋 Response:**
+                    ```json
+                    {
+                      "success": true,
+                      "original_text": "原文",
+                      "translated_text": "คำแปล",
+                      "text_overlay": {
+                        "Lines": [
                           {
-                            "WordText": "คำ",
-                            "Left": 100,
-                            "Top": 50,
-                            "Height": 20,
-                            "Width": 40
+                            "LineText": "ข้อความ",
+                            "Words": [
+                              {
+                                "WordText": "คำ",
+                                "Left": 100,
+                                "Top": 50,
+                                "Height": 20,
+                                "Width": 40
+                              }
+                            ]
                           }
                         ]
                       }
-                    ]
-                  }
-                }
-                ```
-                """)
+                    }
+                    ```
+                    """)
             
-            with gr.Column():
-                gr.Markdown("""
-                **🛠️ ข้อมูลตำแหน่งสำหรับซ้อนคำแปล:**
+                with gr.Column():
+                    gr.Markdown("""
+                    **🛠️ ข้อมูลตำแหน่งสำหรับซ้อนคำแปล:**
                 
-                ใช้ข้อมูลจาก `text_overlay` เพื่อ:
-                - หาตำแหน่งข้อความต้นทาง
-                - ซ้อนคำแปลในตำแหน่งเดียวกัน
-                - ปรับขนาดฟอนต์ให้เหมาะสม
+                    ใช้ข้อมูลจาก `text_overlay` เพื่อ:
+                    - หาตำแหน่งข้อความต้นทาง
+                    - ซ้อนคำแปลในตำแหน่งเดียวกัน
+                    - ปรับขนาดฟอนต์ให้เหมาะสม
                 
-                **🎨 ตัวอย่างการใช้งาน:**
-                ```javascript
-                // สร้าง overlay element
-                const overlay = document.createElement('div');
-                overlay.style.position = 'absolute';
-                overlay.style.left = word.Left + 'px';
-                overlay.style.top = word.Top + 'px';
-                overlay.style.background = 'rgba(255,255,255,0.9)';
-                overlay.innerText = translatedText;
-                ```
-                """)
-
-# เริ่ม Flask server
-flask_thread = threading.Thread(target=run_flask, daemon=True)
-flask_thread.start()
+                    **🎨 ตัวอย่างการใช้งาน:**
+                    ```javascript
+                    // สร้าง overlay element
+                    const overlay = document.createElement('div');
+                    overlay.style.position = 'absolute';
+                    overlay.style.left = word.Left + 'px';
+                    overlay.style.top = word.Top + 'px';
+                    overlay.style.background = 'rgba(255,255,255,0.9)';
+                    overlay.innerText = translatedText;
+                    ```
+                    """)
+    return demo
 
-if __name__ == "__main__":
+
+def main():
+    """APP_MODE=api: API server อย่างเดียวใน main thread / full: API ใน thread + Gradio UI
+    
+    WORKERS > 1: API เป็น pre-fork worker แยก process (แต่ละ worker warm-up ของตัวเองหลัง fork)
+    """
+    prefork = PREFORK
+    if WORKERS > 1 and not prefork:
+        print("WORKERS > 1 ต้องใช้ระบบที่รองรับ fork รันแบบ process เดียวแทน")
+    
+    if prefork:
+        # fork ก่อนสร้าง thread ใดๆ ใน process นี้
+        if APP_MODE == 'api':
+            return run_prefork_api()
+        start_api_supervisor()
+    
+    if WARMUP:
+        # อุ่นเครื่องให้เสร็จก่อนเปิด port จะได้ไม่รับ request แรกขณะยังเย็นอยู่
+        app.warm_up()
+    
+    if APP_MODE == 'api':
+        return run_api_server()
+    
+    demo = create_interface()
+    if not prefork:
+        # เริ่ม API server (Flask หรือ aiohttp ตาม SERVER_MODE)
+        threading.Thread(target=run_api_server, daemon=True).start()
     demo.launch(
         server_name="0.0.0.0",
         server_port=PORT,
         share=False
-    )
\ No newline at end of file
+    )
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,86 @@
+"""Micro-benchmark: detect_language_advanced (NumPy) เทียบกับเวอร์ชันเดิม (list comprehension)
+
+รัน: python benchmarks/bench_detect_language.py [--repeat 200]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import ProfessionalTranslationApp  # noqa: E402
+
+
+def legacy_detect_language(text):
+    """เวอร์ชันเดิมก่อนเปลี่ยนเป็น NumPy (ใช้เทียบผลลัพธ์และความเร็ว)"""
+    thai_count = len([c for c in text if '\u0e00' <= c <= '\u0e7f'])
+    japanese_count = len([c for c in text if '\u3040' <= c <= '\u309f' or '\u30a0' <= c <= '\u30ff' or '\u4e00' <= c <= '\u9fff'])
+    korean_count = len([c for c in text if '\uac00' <= c <= '\ud7a3'])
+    chinese_count = len([c for c in text if '\u4e00' <= c <= '\u9fff' and not ('\u3040' <= c <= '\u309f' or '\u30a0' <= c <= '\u30ff')])
+
+    counts = {
+        'th': thai_count,
+        'ja': japanese_count,
+        'ko': korean_count,
+        'zh': chinese_count
+    }
+
+    detected_lang = max(counts, key=counts.get)
+    if counts[detected_lang] == 0:
+        return 'en'
+    return detected_lang
+
+
+SAMPLES = {
+    'th': "สวัสดีครับ วันนี้อากาศดีมาก เราไปเที่ยวทะเลกันไหม",
+    'ja': "お前はもう死んでいる。俺の名前を言ってみろ！",
+    'ko': "나는 너를 사랑해. 감사합니다, 정말 고마워요.",
+    'zh': "我们今天去哪里吃饭？你决定吧。",
+    'en': "I can't believe you did that. Let's go home now!",
+    'ru': "Я не могу поверить, что ты это сделал.",
+    'hi': "मैं विश्वास नहीं कर सकता कि तुमने ऐसा किया।",
+    'vi': "Tôi không thể tin được là bạn đã làm điều đó.",
+}
+
+# ข้อความละตินที่มีตัวอักษรของภาษาอื่นปนมาเล็กน้อย ต้องยังเป็น 'en' เหมือนเวอร์ชันเดิม
+MIXED_SAMPLES = {
+    'en_cyrillic': "Hello world, this is a test with a Cyrillic б letter",
+    'ro': "Bună ziua, ce mai faci astăzi?",
+    'en_vi_name': "We met Nguyễn at the station and went to the museum together.",
+    'en_devanagari': "The symbol ॐ is often written at the top of the page.",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--long-factor", type=int, default=400,
+                        help="จำนวนครั้งที่ต่อข้อความเพื่อจำลอง transcript เว็บตูนยาว")
+    args = parser.parse_args()
+
+    app = ProfessionalTranslationApp()
+
+    # ผลลัพธ์ต้องตรงกับเวอร์ชันเดิมสำหรับ th/ja/ko/zh/en และข้อความละตินที่มีตัวอักษรอื่นปน
+    for lang in ('th', 'ja', 'ko', 'zh', 'en'):
+        text = SAMPLES[lang]
+        assert app.detect_language_advanced(text) == legacy_detect_language(text), lang
+    for name, text in MIXED_SAMPLES.items():
+        assert app.detect_language_advanced(text) == legacy_detect_language(text) == 'en', name
+    # ภาษาที่เวอร์ชันเดิมตรวจไม่ได้
+    for lang in ('ru', 'hi', 'vi'):
+        assert app.detect_language_advanced(SAMPLES[lang]) == lang, lang
+
+    cases = dict(SAMPLES)
+    cases['webtoon_long'] = "\n".join(SAMPLES.values()) * args.long_factor
+
+    print(f"{'case':<14}{'chars':>8}{'legacy us':>12}{'numpy us':>12}{'speedup':>9}  result")
+    for name, text in cases.items():
+        legacy = timeit.timeit(lambda: legacy_detect_language(text), number=args.repeat) / args.repeat
+        current = timeit.timeit(lambda: app.detect_language_advanced(text), number=args.repeat) / args.repeat
+        print(f"{name:<14}{len(text):>8}{legacy * 1e6:>12.1f}{current * 1e6:>12.1f}"
+              f"{legacy / current:>8.1f}x  {app.detect_language_advanced(text)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""สร้าง corpus ภาพมังงะ/เว็บตูนสังเคราะห์สำหรับ benchmark (สุ่มแบบกำหนด seed จึงได้ภาพเดิมทุกครั้ง)
+
+รัน: python benchmarks/corpus.py [--output benchmarks/corpus] [--manga 8] [--webtoon 4]
+
+- manga: หน้าขาวดำ 1200x1700 มีกรอบช่อง, screentone, ลายเส้นและ speech bubble (JPEG เหมือนสแกน)
+- webtoon: ภาพสียาว 800x(5000-9000) ไล่สีพื้นหลังและ bubble เป็นช่วงๆ (JPEG/PNG)
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+MANIFEST = "manifest.json"
+
+BUBBLE_LINES = [
+    "WHAT ARE YOU DOING HERE?",
+    "I WON'T LOSE THIS TIME!",
+    "WAIT... THAT'S IMPOSSIBLE",
+    "LET'S GO HOME.",
+    "YOU'RE LATE AGAIN!",
+    "HE'S STRONGER THAN I THOUGHT",
+]
+
+
+def _font():
+    try:
+        return ImageFont.load_default(size=22)
+    except TypeError:  # Pillow รุ่นเก่าไม่มี size
+        return ImageFont.load_default()
+
+
+def _screentone(height, width, rng):
+    """ลายจุด screentone แบบมังงะ"""
+    spacing = int(rng.integers(5, 10))
+    radius = spacing / 3.0
+    yy, xx = np.mgrid[0:height, 0:width]
+    dist = np.hypot((yy % spacing) - spacing / 2.0, (xx % spacing) - spacing / 2.0)
+    return np.where(dist < radius, 90, 235).astype(np.uint8)
+
+
+def _bubble(draw, rng, box_left, box_top, box_right, box_bottom, font, fill="white"):
+    """วาด speech bubble รูปวงรีพร้อมข้อความในกรอบที่กำหนด"""
+    width = int(rng.integers(220, 360))
+    height = int(rng.integers(110, 180))
+    left = int(rng.integers(box_left, max(box_left + 1, box_right - width)))
+    top = int(rng.integers(box_top, max(box_top + 1, box_bottom - height)))
+    draw.ellipse((left, top, left + width, top + height), fill=fill, outline="black", width=3)
+
+    words = BUBBLE_LINES[int(rng.integers(len(BUBBLE_LINES)))].split()
+    lines = [" ".join(words[i:i + 2]) for i in range(0, len(words), 2)]
+    y = top + height // 2 - 14 * len(lines)
+    for line in lines:
+        draw.text((left + width // 2, y), line, fill="black", font=font, anchor="ma")
+        y += 28
+
+
+def manga_page(rng, width=1200, height=1700):
+    page = np.full((height, width), 255, dtype=np.uint8)
+
+    # แบ่งช่องเป็นแถวๆ ละ 1-2 ช่อง
+    rows = int(rng.integers(3, 5))
+    edges = np.linspace(40, height - 40, rows + 1).astype(int)
+    panels = []
+    for top, bottom in zip(edges[:-1], edges[1:]):
+        split = int(rng.integers(width // 3, 2 * width // 3)) if rng.random() < 0.6 else None
+        columns = [(40, split - 10), (split + 10, width - 40)] if split else [(40, width - 40)]
+        for left, right in columns:
+            panels.append((left, top + 10, right, bottom - 10))
+
+    for left, top, right, bottom in panels:
+        if rng.random() < 0.5:
+            page[top:bottom, left:right] = _screentone(bottom - top, right - left, rng)
+
+    image = Image.fromarray(page)
+    draw = ImageDraw.Draw(image)
+    font = _font()
+    for left, top, right, bottom in panels:
+        draw.rectangle((left, top, right, bottom), outline="black", width=4)
+        # ลายเส้นสุ่มแทนภาพตัวละคร
+        for _ in range(int(rng.integers(6, 14))):
+            x0, x1 = sorted(rng.integers(left, right, 2))
+            y0, y1 = sorted(rng.integers(top, bottom, 2))
+            draw.line((x0, y0, x1, y1), fill=int(rng.integers(0, 80)), width=int(rng.integers(1, 4)))
+        if rng.random() < 0.8:
+            _bubble(draw, rng, left + 10, top + 10, right - 10, bottom - 10, font)
+
+    # noise แบบภาพสแกน
+    noisy = np.asarray(image, dtype=np.int16) + rng.normal(0, 6, (height, width)).astype(np.int16)
+    return Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8)).convert("RGB")
+
+
+def webtoon_strip(rng, width=800, height=None):
+    height = height or int(rng.integers(5000, 9000))
+    t = np.linspace(0.0, 1.0, height)[:, None, None]
+    top_color = rng.integers(120, 255, 3)
+    bottom_color = rng.integers(20, 200, 3)
+    strip = (top_color * (1 - t) + bottom_color * t).repeat(width, axis=1).astype(np.uint8)
+
+    image = Image.fromarray(strip)
+    draw = ImageDraw.Draw(image)
+    font = _font()
+    y = 200
+    while y < height - 400:
+        # ช่องภาพสีเรียบ + bubble
+        panel_height = int(rng.integers(500, 1100))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        draw.rectangle((60, y, width - 60, min(height - 200, y + panel_height)), fill=color)
+        _bubble(draw, rng, 80, y + 20, width - 80, y + panel_height // 2, font)
+        y += panel_height + int(rng.integers(300, 900))
+    return image
+
+
+def generate_corpus(directory=DEFAULT_DIR, manga=8, webtoon=4, seed=1234):
+    """สร้าง corpus (ข้ามถ้ามีชุดเดียวกันอยู่แล้ว) คืน list ของ {path, kind, is_manga, width, height}"""
+    params = {"manga": manga, "webtoon": webtoon, "seed": seed}
+    manifest_path = os.path.join(directory, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("params") == params and all(
+            os.path.exists(os.path.join(directory, item["path"])) for item in manifest["images"]
+        ):
+            return [dict(item, path=os.path.join(directory, item["path"])) for item in manifest["images"]]
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    images = []
+    for index in range(manga):
+        image = manga_page(rng)
+        name = f"manga_{index:02d}.jpg"
+        image.save(os.path.join(directory, name), "JPEG", quality=85)
+        images.append({"path": name, "kind": "manga", "is_manga": True,
+                       "width": image.width, "height": image.height})
+    for index in range(webtoon):
+        image = webtoon_strip(rng)
+        # เว็บตูนส่วนใหญ่เป็น JPEG มีบางเรื่องเป็น PNG
+        name = f"webtoon_{index:02d}." + ("png" if index % 2 else "jpg")
+        image.save(os.path.join(directory, name), "PNG" if index % 2 else "JPEG", quality=90)
+        images.append({"path": name, "kind": "webtoon", "is_manga": False,
+                       "width": image.width, "height": image.height})
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"params": params, "images": images}, f, indent=2)
+    return [dict(item, path=os.path.join(directory, item["path"])) for item in images]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=DEFAULT_DIR)
+    parser.add_argument("--manga", type=int, default=8)
+    parser.add_argument("--webtoon", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    for item in generate_corpus(args.output, args.manga, args.webtoon, args.seed):
+        size = os.path.getsize(item["path"]) / 1024
+        print(f"{item['kind']:8s} {item['width']}x{item['height']:<6d} {size:8.1f} KB  {item['path']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+"""ชุด benchmark: enhance_manga_image, detect_language_advanced, end-to-end /api/translate-with-overlay และเวลาเริ่มแอป
+
+end-to-end รันแอปเป็น process แยก ชี้ provider ทั้งหมดไปที่ stand-in (benchmarks/standins.py)
+แล้วยิง request ที่ concurrency หลายระดับ ผลทั้งหมดเขียนเป็น JSON เพื่อเทียบระหว่าง release
+startup วัดเวลา import, เวลาจนถึง /api/health ตอบ และ latency ของ request แรก ในแต่ละ APP_MODE
+
+รัน:
+    python benchmarks/run.py                                # ทุก driver
+    python benchmarks/run.py --only e2e --concurrency 1,8,32 --requests 200
+    python benchmarks/run.py --only enhance,detect --output /tmp/bench.json
+    python benchmarks/run.py --only e2e --ocr-latency-ms 1200 --error-rate 0.05 --ocr-rate-limit 2
+    python benchmarks/run.py --only e2e --warm          # เปิดแคช (วัดกรณีภาพซ้ำ)
+    python benchmarks/run.py --only startup --startup-runs 5
+"""
+import argparse
+import base64
+import importlib.util
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import DEFAULT_DIR, generate_corpus  # noqa: E402
+from standins import add_behaviour_arguments, behaviours_from_args, start_standins  # noqa: E402
+
+DRIVERS = ("enhance", "detect", "e2e", "startup")
+# โมดูลที่ import นาน (ตรวจว่าโหลดตอน import app หรือไม่)
+HEAVY_MODULES = ("gradio", "cv2", "numpy", "PIL", "pytesseract", "aiohttp")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples, q):
+    """nearest-rank percentile (q = 0-100)"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize_ms(seconds):
+    values = [s * 1000 for s in seconds]
+    return {
+        "n": len(values),
+        "mean_ms": round(sum(values) / len(values), 3) if values else None,
+        "p50_ms": round(percentile(values, 50), 3) if values else None,
+        "p90_ms": round(percentile(values, 90), 3) if values else None,
+        "p99_ms": round(percentile(values, 99), 3) if values else None,
+        "max_ms": round(max(values), 3) if values else None,
+    }
+
+
+def load_app():
+    """import แอปใน process นี้ (สำหรับ micro-benchmark ไม่เปิด server)"""
+    os.environ.setdefault("OCR_CACHE_DB", "")
+    os.environ.setdefault("TRANSLATION_MEMORY_DB", "")
+    sys.path.insert(0, ROOT)
+    import app
+    return app
+
+
+def bench_enhance(corpus, repeat):
+    """เวลาของ enhance_manga_image (PIL) และ pipeline NumPy prepare_image_for_ocr ต่อภาพ"""
+    from PIL import Image
+    module = load_app()
+    translator = module.app
+
+    results = {}
+    for item in corpus:
+        with open(item["path"], "rb") as f:
+            image_bytes = f.read()
+        image = Image.open(item["path"])
+        image.load()
+
+        enhance = [timeit.timeit(lambda: translator.enhance_manga_image(image), number=1) for _ in range(repeat)]
+        prepare = [
+            timeit.timeit(lambda: module.prepare_image_for_ocr(image_bytes, None, item["is_manga"]), number=1)
+            for _ in range(repeat)
+        ]
+        results[os.path.basename(item["path"])] = {
+            "kind": item["kind"],
+            "size": [item["width"], item["height"]],
+            "enhance_manga_image": summarize_ms(enhance),
+            "prepare_image_for_ocr": summarize_ms(prepare),
+        }
+    return results
+
+
+def bench_detect(repeat):
+    """เวลาต่อการเรียก detect_language_advanced สำหรับข้อความสั้น/ยาว"""
+    from bench_detect_language import SAMPLES
+    translator = load_app().app
+
+    cases = dict(SAMPLES)
+    cases["webtoon_long"] = "\n".join(SAMPLES.values()) * 50
+    results = {}
+    for name, text in cases.items():
+        number = max(1, repeat // 10) if len(text) > 1000 else repeat
+        seconds = min(timeit.repeat(lambda: translator.detect_language_advanced(text), number=number, repeat=5))
+        results[name] = {
+            "chars": len(text),
+            "detected": translator.detect_language_advanced(text),
+            "us_per_call": round(seconds / number * 1e6, 3),
+            "calls_per_sec": round(number / seconds, 1),
+        }
+    return results
+
+
+def start_app_server(env, timeout=120, poll=0.25):
+    """รัน python app.py เป็น process แยก (ค่าเริ่มต้น APP_MODE=api) และรอจน /api/health ตอบ"""
+    env = dict(env)
+    env.setdefault("APP_MODE", "api")
+    env.setdefault("PORT", str(free_port()))
+    process = subprocess.Popen(
+        [sys.executable, "app.py"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    url = f"http://127.0.0.1:{env['API_PORT']}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app exited: {process.stderr.read().decode(errors='replace')[-2000:]}")
+        try:
+            if requests.get(url + "/api/health", timeout=1).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            time.sleep(poll)
+    process.kill()
+    raise RuntimeError("app did not become healthy in time")
+
+
+def stop_app_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run_load(url, payloads, concurrency, total):
+    """ยิง total request ด้วย concurrency thread คืน latency และผลลัพธ์ของแต่ละ request"""
+    local = threading.local()
+    counter = iter(range(total))
+    lock = threading.Lock()
+    samples = []
+
+    def worker():
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            started = time.perf_counter()
+            try:
+                response = session.post(url, json=payloads[index % len(payloads)], timeout=120)
+                status = response.status_code
+                error = response.json().get("error")
+            except (requests.RequestException, ValueError) as e:
+                status, error = None, type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples.append((elapsed, status, error))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - started
+    return samples, wall
+
+
+def bench_e2e(corpus, args):
+    standins = start_standins(behaviours_from_args(args))
+    workdir = tempfile.mkdtemp(prefix="bench-cache-")
+    env = dict(os.environ, **standins.env())
+    env.update({
+        "API_PORT": str(free_port()),
+        "SERVER_MODE": args.server_mode,
+        "WORKERS": str(args.workers),
+        "CPU_PROCESSES": str(args.cpu_processes),
+        "OCR_API_KEYS": args.ocr_keys,
+        "OCR_CACHE_DB": os.path.join(workdir, "ocr.db") if args.warm else "",
+        "TRANSLATION_MEMORY_DB": os.path.join(workdir, "tm.db") if args.warm else "",
+    })
+    if not args.warm:
+        # ทุก request ต้องผ่าน OCR/แปลจริง (ยกเว้นที่ถูกรวมด้วย single-flight)
+        env.update({"OCR_CACHE_SIZE": "0", "TRANSLATION_MEMORY_SIZE": "0"})
+
+    payloads = []
+    for item in corpus:
+        with open(item["path"], "rb") as f:
+            encoded = base64.b64encode(f.read()).decode()
+        mime = "image/png" if item["path"].endswith(".png") else "image/jpeg"
+        payloads.append({
+            "image": f"data:{mime};base64,{encoded}",
+            "target_lang": "th",
+            "is_manga": item["is_manga"],
+            "per_line": args.per_line,
+        })
+
+    process, base_url = start_app_server(env)
+    url = base_url + "/api/translate-with-overlay"
+    results = {}
+    try:
+        # warm-up: import/JIT ของ OpenCV และ connection pool
+        run_load(url, payloads, 1, min(len(payloads), 2))
+        for concurrency in args.concurrency:
+            requests.post(standins.base_url() + "/stats/reset", timeout=5)
+            samples, wall = run_load(url, payloads, concurrency, args.requests)
+            latencies = [elapsed for elapsed, _, _ in samples]
+            failures = sum(1 for _, status, error in samples if status != 200 or error)
+            statuses, errors = {}, {}
+            for _, status, error in samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if error:
+                    errors[error] = errors.get(error, 0) + 1
+            upstream = requests.get(standins.base_url() + "/stats", timeout=5).json()
+            results[str(concurrency)] = dict(
+                summarize_ms(latencies),
+                concurrency=concurrency,
+                wall_seconds=round(wall, 3),
+                throughput_rps=round(len(samples) / wall, 3) if wall else None,
+                error_rate=round(failures / len(samples), 4) if samples else None,
+                statuses=statuses,
+                errors=errors,
+                upstream_calls={name: {k: v for k, v in stats.items() if k != "behaviour"}
+                                for name, stats in upstream.items()},
+            )
+            print(f"  e2e c={concurrency:<3d} {results[str(concurrency)]['throughput_rps']:8.2f} req/s "
+                  f"p50={results[str(concurrency)]['p50_ms']}ms p99={results[str(concurrency)]['p99_ms']}ms "
+                  f"errors={failures}")
+    finally:
+        stop_app_server(process)
+        standins.shutdown()
+
+    return {
+        "server_mode": args.server_mode,
+        "workers": args.workers,
+        "cpu_processes": args.cpu_processes,
+        "warm": args.warm,
+        "per_line": args.per_line,
+        "requests_per_level": args.requests,
+        "providers": {name: behaviour.to_dict() for name, behaviour in standins.behaviours.items()},
+        "levels": results,
+    }
+
+
+def measure_import(env):
+    """เวลา import app (ไม่รวมเวลาเริ่ม interpreter) และโมดูลหนักที่ถูกโหลดตอน import"""
+    script = (
+        "import json, sys, time\n"
+        "started = time.perf_counter()\n"
+        "import app\n"
+        "elapsed = time.perf_counter() - started\n"
+        f"print(json.dumps([elapsed, [m for m in {HEAVY_MODULES!r} if m in sys.modules]]))\n"
+    )
+    output = subprocess.check_output([sys.executable, "-c", script], cwd=ROOT, env=env, stderr=subprocess.DEVNULL)
+    elapsed, loaded = json.loads(output.decode().strip().splitlines()[-1])
+    return elapsed, loaded
+
+
+def bench_startup(corpus, args):
+    """cold start ต่อโหมด: import, spawn จนถึง /api/health ตอบ และ request แรก/ที่สอง (แคชปิด)"""
+    standins = start_standins(behaviours_from_args(args))
+    base_env = dict(os.environ, **standins.env())
+    base_env.update({
+        "OCR_API_KEYS": args.ocr_keys,
+        "OCR_CACHE_DB": "",
+        "TRANSLATION_MEMORY_DB": "",
+        "PHASH_DB": "",
+        "IMAGE_CACHE_DIR": "",
+        "OCR_CACHE_SIZE": "0",
+        "TRANSLATION_MEMORY_SIZE": "0",
+    })
+    modes = {"api": {"APP_MODE": "api"}, "api_warmup": {"APP_MODE": "api", "WARMUP": "1"}}
+    if importlib.util.find_spec("gradio") is not None:
+        modes["full"] = {"APP_MODE": "full"}
+
+    payloads = []
+    for item in corpus[:2]:
+        with open(item["path"], "rb") as f:
+            payloads.append((f.read(), item))
+
+    results = {}
+    try:
+        for name, overrides in modes.items():
+            env = dict(base_env, **overrides)
+            imports, ready, first, second = [], [], [], []
+            loaded = []
+            for _ in range(args.startup_runs):
+                elapsed, loaded = measure_import(env)
+                imports.append(elapsed)
+
+                env["API_PORT"] = str(free_port())
+                started = time.perf_counter()
+                process, url = start_app_server(env, poll=0.01)
+                ready.append(time.perf_counter() - started)
+                try:
+                    for samples, (image_bytes, item) in zip((first, second), payloads):
+                        mime = "image/png" if item["path"].endswith(".png") else "image/jpeg"
+                        started = time.perf_counter()
+                        requests.post(
+                            url + "/api/translate-with-overlay",
+                            params={"target_lang": "th", "is_manga": int(item["is_manga"])},
+                            data=image_bytes, headers={"Content-Type": mime}, timeout=120
+                        ).raise_for_status()
+                        samples.append(time.perf_counter() - started)
+                finally:
+                    stop_app_server(process)
+
+            results[name] = {
+                "env": overrides,
+                "heavy_modules_on_import": loaded,
+                "import": summarize_ms(imports),
+                "ready": summarize_ms(ready),
+                "first_request": summarize_ms(first),
+                "second_request": summarize_ms(second),
+            }
+            print(f"  startup {name:<10s} import={results[name]['import']['p50_ms']}ms "
+                  f"ready={results[name]['ready']['p50_ms']}ms "
+                  f"first={results[name]['first_request']['p50_ms']}ms "
+                  f"second={results[name]['second_request']['p50_ms']}ms")
+    finally:
+        standins.shutdown()
+
+    return {
+        "runs": args.startup_runs,
+        "providers": {name: behaviour.to_dict() for name, behaviour in standins.behaviours.items()},
+        "modes": results,
+    }
+
+
+def metadata(args):
+    def git_revision():
+        try:
+            return subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+            ).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    import cv2
+    import numpy as np
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "args": {name: value for name, value in vars(args).items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", default=",".join(DRIVERS), help="driver ที่จะรัน คั่นด้วย ,")
+    parser.add_argument("--output", default=None, help="ไฟล์ JSON (ค่าเริ่มต้น benchmarks/results/<เวลา>.json)")
+    parser.add_argument("--corpus", default=DEFAULT_DIR)
+    parser.add_argument("--manga", type=int, default=8)
+    parser.add_argument("--webtoon", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=20, help="จำนวนรอบของ micro-benchmark")
+    parser.add_argument("--concurrency", type=lambda value: [int(v) for v in value.split(",")], default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=64, help="จำนวน request ต่อระดับ concurrency")
+    parser.add_argument("--server-mode", choices=["thread", "async"], default="thread")
+    parser.add_argument("--workers", type=int, default=1, help="WORKERS ของแอป (pre-fork)")
+    parser.add_argument("--cpu-processes", type=int, default=0, help="CPU_PROCESSES ของแอป (process pool ของงานภาพ)")
+    parser.add_argument("--warm", action="store_true", help="เปิด OCR cache และ translation memory (ค่าเริ่มต้นปิด)")
+    parser.add_argument("--per-line", action="store_true")
+    parser.add_argument("--startup-runs", type=int, default=3, help="จำนวนรอบของ startup driver ต่อโหมด")
+    parser.add_argument("--ocr-keys", default="bench-key-1:100000:0,bench-key-2:100000:0",
+                        help="OCR_API_KEYS ของแอประหว่าง benchmark (ค่าเริ่มต้นโควตาไม่จำกัด)")
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+
+    selected = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(selected) - set(DRIVERS)
+    if unknown:
+        parser.error(f"unknown driver: {', '.join(sorted(unknown))}")
+
+    corpus = generate_corpus(args.corpus, args.manga, args.webtoon)
+    report = {"meta": metadata(args), "results": {}}
+    if "enhance" in selected:
+        print("enhance_manga_image / prepare_image_for_ocr ...")
+        report["results"]["enhance"] = bench_enhance(corpus, args.repeat)
+    if "detect" in selected:
+        print("detect_language_advanced ...")
+        report["results"]["detect"] = bench_detect(args.repeat * 50)
+    if "e2e" in selected:
+        print("end-to-end /api/translate-with-overlay ...")
+        report["results"]["e2e"] = bench_e2e(corpus, args)
+    if "startup" in selected:
+        print("startup (import / ready / first request) ...")
+        report["results"]["startup"] = bench_startup(corpus, args)
+
+    output = args.output or os.path.join(BENCH_DIR, "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"results -> {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""Stand-in server ของ OCR.space / MyMemory / LibreTranslate สำหรับ benchmark และ load test
+
+จำลอง latency, error rate และ rate limit ได้ต่อ provider โดยไม่เรียก API จริง
+
+รัน: python benchmarks/standins.py --port 8900 --ocr-latency-ms 800 --latency-ms 150 --error-rate 0.02
+แล้วตั้ง env ของแอป:
+    OCR_SPACE_URL=http://127.0.0.1:8900/parse/image
+    MYMEMORY_URL=http://127.0.0.1:8900/get
+    LIBRETRANSLATE_URL=http://127.0.0.1:8900/translate
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PROVIDERS = ("ocr_space", "mymemory", "libretranslate")
+PATHS = {"/parse/image": "ocr_space", "/get": "mymemory", "/translate": "libretranslate"}
+ENV_NAMES = {"ocr_space": "OCR_SPACE_URL", "mymemory": "MYMEMORY_URL", "libretranslate": "LIBRETRANSLATE_URL"}
+
+# บรรทัดที่ OCR stand-in ตอบกลับ (เลือกตาม hash ของภาพ จึงได้ผลเดิมทุกครั้งสำหรับภาพเดิม)
+SAMPLE_LINES = [
+    "お前はもう死んでいる",
+    "俺の名前を言ってみろ！",
+    "나는 너를 사랑해",
+    "감사합니다, 정말 고마워요",
+    "WHAT ARE YOU DOING HERE?",
+    "I WON'T LOSE THIS TIME!",
+    "我们今天去哪里吃饭？",
+    "LET'S GO HOME.",
+]
+
+
+class ProviderBehaviour:
+    """พฤติกรรมของ provider หนึ่งตัว: latency (ms), สัดส่วน error และ rate limit ต่อ client (request/วินาที)"""
+
+    def __init__(self, latency_ms=100.0, jitter_ms=0.0, error_rate=0.0, rate_limit=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def delay(self):
+        return max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+
+    def allow(self, client):
+        """token bucket ต่อ client (burst = rate_limit)"""
+        if self.rate_limit <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(client, (self.rate_limit, now))
+            tokens = min(self.rate_limit, tokens + (now - updated) * self.rate_limit)
+            allowed = tokens >= 1
+            self._buckets[client] = (tokens - 1 if allowed else tokens, now)
+            return allowed
+
+    def to_dict(self):
+        return {"latency_ms": self.latency_ms, "jitter_ms": self.jitter_ms,
+                "error_rate": self.error_rate, "rate_limit": self.rate_limit}
+
+
+def ocr_space_result(image_bytes):
+    """ผลแบบ OCR.space (isOverlayRequired=true) ที่กำหนดจาก hash ของภาพ"""
+    digest = hashlib.sha256(image_bytes).digest()
+    count = 1 + digest[0] % 4
+    lines = []
+    top = 40
+    for index in range(count):
+        text = SAMPLE_LINES[digest[index + 1] % len(SAMPLE_LINES)]
+        words = []
+        left = 30 + digest[index + 5] % 200
+        for word in text.split():
+            width = 18 * len(word)
+            words.append({"WordText": word, "Left": left, "Top": top, "Height": 24, "Width": width})
+            left += width + 12
+        lines.append({"LineText": text, "Words": words, "MaxHeight": 24, "MinTop": top})
+        top += 60 + digest[index + 9] % 120
+    return {
+        "ParsedResults": [{
+            "TextOverlay": {"Lines": lines, "HasOverlay": True},
+            "FileParseExitCode": 1,
+            "ParsedText": "\r\n".join(line["LineText"] for line in lines) + "\r\n",
+            "ErrorMessage": "",
+        }],
+        "OCRExitCode": 1,
+        "IsErroredOnProcessing": False,
+    }
+
+
+def fake_translation(text, target_lang):
+    return f"[{target_lang}] {text}"
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _form(self, body):
+        """อ่าน multipart/form-data หรือ urlencoded คืน dict name -> bytes"""
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/"):
+            message = BytesParser(policy=HTTP).parsebytes(
+                b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+            )
+            return {
+                part.get_param("name", header="content-disposition"): part.get_payload(decode=True) or b""
+                for part in message.iter_parts()
+            }
+        return {name: values[0].encode() for name, values in parse_qs(body.decode()).items()}
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/stats":
+            return self._send(200, self.server.get_stats())
+        if url.path == "/get":
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            return self._handle("mymemory", self.client_address[0], lambda: {
+                "responseData": {
+                    "translatedText": fake_translation(query.get("q", ""), query.get("langpair", "|").split("|")[-1]),
+                    "match": 0.85,
+                },
+                "responseStatus": 200,
+            })
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self._body()
+        if path == "/parse/image":
+            form = self._form(body)
+            api_key = form.get("apikey", b"").decode() or self.client_address[0]
+            return self._handle("ocr_space", api_key, lambda: ocr_space_result(form.get("image", body)))
+        if path == "/translate":
+            payload = json.loads(body or b"{}")
+            return self._handle("libretranslate", self.client_address[0], lambda: {
+                "translatedText": fake_translation(payload.get("q", ""), payload.get("target", ""))
+            })
+        if path == "/stats/reset":
+            self.server.reset_stats()
+            return self._send(200, {"success": True})
+        self._send(404, {"error": "not found"})
+
+    def _handle(self, provider, client, build):
+        behaviour = self.server.behaviours[provider]
+        time.sleep(behaviour.delay())
+        if not behaviour.allow(client):
+            self.server.count(provider, "rate_limited")
+            # OCR.space ตอบ 403 เมื่อเกินโควตา, API แปลภาษาตอบ 429
+            status = 403 if provider == "ocr_space" else 429
+            return self._send(status, {"error": "rate limit exceeded"})
+        if random.random() < behaviour.error_rate:
+            self.server.count(provider, "errors")
+            return self._send(500, {"error": "simulated upstream error"})
+        self.server.count(provider, "ok")
+        self._send(200, build())
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, behaviours):
+        super().__init__(address, StandinHandler)
+        self.behaviours = behaviours
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def count(self, provider, outcome):
+        with self._lock:
+            self.stats[provider][outcome] += 1
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {provider: {"ok": 0, "errors": 0, "rate_limited": 0} for provider in PROVIDERS}
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                provider: dict(counts, behaviour=self.behaviours[provider].to_dict())
+                for provider, counts in self.stats.items()
+            }
+
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{'127.0.0.1' if host in ('0.0.0.0', '') else host}:{port}"
+
+    def env(self):
+        """env ของแอปที่ชี้ provider ทั้งสามมาที่ server นี้"""
+        base = self.base_url()
+        return {ENV_NAMES[provider]: base + path for path, provider in PATHS.items()}
+
+
+def start_standins(behaviours, host="127.0.0.1", port=0):
+    """เปิด stand-in server ใน background thread (port=0 = สุ่ม port ว่าง)"""
+    server = StandinServer((host, port), behaviours)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def behaviours_from_args(args):
+    """แปลง argument เป็น ProviderBehaviour ต่อ provider (ค่าเฉพาะ OCR ใช้แทนค่ารวมถ้ากำหนด)"""
+    def pick(specific, general):
+        return general if specific is None else specific
+
+    translate = dict(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                     error_rate=args.error_rate, rate_limit=args.rate_limit)
+    ocr = dict(
+        latency_ms=pick(args.ocr_latency_ms, args.latency_ms),
+        jitter_ms=pick(args.ocr_jitter_ms, args.jitter_ms),
+        error_rate=pick(args.ocr_error_rate, args.error_rate),
+        rate_limit=pick(args.ocr_rate_limit, args.rate_limit),
+    )
+    return {
+        "ocr_space": ProviderBehaviour(**ocr),
+        "mymemory": ProviderBehaviour(**translate),
+        "libretranslate": ProviderBehaviour(**translate),
+    }
+
+
+def add_behaviour_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="latency ของ API แปลภาษา")
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="สัดส่วน HTTP 500 (0-1)")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="request/วินาที ต่อ client (0 = ไม่จำกัด)")
+    parser.add_argument("--ocr-latency-ms", type=float, default=800.0)
+    parser.add_argument("--ocr-jitter-ms", type=float, default=200.0)
+    parser.add_argument("--ocr-error-rate", type=float, default=None)
+    parser.add_argument("--ocr-rate-limit", type=float, default=None, help="request/วินาที ต่อ API key")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+
+    server = StandinServer((args.host, args.port), behaviours_from_args(args))
+    for name, url in server.env().items():
+        print(f"{name}={url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()